@@ -1,54 +1,25 @@
 import json
 import re
+import threading
+import time
+from collections import deque
 from datetime import datetime, timedelta
 
-from openai import OpenAI
+from app.services.llm_metrics import record_llm_call
+from app.services.llm_provider import get_provider
+from app.services.llm_router import FAST_ROUTE, model_router
 
-# 初始化OpenAI客户端
-client = OpenAI(
-    api_key="sk-9faaade8e44b4b7e8f0f8ee2f093de46", base_url="https://api.deepseek.com"
-)
+# 客户端由 provider 按配置创建（LLM_PROVIDER / DEEPSEEK_* / LOCAL_LLM_*），
+# 导入本模块不会建立任何连接
 
+# 分析提示词版本号：修改分析提示词或解析逻辑时需递增，使旧的缓存结果失效
+ANALYSIS_PROMPT_VERSION = "2"
 
-def analyze_email(email_content, sender=None, subject=None, recipients=None):
-    """
-    Analyze email content to detect spam and extract multiple schedule events.
+# ============================================================
+# 静态提示词：不含任何随调用变化的内容，作为字节稳定的前缀
+# ============================================================
+ANALYSIS_SYSTEM_PROMPT = """You are a professional email management assistant. Analyze emails and return structured JSON output.
 
-    Returns:
-    {
-      success: boolean,
-      data: {
-        is_spam: boolean,
-        summary: string,
-        has_schedule: boolean,
-        events: [
-          {
-            name: string,
-            date: string,
-            start_time: string,
-            end_time: string,
-            location: string,
-            participants: string
-          }
-        ]
-      },
-      message?: string
-    }
-    """
-    # Get current date and time information
-    now = datetime.now()
-    current_date = now.strftime("%Y-%m-%d")
-    current_time = now.strftime("%H:%M")
-    day_of_week = now.strftime("%A")  # Monday, Tuesday, etc.
-
-    date_context = f"""Current Date and Time Information:
-- Date: {current_date}
-- Time: {current_time}
-- Day of Week: {day_of_week}
-
-Use this information to accurately interpret relative dates like "today", "tomorrow", "next week", etc."""
-
-    task_description = """
 Tasks:
 1. Detect spam/advertisements
 2. Provide email summary (or spam detection reason if spam)
@@ -83,43 +54,339 @@ Rules:
 - Empty fields: use empty string "", NOT null or "None"
 - Multiple events: list all in the events array"""
 
-    system_prompt = (
-        "You are a professional email management assistant. Analyze emails and return structured JSON output.\n\n"
-        + date_context
-        + task_description
-    )
+GENERATION_SYSTEM_PROMPT = """You are a professional email writing assistant. Your task is to generate a complete email based on brief information provided by the user.
 
-    # Build user message
-    user_message = "Please analyze the following email:\n"
-    if subject:
-        user_message += f"Subject: {subject}\n"
-    if sender:
-        user_message += f"Sender: {sender}\n"
-    if recipients:
-        user_message += f"Recipients: {recipients}\n"
-    user_message += f"Content: {email_content}"
+Requirements:
+1. Generate a clear and appropriate email subject
+2. Write a complete, well-structured email body
+3. Adapt the tone based on the user's requirement (professional, casual, formal, etc.)
+4. Include appropriate greetings and closing
+5. Make the email coherent and easy to understand
+6. If the brief mentions an event (meeting, call, deadline, etc.), state its date, time and location clearly in the email, resolving relative dates with the current date given below
+
+Please respond in the following format:
+【Email Subject】：Generated email subject
+【Email Content】：Complete email content with proper formatting
+【Event Details】：A single-line JSON object for the main event mentioned in the brief: {"title": "...", "date": "YYYY-MM-DD", "start_time": "HH:MM", "end_time": "HH:MM", "location": "..."} (omit unknown fields), or none if there is no event"""
+
+MERGE_TEMPLATE_INSTRUCTIONS = """
+
+Mail-merge mode:
+- The email will be sent to many recipients, so write ONE template that works for all of them.
+- Use the placeholder {{first_name}} in the greeting, and {{name}} or {{company}} wherever a personal reference reads naturally; write placeholders exactly with double braces.
+- Do not invent recipient-specific details; everything outside the placeholders must be correct for every recipient."""
+
+MERGE_REFINE_SYSTEM_PROMPT = """You personalize mail-merge emails. Each recipient in the user message already has a rendered email; adapt it lightly using that recipient's notes.
+
+Rules:
+- Keep the meaning, facts, dates, times, links, greeting and sign-off unchanged
+- Only add or adjust a sentence or two where the notes make it natural; if the notes add nothing useful, return the email unchanged
+- Never quote or mention the notes themselves
+- Respond with a JSON object of the form {"results": [{"recipient_id": "<id>", "subject": "...", "content": "..."}]}
+- Include exactly one entry per recipient id and copy the id verbatim"""
+
+# 批量分析：单个请求的输入 token 预算与最大邮件数
+DEFAULT_BATCH_TOKEN_BUDGET = 6000
+DEFAULT_BATCH_MAX_EMAILS = 10
+
+BATCH_ANALYSIS_INSTRUCTIONS = """
+
+Batch mode:
+- The user message contains several emails, each introduced by a line "=== Message ID: <id> ===".
+- Analyze every email independently using the rules above.
+- Respond with a JSON object of the form {"results": [{"message_id": "<id>", "is_spam": false, "summary": "...", "has_schedule": false, "events": []}]}
+- Include exactly one entry per message id and copy the id verbatim."""
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def analyze_email(email_content, sender=None, subject=None, recipients=None):
+    """
+    Analyze email content to detect spam and extract multiple schedule events.
+
+    Returns:
+    {
+      success: boolean,
+      data: {
+        is_spam: boolean,
+        summary: string,
+        has_schedule: boolean,
+        events: [
+          {
+            name: string,
+            date: string,
+            start_time: string,
+            end_time: string,
+            location: string,
+            participants: string
+          }
+        ]
+      },
+      message?: string
+    }
+    """
+    messages = _build_analysis_messages(email_content, sender, subject, recipients)
+    route = model_router.route_analysis(email_content, sender, estimate_tokens(messages[-1]["content"]))
+
+    result = _analyze_on_route(route, messages, sender)
+    if not result["success"] and route.name == FAST_ROUTE:
+        # 快速模型输出未通过校验，换完整模型重试一次
+        model_router.record_fallback("analysis")
+        result = _analyze_on_route(model_router.full_route, messages, sender)
+    return result
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_message},
-    ]
 
+def _analyze_on_route(route, messages, sender=None):
+    started = time.monotonic()
     try:
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=messages,
+        response = get_provider(route.provider).complete(
+            messages,
+            operation="analysis",
             response_format={"type": "json_object"},
-            stream=False,
+            **_route_kwargs(route),
         )
-
         result_text = response.choices[0].message.content
-        return parse_json_response(result_text)
+    except Exception as e:
+        error_message = f"Analysis failed: {e}"
+        print(error_message)
+        _observe_call(route, "analysis", started, error=e)
+        return {"success": False, "data": None, "message": error_message}
+
+    result = parse_json_response(result_text)
+    result["usage"] = _record_usage("analysis", response)
+    _observe_call(route, "analysis", started, result["usage"], valid=result["success"], sender=sender)
+    return result
+
+
+async def analyze_email_async(email_content, sender=None, subject=None, recipients=None):
+    """
+    Async counterpart of analyze_email, used by the concurrent email processor.
+
+    Returns the same structure as analyze_email.
+    """
+    messages = _build_analysis_messages(email_content, sender, subject, recipients)
+    route = model_router.route_analysis(email_content, sender, estimate_tokens(messages[-1]["content"]))
+
+    result = await _analyze_on_route_async(route, messages, sender)
+    if not result["success"] and route.name == FAST_ROUTE:
+        model_router.record_fallback("analysis")
+        result = await _analyze_on_route_async(model_router.full_route, messages, sender)
+    return result
+
 
+async def _analyze_on_route_async(route, messages, sender=None):
+    started = time.monotonic()
+    try:
+        response = await get_provider(route.provider).acomplete(
+            messages,
+            operation="analysis",
+            response_format={"type": "json_object"},
+            **_route_kwargs(route),
+        )
+        result_text = response.choices[0].message.content
     except Exception as e:
         error_message = f"Analysis failed: {e}"
         print(error_message)
+        _observe_call(route, "analysis", started, error=e)
         return {"success": False, "data": None, "message": error_message}
 
+    result = parse_json_response(result_text)
+    result["usage"] = _record_usage("analysis", response)
+    _observe_call(route, "analysis", started, result["usage"], valid=result["success"], sender=sender)
+    return result
+
+
+def _observe_call(route, operation, started, usage=None, valid=True, error=None, sender=None):
+    """记录一次 LLM 调用：路由统计与调用指标（耗时、token、结果、解析是否成功）"""
+    seconds = time.monotonic() - started
+    model = route.model or get_provider(route.provider).model
+    if error is not None:
+        model_router.record(route, operation, seconds, usage, False)
+        record_llm_call(operation, model, seconds, usage, outcome=type(error).__name__)
+        return
+    model_router.record(route, operation, seconds, usage, valid, sender)
+    record_llm_call(operation, model, seconds, usage, outcome="ok", parse_ok=valid)
+
+
+def _route_kwargs(route):
+    """路由指定了模型时覆盖 provider 的默认模型"""
+    return {"model": route.model} if route.model else {}
+
+
+def analyze_email_batch(
+    emails,
+    max_batch_tokens=DEFAULT_BATCH_TOKEN_BUDGET,
+    max_batch_emails=DEFAULT_BATCH_MAX_EMAILS,
+):
+    """
+    Analyze several emails with as few requests as possible.
+
+    Input: a list of {id, content, sender?, subject?, recipients?} dicts.
+    Emails are packed into requests under ``max_batch_tokens`` and the model
+    answers with one JSON entry per message id. Entries that are missing or
+    fail to parse are split off and retried in smaller batches, down to a
+    single analyze_email call.
+
+    Returns: {str(id): <same structure as analyze_email>}
+    """
+    results = {}
+    for batch in pack_email_batches(emails, max_batch_tokens, max_batch_emails):
+        results.update(_analyze_batch_with_split(batch))
+    return results
+
+
+def pack_email_batches(
+    emails,
+    max_batch_tokens=DEFAULT_BATCH_TOKEN_BUDGET,
+    max_batch_emails=DEFAULT_BATCH_MAX_EMAILS,
+):
+    """按 token 预算将邮件依次打包成批次；超出预算的单封邮件独占一批"""
+    batches = []
+    current = []
+    current_tokens = 0
+    for item in emails:
+        tokens = estimate_tokens(
+            _format_email_block(
+                item.get("content", ""),
+                item.get("sender"),
+                item.get("subject"),
+                item.get("recipients"),
+            )
+        )
+        if current and (
+            current_tokens + tokens > max_batch_tokens
+            or len(current) >= max_batch_emails
+        ):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def estimate_tokens(text):
+    """
+    粗略估算文本的 token 数（不依赖分词器）：
+    中日韩字符约 1 个 token，其余字符约 4 个一个 token
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _analyze_batch_with_split(batch):
+    if len(batch) == 1:
+        item = batch[0]
+        return {
+            str(item["id"]): analyze_email(
+                item.get("content", ""),
+                sender=item.get("sender"),
+                subject=item.get("subject"),
+                recipients=item.get("recipients"),
+            )
+        }
+
+    results = _request_batch_analysis(batch)
+    failed = [item for item in batch if not results.get(str(item["id"]), {}).get("success")]
+    if failed:
+        print(f"Batch analysis: retrying {len(failed)}/{len(batch)} emails in smaller batches")
+        half = (len(failed) + 1) // 2
+        for part in (failed[:half], failed[half:]):
+            if part:
+                results.update(_analyze_batch_with_split(part))
+    return results
+
+
+def _request_batch_analysis(batch):
+    """发送一次批量分析请求，只返回解析成功的条目"""
+    user_message = "Please analyze the following emails:\n"
+    for item in batch:
+        user_message += f"\n=== Message ID: {item['id']} ===\n"
+        user_message += _format_email_block(
+            item.get("content", ""),
+            item.get("sender"),
+            item.get("subject"),
+            item.get("recipients"),
+        )
+        user_message += "\n"
+
+    messages = [
+        {
+            "role": "system",
+            "content": build_system_prompt(ANALYSIS_SYSTEM_PROMPT + BATCH_ANALYSIS_INSTRUCTIONS),
+        },
+        {"role": "user", "content": user_message},
+    ]
+
+    route = model_router.full_route
+    started = time.monotonic()
+    try:
+        response = get_provider().complete(
+            messages,
+            operation="analysis_batch",
+            response_format={"type": "json_object"},
+        )
+        result_text = response.choices[0].message.content
+    except Exception as e:
+        print(f"Batch analysis failed: {e}")
+        _observe_call(route, "analysis_batch", started, error=e)
+        return {}
+
+    usage = _record_usage("analysis_batch", response)
+    try:
+        data = _load_json_object(result_text)
+    except Exception as e:
+        print(f"Batch analysis failed: {e}")
+        _observe_call(route, "analysis_batch", started, usage, valid=False)
+        return {}
+    _observe_call(route, "analysis_batch", started, usage)
+
+    entries = data.get("results", []) if isinstance(data, dict) else []
+    if isinstance(entries, dict):
+        entries = [dict(v, message_id=k) for k, v in entries.items() if isinstance(v, dict)]
+
+    expected_ids = {str(item["id"]) for item in batch}
+    results = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        message_id = str(entry.get("message_id", ""))
+        if message_id not in expected_ids:
+            continue
+        try:
+            results[message_id] = _convert_analysis_data(entry)
+        except Exception as e:
+            print(f"Failed to parse batch entry {message_id}: {e}")
+    return results
+
+
+def _build_analysis_messages(email_content, sender=None, subject=None, recipients=None):
+    """构建邮件分析的提示词消息"""
+    user_message = "Please analyze the following email:\n" + _format_email_block(
+        email_content, sender, subject, recipients
+    )
+    return [
+        {"role": "system", "content": build_system_prompt(ANALYSIS_SYSTEM_PROMPT)},
+        {"role": "user", "content": user_message},
+    ]
+
+
+def _format_email_block(email_content, sender=None, subject=None, recipients=None):
+    """格式化单封邮件的头部与正文"""
+    block = ""
+    if subject:
+        block += f"Subject: {subject}\n"
+    if sender:
+        block += f"Sender: {sender}\n"
+    if recipients:
+        block += f"Recipients: {recipients}\n"
+    block += f"Content: {email_content}"
+    return block
+
 
 def generate_email(
     brief_info, sender_name=None, recipient_name=None, tone="professional"
@@ -141,143 +408,376 @@ def generate_email(
       data: {
         subject: string;        // 生成的邮件主题
         content: string;        // 生成的完整邮件内容
+        event: object | null;   // 同一次响应中提取的事件信息（title/date/start_time/end_time/location）
       };
       message?: string;         // 错误信息
     }
     """
-    # Get current date and time information
-    now = datetime.now()
-    current_date = now.strftime("%Y-%m-%d")
-    current_time = now.strftime("%H:%M")
-    day_of_week = now.strftime("%A")  # Monday, Tuesday, etc.
+    messages = _build_generation_messages(brief_info, sender_name, recipient_name, tone)
+    route = model_router.route_generation(estimate_tokens(brief_info))
 
-    # ============================================================
-    # 构建邮件生成提示词：动态部分 + 静态部分
-    # ============================================================
-    date_context = f"""Current Date and Time Information:
-- Date: {current_date}
-- Time: {current_time}
-- Day of Week: {day_of_week}
+    result = _generate_on_route(route, messages)
+    if not _is_valid_generation(result) and route.name == FAST_ROUTE:
+        model_router.record_fallback("generation")
+        result = _generate_on_route(model_router.full_route, messages)
+    return result
 
-Use this information when the user mentions relative dates like "today", "tomorrow", "next week", etc."""
 
-    task_requirements = """
-Requirements:
-1. Generate a clear and appropriate email subject
-2. Write a complete, well-structured email body
-3. Adapt the tone based on the user's requirement (professional, casual, formal, etc.)
-4. Include appropriate greetings and closing
-5. Make the email coherent and easy to understand
+def _generate_on_route(route, messages, operation="generation"):
+    started = time.monotonic()
+    try:
+        response = get_provider(route.provider).complete(
+            messages, operation=operation, **_route_kwargs(route)
+        )
+        result_text = response.choices[0].message.content
+    except Exception as e:
+        error_message = f"Email generation failed: {e}"
+        print(error_message)
+        _observe_call(route, operation, started, error=e)
+        return {"success": False, "data": None, "message": error_message}
 
-Please respond in the following format:
-【Email Subject】：Generated email subject
-【Email Content】：Complete email content with proper formatting"""
+    result = parse_email_generation_response(result_text)
+    result["usage"] = _record_usage(operation, response)
+    _observe_call(route, operation, started, result["usage"], valid=_is_valid_generation(result))
+    return result
 
-    system_prompt = (
-        "You are a professional email writing assistant. Your task is to generate a complete email based on brief information provided by the user.\n\n"
-        + date_context
-        + "\n"
-        + task_requirements
-    )
 
-    # Build user message
-    user_message = f"Please generate an email based on the following information:\n"
-    user_message += f"Brief information: {brief_info}\n"
-    if sender_name:
-        user_message += f"Sender name: {sender_name}\n"
-    if recipient_name:
-        user_message += f"Recipient name: {recipient_name}\n"
-    user_message += f"Tone: {tone}\n"
+def _is_valid_generation(result):
+    data = result.get("data") or {}
+    return bool(result.get("success") and data.get("subject") and data.get("content"))
+
+
+def generate_email_template(brief_info, sender_name=None, tone="professional"):
+    """
+    邮件合并：一次调用生成带 {{first_name}} / {{name}} / {{company}} 占位符的模板，
+    由调用方按收件人在本地渲染。输出结构与 generate_email 相同。
+    """
+    messages = _build_generation_messages(brief_info, sender_name, None, tone)
+    messages[0]["content"] = build_system_prompt(GENERATION_SYSTEM_PROMPT + MERGE_TEMPLATE_INSTRUCTIONS)
+    # 模板会发给所有收件人，始终使用完整模型
+    return _generate_on_route(model_router.full_route, messages, operation="merge_template")
+
+
+async def refine_merge_batch_async(items, tone="professional"):
+    """
+    按收件人备注微调一批已渲染的邮件，一个请求处理整批。
+
+    items: [{"id", "subject", "content", "name", "company", "notes"}]
+    返回 {id: {"subject", "content"}}，只包含解析成功的条目；失败时返回空 dict，
+    调用方保留本地渲染结果。
+    """
+    user_message = f"Tone: {tone}\nPlease personalize the following emails:\n"
+    for item in items:
+        user_message += f"\n=== Recipient ID: {item['id']} ===\n"
+        user_message += f"Name: {item.get('name') or ''}\n"
+        if item.get("company"):
+            user_message += f"Company: {item['company']}\n"
+        user_message += f"Notes: {item.get('notes') or ''}\n"
+        user_message += f"Subject: {item.get('subject') or ''}\n"
+        user_message += f"Content:\n{item.get('content') or ''}\n"
 
     messages = [
-        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": build_system_prompt(MERGE_REFINE_SYSTEM_PROMPT)},
         {"role": "user", "content": user_message},
     ]
 
+    route = model_router.full_route
+    started = time.monotonic()
     try:
-        response = client.chat.completions.create(
-            model="deepseek-chat", messages=messages, stream=False
+        response = await get_provider().acomplete(
+            messages,
+            operation="merge_refine",
+            response_format={"type": "json_object"},
         )
-
         result_text = response.choices[0].message.content
-        return parse_email_generation_response(result_text)
+    except Exception as e:
+        print(f"Mail-merge refinement failed: {e}")
+        _observe_call(route, "merge_refine", started, error=e)
+        return {}
+
+    usage = _record_usage("merge_refine", response)
+    try:
+        data = _load_json_object(result_text)
+    except Exception as e:
+        print(f"Mail-merge refinement failed: {e}")
+        _observe_call(route, "merge_refine", started, usage, valid=False)
+        return {}
+    _observe_call(route, "merge_refine", started, usage)
+
+    entries = data.get("results", []) if isinstance(data, dict) else []
+    expected_ids = {str(item["id"]) for item in items}
+    results = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        recipient_id = str(entry.get("recipient_id", ""))
+        content = entry.get("content")
+        if recipient_id in expected_ids and isinstance(content, str) and content.strip():
+            results[recipient_id] = {"subject": entry.get("subject") or "", "content": content.strip()}
+    return results
+
+
+def generate_email_stream(
+    brief_info, sender_name=None, recipient_name=None, tone="professional"
+):
+    """
+    流式生成邮件，边生成边解析。
+
+    依次产出 (event, payload)：
+      ("subject", str)   主题完整后立即产出一次
+      ("delta", str)     正文增量
+      ("done", {subject, content, event, usage})  生成结束，附完整结果
+      ("error", str)     调用失败
+    """
+    messages = _build_generation_messages(brief_info, sender_name, recipient_name, tone)
+    # 流式输出已发给客户端，无法再回退到完整模型，只按路由选择一次
+    route = model_router.route_generation(estimate_tokens(brief_info))
+    parser = EmailStreamParser()
+    usage = None
+    started = time.monotonic()
+
+    try:
+        stream = get_provider(route.provider).stream(
+            messages,
+            operation="generation",
+            stream_options={"include_usage": True},
+            **_route_kwargs(route),
+        )
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = _record_usage("generation", chunk)
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                yield from parser.feed(text)
+
+        yield from parser.finish()
+        _observe_call(route, "generation", started, usage, valid=bool(parser.subject and parser.content))
+        yield "done", {
+            "subject": parser.subject,
+            "content": parser.content,
+            "event": parser.event,
+            "usage": usage,
+        }
 
     except Exception as e:
         error_message = f"Email generation failed: {e}"
         print(error_message)
-        return {"success": False, "data": None, "message": error_message}
+        _observe_call(route, "generation", started, usage, error=e)
+        yield "error", error_message
 
 
-def parse_json_response(response_text):
-    """Parse JSON response from DeepSeek API and convert to internal format"""
-    try:
-        text = response_text.strip()
+class EmailStreamParser:
+    """
+    增量解析【Email Subject】/【Email Content】格式的流式输出。
 
-        # 尝试直接解析
-        try:
-            data = json.loads(text)
-        except json.JSONDecodeError:
-            # 如果失败，尝试提取 JSON 块（匹配第一个 { 到最后一个 }）
-            json_match = re.search(r"\{.*\}", text, re.DOTALL)
-            if json_match:
-                data = json.loads(json_match.group(0))
-            else:
-                raise ValueError("No valid JSON found in response")
+    主题在遇到换行或正文标记时即视为完整；正文到下一个【标记为止，
+    与 parse_email_generation_response 的规则一致。正文之后的【Event Details】
+    不会作为增量产出，流结束时解析到 event。
+    """
+
+    _SUBJECT_MARKER = re.compile(r"【Email Subject】[：:]")
+    _CONTENT_MARKER = re.compile(r"【Email Content】[：:]")
 
-        is_spam = data.get("is_spam", False)
-        summary = data.get("summary", "")
-        has_schedule = data.get("has_schedule", False)
-        events_raw = data.get("events", [])
+    def __init__(self):
+        self._buffer = ""
+        self._raw = ""
+        self._state = "preamble"
+        self.subject = ""
+        self.content = ""
+        self.event = None
 
+    def feed(self, text):
+        self._raw += text
+        self._buffer += text
         events = []
-        for event_raw in events_raw:
-            event_name = event_raw.get("name", "")
-            date_str = event_raw.get("date", "")
-            start_time_str = event_raw.get("start_time", "")
-            end_time_str = event_raw.get("end_time", "")
-            location = event_raw.get("location", "")
-            participants = event_raw.get("participants", "")
-
-            event_date = parse_date_from_string(date_str)
-            if not event_date:
-                event_date = datetime.now().date()
-
-            start_time = None
-            if start_time_str:
-                try:
-                    time_part = datetime.strptime(start_time_str, "%H:%M").time()
-                    start_time = datetime.combine(event_date, time_part)
-                except ValueError:
-                    pass
-
-            end_time = None
-            if end_time_str:
-                try:
-                    time_part = datetime.strptime(end_time_str, "%H:%M").time()
-                    end_time = datetime.combine(event_date, time_part)
-                except ValueError:
-                    pass
-
-            if event_name or start_time:
-                events.append(
-                    {
-                        "event_name": event_name,
-                        "start_time": start_time,
-                        "end_time": end_time,
-                        "location": location,
-                        "participants": participants,
-                    }
+        while True:
+            if self._state == "preamble":
+                match = self._SUBJECT_MARKER.search(self._buffer)
+                if not match:
+                    break
+                self._buffer = self._buffer[match.end():]
+                self._state = "subject"
+            elif self._state == "subject":
+                self._buffer = self._buffer.lstrip()
+                end = min(
+                    (i for i in (self._buffer.find("\n"), self._buffer.find("【")) if i >= 0),
+                    default=-1,
                 )
+                if end < 0:
+                    break
+                self.subject = self._buffer[:end].strip()
+                self._buffer = self._buffer[end:]
+                self._state = "between"
+                events.append(("subject", self.subject))
+            elif self._state == "between":
+                match = self._CONTENT_MARKER.search(self._buffer)
+                if not match:
+                    break
+                self._buffer = self._buffer[match.end():]
+                self._state = "content"
+            elif self._state == "content":
+                if not self.content:
+                    self._buffer = self._buffer.lstrip()
+                end = self._buffer.find("【")
+                delta = self._buffer if end < 0 else self._buffer[:end]
+                self._buffer = ""
+                if end >= 0:
+                    self._state = "finished"
+                if delta:
+                    self.content += delta
+                    events.append(("delta", delta))
+                break
+            else:
+                self._buffer = ""
+                break
+        return events
 
-        return {
-            "success": True,
-            "data": {
-                "is_spam": is_spam,
-                "judge_reason": summary,
-                "is_schedule": has_schedule and len(events) > 0,
-                "events": events,
-            },
-        }
+    def finish(self):
+        """流结束时调用：标记缺失时退回整段解析，补发尚未产出的部分"""
+        events = []
+        if self._state in ("preamble", "subject", "between"):
+            fallback = parse_email_generation_response(self._raw)
+            data = fallback.get("data") or {}
+            if not self.subject and data.get("subject"):
+                self.subject = data["subject"]
+                events.append(("subject", self.subject))
+            if data.get("content"):
+                self.content = data["content"]
+                events.append(("delta", self.content))
+        self.content = self.content.strip()
+        self.event = parse_event_details(self._raw)
+        self._state = "finished"
+        return events
+
+
+def _build_generation_messages(brief_info, sender_name=None, recipient_name=None, tone="professional"):
+    """构建邮件生成的提示词消息"""
+    user_message = f"Please generate an email based on the following information:\n"
+    user_message += f"Brief information: {brief_info}\n"
+    if sender_name:
+        user_message += f"Sender name: {sender_name}\n"
+    if recipient_name:
+        user_message += f"Recipient name: {recipient_name}\n"
+    user_message += f"Tone: {tone}\n"
+
+    return [
+        {"role": "system", "content": build_system_prompt(GENERATION_SYSTEM_PROMPT)},
+        {"role": "user", "content": user_message},
+    ]
+
+
+def build_system_prompt(static_prefix, now=None):
+    """
+    拼接系统提示词：静态指令在前，日期上下文在末尾。
+
+    静态部分逐字节不变，服务商的前缀缓存才能在每次调用时命中；
+    当前日期时间每分钟都在变化，只能放在最后。
+    """
+    return static_prefix + "\n\n" + _build_date_context(now)
+
+
+def _build_date_context(now=None):
+    # Get current date and time information
+    now = now or datetime.now()
+    current_date = now.strftime("%Y-%m-%d")
+    current_time = now.strftime("%H:%M")
+    day_of_week = now.strftime("%A")  # Monday, Tuesday, etc.
+
+    return f"""Current Date and Time Information:
+- Date: {current_date}
+- Time: {current_time}
+- Day of Week: {day_of_week}
+
+Use this information to accurately interpret relative dates like "today", "tomorrow", "next week", etc."""
+
+
+def extract_usage(response):
+    """
+    读取响应中的 token 用量，兼容 DeepSeek（prompt_cache_hit_tokens）
+    与 OpenAI（prompt_tokens_details.cached_tokens）两种缓存字段
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    cached_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+    if cached_tokens is None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) if details else None
+    cached_tokens = cached_tokens or 0
+
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "total_tokens": getattr(usage, "total_tokens", 0) or 0,
+        "cached_tokens": cached_tokens,
+        "cache_hit_rate": round(cached_tokens / prompt_tokens, 4) if prompt_tokens else 0.0,
+    }
+
+
+class PromptCacheStats:
+    """按提示词类型累计前缀缓存命中情况（线程安全），并保留最近若干次调用的滑动窗口"""
+
+    def __init__(self, window=100):
+        self._lock = threading.Lock()
+        self._window = window
+        self._totals = {}
+        self._recent = {}
+
+    def record(self, prompt_type, usage):
+        if not usage:
+            return
+        with self._lock:
+            totals = self._totals.setdefault(
+                prompt_type, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0}
+            )
+            totals["calls"] += 1
+            totals["prompt_tokens"] += usage["prompt_tokens"]
+            totals["cached_tokens"] += usage["cached_tokens"]
+            recent = self._recent.setdefault(prompt_type, deque(maxlen=self._window))
+            recent.append((usage["prompt_tokens"], usage["cached_tokens"]))
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for prompt_type, totals in self._totals.items():
+                recent = self._recent.get(prompt_type, ())
+                recent_prompt = sum(p for p, _ in recent)
+                recent_cached = sum(c for _, c in recent)
+                result[prompt_type] = dict(
+                    totals,
+                    hit_rate=round(totals["cached_tokens"] / totals["prompt_tokens"], 4)
+                    if totals["prompt_tokens"]
+                    else 0.0,
+                    recent_hit_rate=round(recent_cached / recent_prompt, 4)
+                    if recent_prompt
+                    else 0.0,
+                )
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+            self._recent.clear()
+
+
+prompt_cache_stats = PromptCacheStats()
+
+
+def _record_usage(prompt_type, response):
+    usage = extract_usage(response)
+    prompt_cache_stats.record(prompt_type, usage)
+    return usage
+
+
+def parse_json_response(response_text):
+    """Parse JSON response from DeepSeek API and convert to internal format"""
+    try:
+        data = _load_json_object(response_text)
+        return _convert_analysis_data(data)
 
     except json.JSONDecodeError as e:
         error_message = f"Failed to parse JSON response: {e}"
@@ -289,6 +789,79 @@ def parse_json_response(response_text):
         return {"success": False, "data": None, "message": error_message}
 
 
+def _load_json_object(response_text):
+    """从模型输出中提取 JSON 对象"""
+    text = response_text.strip()
+
+    # 尝试直接解析
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        # 如果失败，尝试提取 JSON 块（匹配第一个 { 到最后一个 }）
+        json_match = re.search(r"\{.*\}", text, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group(0))
+        raise ValueError("No valid JSON found in response")
+
+
+def _convert_analysis_data(data):
+    """将单封邮件的分析 JSON 转换为内部格式"""
+    is_spam = data.get("is_spam", False)
+    summary = data.get("summary", "")
+    has_schedule = data.get("has_schedule", False)
+    events_raw = data.get("events", [])
+
+    events = []
+    for event_raw in events_raw:
+        event_name = event_raw.get("name", "")
+        date_str = event_raw.get("date", "")
+        start_time_str = event_raw.get("start_time", "")
+        end_time_str = event_raw.get("end_time", "")
+        location = event_raw.get("location", "")
+        participants = event_raw.get("participants", "")
+
+        event_date = parse_date_from_string(date_str)
+        if not event_date:
+            event_date = datetime.now().date()
+
+        start_time = None
+        if start_time_str:
+            try:
+                time_part = datetime.strptime(start_time_str, "%H:%M").time()
+                start_time = datetime.combine(event_date, time_part)
+            except ValueError:
+                pass
+
+        end_time = None
+        if end_time_str:
+            try:
+                time_part = datetime.strptime(end_time_str, "%H:%M").time()
+                end_time = datetime.combine(event_date, time_part)
+            except ValueError:
+                pass
+
+        if event_name or start_time:
+            events.append(
+                {
+                    "event_name": event_name,
+                    "start_time": start_time,
+                    "end_time": end_time,
+                    "location": location,
+                    "participants": participants,
+                }
+            )
+
+    return {
+        "success": True,
+        "data": {
+            "is_spam": is_spam,
+            "judge_reason": summary,
+            "is_schedule": has_schedule and len(events) > 0,
+            "events": events,
+        },
+    }
+
+
 def parse_email_generation_response(response_text):
     """
     解析邮件生成API返回的文本
@@ -327,7 +900,7 @@ def parse_email_generation_response(response_text):
                 content = "\n".join(content_lines)
 
         # 构建返回数据
-        data = {"subject": subject, "content": content}
+        data = {"subject": subject, "content": content, "event": parse_event_details(response_text)}
 
         return {
             "success": True,
@@ -340,6 +913,35 @@ def parse_email_generation_response(response_text):
         return {"success": False, "data": None, "message": error_message}
 
 
+_EVENT_DETAILS_RE = re.compile(r"【Event Details】[：:](.*?)(?=【|$)", re.DOTALL)
+_EVENT_DETAIL_FIELDS = ("title", "date", "start_time", "end_time", "location")
+
+
+def parse_event_details(response_text):
+    """
+    解析生成结果中的【Event Details】段，返回只含非空字段的 dict；
+    没有该段、为 none 或无法解析时返回 None
+    """
+    match = _EVENT_DETAILS_RE.search(response_text or "")
+    if not match:
+        return None
+    raw = re.sub(r"^```(?:json)?|```$", "", match.group(1).strip()).strip()
+    if not raw or raw.lower() in ("none", "null", "n/a"):
+        return None
+    try:
+        details = json.loads(raw)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(details, dict):
+        return None
+    event = {
+        key: str(details[key]).strip()
+        for key in _EVENT_DETAIL_FIELDS
+        if details.get(key) not in (None, "")
+    }
+    return event or None
+
+
 def parse_date_from_string(date_str):
     """
     解析日期字符串，支持多种格式
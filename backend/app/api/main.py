@@ -1,7 +1,7 @@
 from fastapi import APIRouter
 
 from app.api.routes import (
-    auth, calendar, calendar_events, emails, gmail, health, oauth, users, recipients
+    auth, calendar, calendar_events, emails, gmail, health, metrics, oauth, users, recipients
 )
 from app.api.routes.simple_auth import router as simple_auth_router  # 新增这行！
 
@@ -16,6 +16,7 @@ api_router.include_router(calendar.router, prefix="/calendar", tags=["Calendar"]
 api_router.include_router(emails.router, prefix="/emails", tags=["Emails"])
 api_router.include_router(calendar_events.router, prefix="/calendar-events", tags=["Calendar Events"])
 api_router.include_router(recipients.router, prefix="/recipients", tags=["Recipients"])
+api_router.include_router(metrics.router, prefix="/metrics", tags=["Metrics"])
 
 # 新增：注册 Simple Auth 路由
 api_router.include_router(simple_auth_router, prefix="", tags=["Simple Auth"])
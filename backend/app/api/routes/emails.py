@@ -1,6 +1,8 @@
-from typing import List
+import json
+from typing import List, Tuple, Union
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from app.core.database import get_db
@@ -8,17 +10,22 @@ from app.core.deps import get_current_user
 from app.core.logging_config import get_logger
 from app.models.user import User
 from app.schemas.email import EmailProcessRequest, EmailProcessResponse, EmailResponse
-from app.services.email_processor import process_unread_emails
+from app.services.email_processor import process_unread_emails_with_stats
 from app.services.email_service import delete_email, get_email_by_id, get_user_emails
 from app.models.email_recipient import EmailRecipient
 from app.schemas.email_recipient import (
+    EmailBulkGenerateRequest,
+    EmailBulkGenerateResponse,
     EmailGenerateRequest,
     EmailGenerateResponse,
     EmailSendRequest,
     EmailSendResponse,
+    OutboxStatusResponse,
 )
+from app.core.config import settings
 from app.services.email_generation import email_generation_service
-from app.services import gmail
+from app.services.mail_merge import generate_bulk
+from app.services.outbox import MAX_SUBJECT_LENGTH, enqueue_email, get_outbox_message
 
 logger = get_logger(__name__)
 router = APIRouter(tags=["emails"])
@@ -31,7 +38,7 @@ def process_emails(
     current_user: User = Depends(get_current_user),
 ):
     try:
-        processed_count, created_events_count, message = process_unread_emails(
+        processed_count, created_events_count, message, stats = process_unread_emails_with_stats(
             db=db, user_id=current_user.id, max_results=request.max_results
         )
         return EmailProcessResponse(
@@ -39,6 +46,7 @@ def process_emails(
             processed_count=processed_count,
             created_events_count=created_events_count,
             message=message,
+            stats=stats,
         )
     except Exception as e:  # noqa: BLE001
         logger.error("Error processing emails: %s", e, exc_info=True)
@@ -112,38 +120,14 @@ def delete_email_endpoint(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
-@router.post("/generate-and-send", response_model=EmailSendResponse)
+@router.post("/generate-and-send", response_model=EmailSendResponse, status_code=status.HTTP_202_ACCEPTED)
 def generate_and_send_email(
     generate_request: EmailGenerateRequest,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    recipients: list[EmailRecipient] = []
-    direct_emails: list[str] = []
-    if generate_request.to_emails and len(generate_request.to_emails) > 0:
-        direct_emails = [str(e) for e in generate_request.to_emails]
-    elif generate_request.to_email:
-        direct_emails = [str(generate_request.to_email)]
-    elif generate_request.recipient_ids:
-        recipients = (
-            db.query(EmailRecipient)
-            .filter(EmailRecipient.user_id == current_user.id)
-            .filter(EmailRecipient.id.in_(generate_request.recipient_ids))
-            .all()
-        )
-    elif generate_request.recipient_id is not None:
-        r = (
-            db.query(EmailRecipient)
-            .filter(
-                EmailRecipient.id == generate_request.recipient_id,
-                EmailRecipient.user_id == current_user.id,
-            )
-            .first()
-        )
-        if r:
-            recipients = [r]
-    if not recipients and not direct_emails:
-        raise HTTPException(status_code=404, detail="Recipient not found")
+    recipients, direct_emails = _resolve_recipients(db, current_user, generate_request)
 
     gen = email_generation_service.generate_email_from_draft(
         subject=generate_request.subject,
@@ -161,6 +145,7 @@ def generate_and_send_email(
         additional_context=generate_request.additional_context,
     )
     if not gen["success"]:
+        response.status_code = status.HTTP_200_OK
         return {
             "success": False,
             "message": gen.get("message", "Failed to generate email"),
@@ -172,21 +157,16 @@ def generate_and_send_email(
     to_emails = ",".join(
         direct_emails if direct_emails else [r.email for r in recipients]
     )
-    res = gmail.send_email(
-        db=db,
-        user_id=str(current_user.id),
+    queued = enqueue_email(
+        db,
+        user_id=current_user.id,
         to_email=to_emails,
-        subject=(data.get("subject") or generate_request.subject or "通知"),
+        # 生成的主题没有经过请求校验，超长时截断以免入库失败
+        subject=(data.get("subject") or generate_request.subject or "通知")[:MAX_SUBJECT_LENGTH],
         body=data.get("body", ""),
         body_html=data.get("body_html"),
     )
-
-    return {
-        "success": res.get("success", False),
-        "message": res.get("message", ""),
-        "gmail_message_id": res.get("message_id"),
-        "thread_id": res.get("thread_id"),
-    }
+    return _queued_response(queued)
 
 
 @router.post("/generate", response_model=EmailGenerateResponse)
@@ -195,32 +175,7 @@ def generate_email(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    recipients: list[EmailRecipient] = []
-    direct_emails: list[str] = []
-    if generate_request.to_emails and len(generate_request.to_emails) > 0:
-        direct_emails = [str(e) for e in generate_request.to_emails]
-    elif generate_request.to_email:
-        direct_emails = [str(generate_request.to_email)]
-    elif generate_request.recipient_ids:
-        recipients = (
-            db.query(EmailRecipient)
-            .filter(EmailRecipient.user_id == current_user.id)
-            .filter(EmailRecipient.id.in_(generate_request.recipient_ids))
-            .all()
-        )
-    elif generate_request.recipient_id is not None:
-        r = (
-            db.query(EmailRecipient)
-            .filter(
-                EmailRecipient.id == generate_request.recipient_id,
-                EmailRecipient.user_id == current_user.id,
-            )
-            .first()
-        )
-        if r:
-            recipients = [r]
-    if not recipients and not direct_emails:
-        raise HTTPException(status_code=404, detail="Recipient not found")
+    recipients, direct_emails = _resolve_recipients(db, current_user, generate_request)
 
     gen = email_generation_service.generate_email_from_draft(
         subject=generate_request.subject,
@@ -257,33 +212,164 @@ def generate_email(
         "subject": data.get("subject") or generate_request.subject or "通知",
         "body": data.get("body", ""),
         "body_html": data.get("body_html"),
+        "event": data.get("event"),
     }
 
 
-@router.post("/send", response_model=EmailSendResponse)
+@router.post("/generate-bulk", response_model=EmailBulkGenerateResponse)
+def generate_bulk_emails(
+    bulk_request: EmailBulkGenerateRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Mail merge: one template call, then a personalized email per saved recipient."""
+    if len(bulk_request.recipient_ids) > settings.MAIL_MERGE_MAX_RECIPIENTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.MAIL_MERGE_MAX_RECIPIENTS} recipients per request",
+        )
+    recipients = (
+        db.query(EmailRecipient)
+        .filter(EmailRecipient.user_id == current_user.id)
+        .filter(EmailRecipient.id.in_(bulk_request.recipient_ids))
+        .all()
+    )
+    if not recipients:
+        raise HTTPException(status_code=404, detail="Recipient not found")
+
+    result = generate_bulk(
+        recipients,
+        brief_content=bulk_request.brief_content,
+        tone=bulk_request.tone,
+        subject=bulk_request.subject,
+        sender_name=bulk_request.sender_name or current_user.full_name,
+        sender_position=bulk_request.sender_position,
+        sender_contact=bulk_request.sender_contact,
+        purpose=bulk_request.purpose,
+        additional_context=bulk_request.additional_context,
+        refine=bulk_request.refine,
+    )
+    if not result["success"]:
+        return {"success": False, "message": result["message"]}
+    return {"success": True, "message": result["message"], **result["data"]}
+
+
+@router.post("/generate/stream")
+def generate_email_stream(
+    generate_request: EmailGenerateRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Stream a generated email as Server-Sent Events.
+
+    Events: ``subject`` once the subject line is complete, ``delta`` for each
+    body chunk, then ``done`` with the cleaned subject/body/body_html (or
+    ``error``).
+    """
+    recipients, direct_emails = _resolve_recipients(db, current_user, generate_request)
+
+    events = email_generation_service.generate_email_stream(
+        subject=generate_request.subject,
+        brief_content=generate_request.brief_content,
+        tone=generate_request.tone,
+        recipient_name=(
+            recipients[0].name
+            if recipients
+            else (direct_emails[0].split("@")[0] if direct_emails else None)
+        ),
+        sender_name=generate_request.sender_name or current_user.full_name,
+        sender_position=generate_request.sender_position,
+        sender_contact=generate_request.sender_contact,
+        purpose=generate_request.purpose,
+        additional_context=generate_request.additional_context,
+    )
+    return StreamingResponse(
+        (_sse_event(event, data) for event, data in events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/send", response_model=EmailSendResponse, status_code=status.HTTP_202_ACCEPTED)
 def send_email_endpoint(
     send_request: EmailSendRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
+    recipients, direct_emails = _resolve_recipients(db, current_user, send_request)
+
+    to_emails = ",".join(
+        direct_emails if direct_emails else [r.email for r in recipients]
+    )
+    queued = enqueue_email(
+        db,
+        user_id=current_user.id,
+        to_email=to_emails,
+        subject=send_request.subject,
+        body=send_request.body,
+        body_html=send_request.body_html,
+    )
+    return _queued_response(queued)
+
+
+@router.get("/outbox/{outbox_id}", response_model=OutboxStatusResponse)
+def get_outbox_status(
+    outbox_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Delivery status of a queued email"""
+    message = get_outbox_message(db, current_user.id, outbox_id)
+    if message is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Outbox message not found")
+    return {
+        "outbox_id": message.id,
+        "status": message.status,
+        "attempts": message.attempts,
+        "last_error": message.last_error,
+        "gmail_message_id": message.gmail_message_id,
+        "thread_id": message.thread_id,
+        "created_at": message.created_at,
+        "next_attempt_at": message.next_attempt_at,
+        "sent_at": message.sent_at,
+    }
+
+
+def _queued_response(queued) -> dict:
+    return {
+        "success": True,
+        "message": "邮件已加入发送队列",
+        "outbox_id": queued.id,
+        "status": queued.status,
+        "gmail_message_id": None,
+        "thread_id": None,
+    }
+
+
+def _resolve_recipients(
+    db: Session,
+    current_user: User,
+    request: Union[EmailGenerateRequest, EmailSendRequest],
+) -> Tuple[list[EmailRecipient], list[str]]:
+    """Resolve saved recipients or direct addresses; 404 if none match"""
     recipients: list[EmailRecipient] = []
     direct_emails: list[str] = []
-    if send_request.to_emails and len(send_request.to_emails) > 0:
-        direct_emails = [str(e) for e in send_request.to_emails]
-    elif send_request.to_email:
-        direct_emails = [str(send_request.to_email)]
-    elif send_request.recipient_ids:
+    if request.to_emails and len(request.to_emails) > 0:
+        direct_emails = [str(e) for e in request.to_emails]
+    elif request.to_email:
+        direct_emails = [str(request.to_email)]
+    elif request.recipient_ids:
         recipients = (
             db.query(EmailRecipient)
             .filter(EmailRecipient.user_id == current_user.id)
-            .filter(EmailRecipient.id.in_(send_request.recipient_ids))
+            .filter(EmailRecipient.id.in_(request.recipient_ids))
             .all()
         )
-    elif send_request.recipient_id is not None:
+    elif request.recipient_id is not None:
         r = (
             db.query(EmailRecipient)
             .filter(
-                EmailRecipient.id == send_request.recipient_id,
+                EmailRecipient.id == request.recipient_id,
                 EmailRecipient.user_id == current_user.id,
             )
             .first()
@@ -292,22 +378,8 @@ def send_email_endpoint(
             recipients = [r]
     if not recipients and not direct_emails:
         raise HTTPException(status_code=404, detail="Recipient not found")
+    return recipients, direct_emails
 
-    to_emails = ",".join(
-        direct_emails if direct_emails else [r.email for r in recipients]
-    )
-    res = gmail.send_email(
-        db=db,
-        user_id=str(current_user.id),
-        to_email=to_emails,
-        subject=send_request.subject,
-        body=send_request.body,
-        body_html=send_request.body_html,
-    )
 
-    return {
-        "success": res.get("success", False),
-        "message": res.get("message", ""),
-        "gmail_message_id": res.get("message_id"),
-        "thread_id": res.get("thread_id"),
-    }
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -1,14 +1,53 @@
-from fastapi import APIRouter, Depends, HTTPException
+import secrets
+from typing import Any, Dict
+
+from fastapi import APIRouter, Body, Depends, HTTPException, Response, status
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.core.database import get_db
 from app.core.deps import get_current_user
+from app.core.logging_config import get_logger
 from app.models.user import User
 from app.services import gmail
+from app.services.push_ingestion import InvalidPushMessage, handle_notification
 
+logger = get_logger(__name__)
 router = APIRouter(tags=["gmail"])
 
 
+@router.post("/watch")
+def api_gmail_watch(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Register Gmail push notifications for the current user's inbox."""
+    if not settings.GMAIL_PUSH_TOPIC:
+        raise HTTPException(status_code=400, detail="GMAIL_PUSH_TOPIC is not configured")
+    try:
+        return gmail.watch_mailbox(db, str(current_user.id), settings.GMAIL_PUSH_TOPIC)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/push", status_code=status.HTTP_204_NO_CONTENT)
+def api_gmail_push(
+    token: str = "",
+    envelope: Dict[str, Any] = Body(...),
+    db: Session = Depends(get_db),
+):
+    """Pub/Sub push endpoint; acknowledges quickly and syncs in the background."""
+    expected = settings.GMAIL_PUSH_VERIFICATION_TOKEN
+    if not expected or not secrets.compare_digest(token, expected):
+        raise HTTPException(status_code=403, detail="Invalid push token")
+    try:
+        outcome = handle_notification(db, envelope)
+    except InvalidPushMessage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info("Gmail push notification: %s", outcome)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
 @router.get("/new")
 def api_gmail_new(
     max_results: int = 10,
@@ -0,0 +1,45 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.services.analysis_cache import analysis_cache
+from app.services.email_compaction import compaction_stats
+from app.services.event_extractor import fast_path_stats
+from app.services.google_clients import service_cache
+from app.services.ics_ingest import invite_stats
+from app.services.llm_metrics import llm_metrics
+from app.services.llm_provider import get_provider
+from app.services.llm_router import model_router
+from app.services.message_store import message_store
+from app.services.mime_body import body_parse_stats
+from app.services.outbox import outbox_sender
+from app.services.push_ingestion import sync_queue
+from app.services.spam_classifier import spam_filter
+from LLM import prompt_cache_stats
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/")
+def get_metrics():
+    """Process-wide LLM call metrics plus the pipeline's component counters."""
+    return {
+        "llm": llm_metrics.snapshot(),
+        "provider": get_provider().stats(),
+        "routing": model_router.stats(),
+        "prompt_cache": prompt_cache_stats.snapshot(),
+        "analysis_cache": analysis_cache.stats(),
+        "spam_filter": spam_filter.stats(),
+        "compaction": compaction_stats.snapshot(),
+        "body_parsing": body_parse_stats.snapshot(),
+        "fast_path": fast_path_stats(),
+        "invites": invite_stats(),
+        "google_services": service_cache.stats(),
+        "message_store": message_store.stats(),
+        "push_sync": sync_queue.stats(),
+        "outbox": outbox_sender.stats(),
+    }
+
+
+@router.get("/prometheus", response_class=PlainTextResponse)
+def get_prometheus_metrics():
+    return PlainTextResponse(llm_metrics.render_prometheus())
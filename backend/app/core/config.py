@@ -71,6 +71,123 @@ class Settings(BaseSettings):
         default="https://accounts.google.com/o/oauth2/v2/auth",
         description="Google OAuth authorization endpoint",
     )
+    GOOGLE_DISCOVERY_DIR: str = Field(
+        default="",
+        description="Directory of <api>.<version>.json discovery documents "
+        "(empty = the static copies bundled with google-api-python-client)",
+    )
+    GMAIL_LIST_PAGE_SIZE: int = Field(
+        default=100,
+        description="Messages per messages.list page; processing runs page by page (max 500)",
+    )
+    GMAIL_BODY_MAX_BYTES: int = Field(
+        default=256 * 1024,
+        description="Max decoded body bytes per message; larger bodies are truncated",
+    )
+    GMAIL_BATCH_SIZE: int = Field(
+        default=50,
+        description="messages.get calls per Gmail batch HTTP request (max 100)",
+    )
+    GMAIL_INCREMENTAL_SYNC_ENABLED: bool = Field(
+        default=True,
+        description="List only messages added since the stored historyId instead of all unread mail",
+    )
+    GMAIL_BATCH_FETCH_ENABLED: bool = Field(
+        default=True,
+        description="Prefetch message bodies with batch requests when processing emails",
+    )
+    GMAIL_TWO_PHASE_FETCH_ENABLED: bool = Field(
+        default=True,
+        description="Fetch metadata first and download full bodies only for messages that pass the filters",
+    )
+    GMAIL_MESSAGE_STORE_ENABLED: bool = Field(
+        default=True,
+        description="Keep fetched messages in a local SQLite store and read them from there first",
+    )
+    GMAIL_MESSAGE_STORE_PATH: str = Field(
+        default="data/message_store.sqlite3",
+        description="SQLite file of the local message store",
+    )
+    GMAIL_MESSAGE_STORE_MAX_BYTES: int = Field(
+        default=512 * 1024 * 1024,
+        description="Compressed size at which least recently read messages are evicted",
+    )
+    GMAIL_LIST_QUERY: str = Field(
+        default="is:unread",
+        description="Search query for full listings; the processed label is excluded automatically",
+    )
+    GMAIL_MARK_PROCESSED_ENABLED: bool = Field(
+        default=True,
+        description="Label handled messages in Gmail with batchModify after each run",
+    )
+    GMAIL_PROCESSED_LABEL: str = Field(
+        default="MailAgent/Processed",
+        description="Gmail label applied to handled messages (created if missing)",
+    )
+    GMAIL_MARK_PROCESSED_REMOVE_UNREAD: bool = Field(
+        default=False,
+        description="Also remove UNREAD from handled messages",
+    )
+    INGEST_SKIP_SENDERS: list[str] = Field(
+        default=[],
+        description="Sender address patterns (fnmatch, e.g. '*@news.example.com') dropped before body fetch",
+    )
+    INGEST_SKIP_LABELS: list[str] = Field(
+        default=[],
+        description="Gmail label ids (e.g. CATEGORY_PROMOTIONS) dropped before body fetch",
+    )
+
+    # Gmail push notifications (users.watch -> Pub/Sub -> /gmail/push)
+    GMAIL_PUSH_TOPIC: str = Field(
+        default="",
+        description="Pub/Sub topic passed to users.watch, e.g. projects/<id>/topics/<name>",
+    )
+    GMAIL_PUSH_VERIFICATION_TOKEN: str = Field(
+        default="",
+        description="Shared secret expected in the push endpoint's ?token= (empty disables the endpoint)",
+    )
+    GMAIL_PUSH_WORKERS: int = Field(
+        default=2,
+        description="Background threads running push-triggered syncs",
+    )
+    GMAIL_PUSH_MAX_RESULTS: int = Field(
+        default=50,
+        description="Messages processed per push-triggered sync",
+    )
+
+    # Outbox (background sending for /emails/send and /emails/generate-and-send)
+    OUTBOX_WORKERS: int = Field(
+        default=2,
+        description="Background threads sending queued emails",
+    )
+    OUTBOX_SEND_RATE_PER_SECOND: float = Field(
+        default=2.0,
+        description="Sustained sends per second per user (messages.send costs 100 of 250 quota units/s)",
+    )
+    OUTBOX_SEND_BURST: int = Field(
+        default=5,
+        description="Sends a user may burst before pacing applies",
+    )
+    OUTBOX_MAX_ATTEMPTS: int = Field(
+        default=5,
+        description="Send attempts before an outbox message is marked failed",
+    )
+    OUTBOX_RETRY_BASE_DELAY_SECONDS: float = Field(
+        default=30.0,
+        description="Delay before the first retry; doubles on each further attempt",
+    )
+    OUTBOX_RETRY_MAX_DELAY_SECONDS: float = Field(
+        default=1800.0,
+        description="Upper bound on the retry delay",
+    )
+    OUTBOX_SENDING_LEASE_SECONDS: int = Field(
+        default=300,
+        description="Messages stuck in 'sending' longer than this are requeued on startup",
+    )
+    OUTBOX_POLL_INTERVAL_SECONDS: float = Field(
+        default=1.0,
+        description="How often idle workers look for due messages",
+    )
 
     # Database Configuration
     DB_HOST: str = Field(
@@ -94,5 +211,219 @@ class Settings(BaseSettings):
         description="MySQL database name",
     )
 
+    # LLM providers
+    LLM_PROVIDER: str = Field(
+        default="deepseek",
+        description="Default LLM provider: 'deepseek' or 'local' (devtools stub server)",
+    )
+    LLM_RECORD_PATH: str = Field(
+        default="",
+        description="Append LLM exchanges to this JSONL file for replay by the stub server",
+    )
+    DEEPSEEK_API_KEY: str = Field(
+        default="",
+        description="DeepSeek API key; set it in .env, LLM calls fail until it is configured",
+    )
+    DEEPSEEK_BASE_URL: str = Field(
+        default="https://api.deepseek.com",
+        description="DeepSeek API base URL",
+    )
+    DEEPSEEK_MODEL: str = Field(
+        default="deepseek-chat",
+        description="DeepSeek chat model",
+    )
+    DEEPSEEK_TIMEOUT_SECONDS: float = Field(
+        default=60.0,
+        description="Client timeout for DeepSeek requests",
+    )
+    DEEPSEEK_MAX_CONCURRENCY: int = Field(
+        default=16,
+        description="Maximum concurrent requests to DeepSeek per process",
+    )
+    LOCAL_LLM_API_KEY: str = Field(
+        default="local",
+        description="API key sent to the local stub server (ignored by it)",
+    )
+    LOCAL_LLM_BASE_URL: str = Field(
+        default="http://127.0.0.1:8787/v1",
+        description="Base URL of the local OpenAI-compatible stub server",
+    )
+    LOCAL_LLM_MODEL: str = Field(
+        default="stub-chat",
+        description="Model name reported to the local stub server",
+    )
+    LOCAL_LLM_TIMEOUT_SECONDS: float = Field(
+        default=30.0,
+        description="Client timeout for local stub requests",
+    )
+    LOCAL_LLM_MAX_CONCURRENCY: int = Field(
+        default=64,
+        description="Maximum concurrent requests to the local stub per process",
+    )
+
+    # LLM call resilience (per-attempt timeout is the provider *_TIMEOUT_SECONDS)
+    LLM_TOTAL_DEADLINE_SECONDS: float = Field(
+        default=90.0,
+        description="Overall deadline for one LLM call including retries",
+    )
+    LLM_MAX_RETRIES: int = Field(
+        default=2,
+        description="Retries for timeouts, connection errors, 429 and 5xx responses",
+    )
+    LLM_RETRY_BASE_DELAY_SECONDS: float = Field(
+        default=0.5,
+        description="Base of the exponential (full jitter) retry backoff",
+    )
+    LLM_RETRY_MAX_DELAY_SECONDS: float = Field(
+        default=8.0,
+        description="Upper bound of a single retry backoff",
+    )
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = Field(
+        default=5,
+        description="Consecutive failed calls (after their retries) that open the circuit (0 disables the breaker)",
+    )
+    LLM_CIRCUIT_RESET_SECONDS: float = Field(
+        default=30.0,
+        description="How long the circuit stays open before a probe request is allowed",
+    )
+    LLM_HEDGE_ENABLED: bool = Field(
+        default=False,
+        description="Send a second request when the first is slower than the latency percentile",
+    )
+    LLM_HEDGE_PERCENTILE: float = Field(
+        default=95.0,
+        description="Latency percentile after which a hedged request is sent",
+    )
+    LLM_HEDGE_MIN_SAMPLES: int = Field(
+        default=20,
+        description="Successful calls observed before hedging starts",
+    )
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = Field(
+        default=0.5,
+        description="Lower bound of the hedge delay",
+    )
+
+    # Cost-aware model routing (full route = LLM_PROVIDER with its model)
+    LLM_ROUTING_ENABLED: bool = Field(
+        default=False,
+        description="Send small/simple requests to the fast model route",
+    )
+    LLM_FAST_PROVIDER: str = Field(
+        default="",
+        description="Provider for the fast route (empty = LLM_PROVIDER)",
+    )
+    LLM_FAST_MODEL: str = Field(
+        default="",
+        description="Model for the fast route (empty = the provider's model)",
+    )
+    LLM_ROUTE_MAX_FAST_TOKENS: int = Field(
+        default=600,
+        description="Largest analysis input (estimated tokens) sent to the fast route",
+    )
+    LLM_ROUTE_MAX_FAST_BRIEF_TOKENS: int = Field(
+        default=150,
+        description="Largest generation brief (estimated tokens) sent to the fast route",
+    )
+    LLM_ROUTE_MAX_FAST_TIME_MENTIONS: int = Field(
+        default=2,
+        description="Emails mentioning more times than this go to the full route",
+    )
+    LLM_ROUTE_SENDER_FAILURE_RATE: float = Field(
+        default=0.3,
+        description="Fast-route validation failure rate that moves a sender to the full route",
+    )
+
+    # Email processing
+    EMAIL_PROCESS_CONCURRENCY: int = Field(
+        default=8,
+        description="Maximum number of emails fetched and analyzed concurrently",
+    )
+    LLM_ANALYSIS_BATCH_SIZE: int = Field(
+        default=1,
+        description="Emails packed into one analysis request (1 disables batching)",
+    )
+    LLM_BATCH_TOKEN_BUDGET: int = Field(
+        default=6000,
+        description="Estimated input token budget for one batched analysis request",
+    )
+    ANALYSIS_COMPACTION_ENABLED: bool = Field(
+        default=True,
+        description="Strip quoted history, signatures, footers and URLs before analysis",
+    )
+    ANALYSIS_BODY_TOKEN_BUDGET: int = Field(
+        default=1500,
+        description="Estimated token budget for one email body sent to analysis",
+    )
+    FAST_PATH_EXTRACTOR_ENABLED: bool = Field(
+        default=True,
+        description="Extract explicit templated schedules with rules before calling the LLM",
+    )
+    ICS_INGEST_ENABLED: bool = Field(
+        default=True,
+        description="Store events from text/calendar parts and .ics attachments without the LLM",
+    )
+    ICS_LOCAL_TIMEZONE: str = Field(
+        default="Asia/Shanghai",
+        description="Timezone invite times are converted to before they are stored",
+    )
+    ICS_RECURRENCE_MAX_OCCURRENCES: int = Field(
+        default=10,
+        description="Upcoming occurrences of a recurring invite stored as events",
+    )
+    ICS_RECURRENCE_HORIZON_DAYS: int = Field(
+        default=90,
+        description="How far ahead recurring invites are expanded",
+    )
+
+    # LLM analysis cache
+    ANALYSIS_CACHE_ENABLED: bool = Field(
+        default=True,
+        description="Reuse stored analyze_email results for identical content",
+    )
+    ANALYSIS_CACHE_TTL_SECONDS: int = Field(
+        default=7 * 24 * 3600,
+        description="Lifetime of a cached analysis result",
+    )
+    ANALYSIS_CACHE_MAX_ENTRIES: int = Field(
+        default=20000,
+        description="Maximum rows kept in the analysis cache table (LRU eviction)",
+    )
+    ANALYSIS_CACHE_MEMORY_SIZE: int = Field(
+        default=1024,
+        description="Entries kept in the in-process hot tier of the analysis cache",
+    )
+
+    # Local spam classifier
+    SPAM_CLASSIFIER_ENABLED: bool = Field(
+        default=True,
+        description="Score emails with the local classifier before calling the LLM",
+    )
+    SPAM_CLASSIFIER_MODEL_PATH: str = Field(
+        default="data/spam_classifier.npz",
+        description="Where the trained spam classifier weights are stored",
+    )
+    SPAM_CLASSIFIER_THRESHOLD: float = Field(
+        default=0.98,
+        description="Spam probability at or above which the LLM call is skipped",
+    )
+    SPAM_CLASSIFIER_MIN_SAMPLES: int = Field(
+        default=200,
+        description="Minimum stored verdicts required before a model is trained",
+    )
+
+    # Mail-merge bulk generation
+    MAIL_MERGE_MAX_RECIPIENTS: int = Field(
+        default=500,
+        description="Maximum recipients in one bulk generation request",
+    )
+    MAIL_MERGE_REFINE_BATCH_SIZE: int = Field(
+        default=20,
+        description="Recipients packed into one LLM refinement request",
+    )
+    MAIL_MERGE_REFINE_CONCURRENCY: int = Field(
+        default=4,
+        description="Maximum refinement requests in flight at once",
+    )
+
 
 settings = Settings()  # type: ignore
@@ -1,13 +1,23 @@
 from app.models.calendar import CalendarEvent
+from app.models.calendar_invite import CalendarInviteEvent
 from app.models.email import Email
 from app.models.oauth_token import OAuthToken
 from app.models.user import User
 from app.models.email_recipient import EmailRecipient
+from app.models.llm_cache import AnalysisCacheEntry
+from app.models.spam_verdict import SpamVerdict
+from app.models.mailbox_sync import MailboxSyncState
+from app.models.outbox import OutboxMessage
 
 __all__ = [
     "User",
     "OAuthToken",
     "Email",
     "CalendarEvent",
+    "CalendarInviteEvent",
     "EmailRecipient",
+    "AnalysisCacheEntry",
+    "SpamVerdict",
+    "MailboxSyncState",
+    "OutboxMessage",
 ]
\ No newline at end of file
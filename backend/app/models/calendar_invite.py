@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+from sqlalchemy import DateTime, ForeignKey, Index, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.models.base import Base
+
+
+class CalendarInviteEvent(Base):
+    """Links a calendar event row to the iCalendar UID (and occurrence) it was created from.
+
+    A later invite with the same UID replaces these rows, and a cancellation
+    deletes them.
+    """
+
+    __tablename__ = "calendar_invite_events"
+    __table_args__ = (Index("ix_calendar_invite_events_user_uid", "user_id", "uid"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
+    uid: Mapped[str] = mapped_column(String(255))
+    # 这一次发生的原始开始时间（本地、naive），与 RECURRENCE-ID 对应
+    occurrence_start: Mapped[datetime] = mapped_column(DateTime())
+    calendar_event_id: Mapped[int] = mapped_column(
+        ForeignKey("calendar_events.id", ondelete="CASCADE"), index=True
+    )
+
+    created_at: Mapped[datetime] = mapped_column(
+        default=lambda: datetime.now(timezone.utc)
+    )
+
+    def __repr__(self):
+        return f"<CalendarInviteEvent(uid='{self.uid}', occurrence_start={self.occurrence_start}, calendar_event_id={self.calendar_event_id})>"
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+from sqlalchemy import DateTime, String, Text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.models.base import Base
+
+
+class AnalysisCacheEntry(Base):
+    __tablename__ = "llm_analysis_cache"
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    cache_key: Mapped[str] = mapped_column(String(64), unique=True, index=True)
+    result: Mapped[str] = mapped_column(Text)
+    hit_count: Mapped[int] = mapped_column(default=0)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
+    )
+    last_accessed_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), index=True, default=lambda: datetime.now(timezone.utc)
+    )
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
+
+    def __repr__(self):
+        return f"<AnalysisCacheEntry(cache_key='{self.cache_key}', hit_count={self.hit_count})>"
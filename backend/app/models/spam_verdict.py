@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+from sqlalchemy import Boolean, DateTime, ForeignKey, String, Text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.models.base import Base
+
+
+class SpamVerdict(Base):
+    """An LLM spam verdict for one email, kept as training data for the local classifier."""
+
+    __tablename__ = "spam_verdicts"
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    email_id: Mapped[str] = mapped_column(String(255), unique=True, index=True)
+
+    sender: Mapped[str | None] = mapped_column(String(500))
+    subject: Mapped[str | None] = mapped_column(String(500))
+    body_excerpt: Mapped[str | None] = mapped_column(Text)
+    is_spam: Mapped[bool] = mapped_column(Boolean, index=True)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
+    )
+
+    def __repr__(self):
+        return f"<SpamVerdict(email_id='{self.email_id}', is_spam={self.is_spam})>"
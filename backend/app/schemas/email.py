@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, Optional
 
 from pydantic import BaseModel, Field, ConfigDict
 
@@ -41,3 +41,7 @@ class EmailProcessResponse(BaseModel):
     processed_count: int
     created_events_count: int
     message: str
+    stats: Optional[Dict[str, Any]] = Field(
+        default=None,
+        description="Counts, wall time and LLM call metrics for this run",
+    )
@@ -1,4 +1,4 @@
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 from pydantic import BaseModel, EmailStr, Field, ConfigDict
 
@@ -59,10 +59,45 @@ class EmailGenerateResponse(BaseModel):
     subject: str
     body: str
     body_html: Optional[str] = None
+    event: Optional[Dict[str, str]] = Field(None, description="从简要内容中提取的事件信息")
     success: bool
     message: str
 
 
+class EmailBulkGenerateRequest(BaseModel):
+    """邮件合并批量生成请求"""
+    recipient_ids: List[int] = Field(..., min_length=1, description="收件人ID列表")
+    subject: Optional[str] = Field(None, description="邮件主题，可省略让系统自动生成")
+    brief_content: str = Field(..., description="用户输入的简要内容")
+    tone: str = Field("professional", description="邮件语气：professional, friendly, formal, casual")
+    purpose: Optional[str] = Field(None, max_length=100, description="邮件目的")
+    additional_context: Optional[str] = Field(None, description="额外的上下文信息")
+    sender_name: Optional[str] = Field(None, description="发件人姓名")
+    sender_position: Optional[str] = Field(None, description="发件人职位")
+    sender_contact: Optional[str] = Field(None, description="发件人联系方式")
+    refine: bool = Field(False, description="按收件人备注再用 LLM 分批微调")
+
+
+class EmailBulkGenerateItem(BaseModel):
+    """单个收件人的生成结果"""
+    recipient_id: int
+    email: str
+    subject: str
+    body: str
+    body_html: Optional[str] = None
+    refined: bool = False
+
+
+class EmailBulkGenerateResponse(BaseModel):
+    """邮件合并批量生成响应"""
+    success: bool
+    message: str
+    template_subject: Optional[str] = None
+    template_body: Optional[str] = None
+    items: List[EmailBulkGenerateItem] = []
+    llm_calls: int = 0
+
+
 class EmailSendRequest(BaseModel):
     """邮件发送请求"""
     recipient_id: Optional[int] = Field(None, description="单个收件人ID")
@@ -75,11 +110,26 @@ class EmailSendRequest(BaseModel):
 
 
 class EmailSendResponse(BaseModel):
-    """邮件发送响应"""
+    """邮件发送响应（邮件进入发件箱后由后台发送）"""
     success: bool
     message: str
+    outbox_id: Optional[int] = None
+    status: Optional[str] = None
+    gmail_message_id: Optional[str] = None
+    thread_id: Optional[str] = None
+
+
+class OutboxStatusResponse(BaseModel):
+    """发件箱中一封邮件的发送状态"""
+    outbox_id: int
+    status: str
+    attempts: int
+    last_error: Optional[str] = None
     gmail_message_id: Optional[str] = None
     thread_id: Optional[str] = None
+    created_at: Optional[datetime] = None
+    next_attempt_at: Optional[datetime] = None
+    sent_at: Optional[datetime] = None
 
 
 class EmailRecipientListResponse(BaseModel):
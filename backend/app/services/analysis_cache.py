@@ -0,0 +1,346 @@
+"""Content-addressed cache in front of ``LLM.analyze_email``.
+
+Results are keyed by a hash of the normalized subject, sender, recipients
+and body plus the analysis prompt version and the reference date (relative dates such as
+"tomorrow" resolve differently on another day). Lookups go through an
+in-process TTL/LRU hot tier first, then the ``llm_analysis_cache`` table.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import re
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from cachetools import TTLCache
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.logging_config import get_logger
+from app.models.llm_cache import AnalysisCacheEntry
+from LLM import (
+    ANALYSIS_PROMPT_VERSION,
+    analyze_email,
+    analyze_email_async,
+    analyze_email_batch,
+    pack_email_batches,
+)
+
+logger = get_logger(__name__)
+
+_SUBJECT_PREFIX_RE = re.compile(r"^\s*((re|fw|fwd|回复|转发)\s*[:：]\s*)+", re.IGNORECASE)
+_ADDRESS_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Prune the table only every N stores; a COUNT per insert is not worth it.
+_PRUNE_EVERY = 50
+
+
+def make_analysis_key(
+    email_content: Optional[str],
+    sender: Optional[str] = None,
+    subject: Optional[str] = None,
+    reference_date: Optional[date] = None,
+    recipients: Optional[str] = None,
+) -> str:
+    """Build the cache key for an analysis request.
+
+    Recipients are part of the key because the extracted participants come
+    from them; their addresses are compared as a sorted, lower-cased set.
+    """
+    normalized_subject = _SUBJECT_PREFIX_RE.sub("", subject or "")
+    normalized_subject = _WHITESPACE_RE.sub(" ", normalized_subject).strip().casefold()
+
+    sender_match = _ADDRESS_RE.search(sender or "")
+    normalized_sender = (sender_match.group(0) if sender_match else (sender or "")).strip().lower()
+
+    recipient_addresses = sorted({address.lower() for address in _ADDRESS_RE.findall(recipients or "")})
+    normalized_recipients = ",".join(recipient_addresses)
+
+    normalized_body = _WHITESPACE_RE.sub(" ", email_content or "").strip()
+
+    payload = "\x1f".join(
+        [
+            ANALYSIS_PROMPT_VERSION,
+            (reference_date or date.today()).isoformat(),
+            normalized_sender,
+            normalized_recipients,
+            normalized_subject,
+            normalized_body,
+        ]
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """Two-tier (memory + database) cache for parsed analysis results."""
+
+    def __init__(self, memory_size: int, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._memory: TTLCache = TTLCache(maxsize=memory_size, ttl=ttl_seconds)
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+
+    def get(self, db: Optional[Session], key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                self._stats["memory_hits"] += 1
+                return _decode_result(cached)
+
+        if db is not None:
+            entry = db.query(AnalysisCacheEntry).filter(AnalysisCacheEntry.cache_key == key).first()
+            now = datetime.now(timezone.utc)
+            if entry is not None and _as_utc(entry.expires_at) <= now:
+                db.delete(entry)
+                db.commit()
+                entry = None
+            if entry is not None:
+                entry.hit_count += 1
+                entry.last_accessed_at = now
+                db.commit()
+                with self._lock:
+                    self._memory[key] = entry.result
+                    self._stats["db_hits"] += 1
+                return _decode_result(entry.result)
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, db: Optional[Session], key: str, result: Dict[str, Any]) -> None:
+        """Store a successful analysis result; failures are never cached."""
+        if not result or not result.get("success"):
+            return
+
+        encoded = _encode_result(result)
+        with self._lock:
+            self._memory[key] = encoded
+            self._stats["stores"] += 1
+            should_prune = self._stats["stores"] % _PRUNE_EVERY == 0
+
+        if db is None:
+            return
+
+        now = datetime.now(timezone.utc)
+        entry = AnalysisCacheEntry(
+            cache_key=key,
+            result=encoded,
+            created_at=now,
+            last_accessed_at=now,
+            expires_at=now + timedelta(seconds=self.ttl_seconds),
+        )
+        db.add(entry)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another worker stored the same content first
+            db.rollback()
+
+        if should_prune:
+            self.prune(db)
+
+    def prune(self, db: Session) -> int:
+        """Drop expired rows, then least recently used rows above the size limit."""
+        now = datetime.now(timezone.utc)
+        removed = (
+            db.query(AnalysisCacheEntry)
+            .filter(AnalysisCacheEntry.expires_at <= now)
+            .delete(synchronize_session=False)
+        )
+
+        overflow = db.query(AnalysisCacheEntry).count() - self.max_entries
+        if overflow > 0:
+            stale_ids = [
+                row[0]
+                for row in db.query(AnalysisCacheEntry.id)
+                .order_by(AnalysisCacheEntry.last_accessed_at.asc())
+                .limit(overflow)
+                .all()
+            ]
+            removed += (
+                db.query(AnalysisCacheEntry)
+                .filter(AnalysisCacheEntry.id.in_(stale_ids))
+                .delete(synchronize_session=False)
+            )
+        db.commit()
+
+        if removed:
+            with self._lock:
+                self._stats["evictions"] += removed
+            logger.info("Analysis cache pruned %d entries", removed)
+        return removed
+
+    def clear_memory(self) -> None:
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["db_hits"] + stats["misses"]
+        stats["hit_rate"] = (
+            round((stats["memory_hits"] + stats["db_hits"]) / lookups, 4) if lookups else 0.0
+        )
+        return stats
+
+
+analysis_cache = AnalysisCache(
+    memory_size=settings.ANALYSIS_CACHE_MEMORY_SIZE,
+    ttl_seconds=settings.ANALYSIS_CACHE_TTL_SECONDS,
+    max_entries=settings.ANALYSIS_CACHE_MAX_ENTRIES,
+)
+
+
+def analyze_email_cached(
+    email_content,
+    sender=None,
+    subject=None,
+    recipients=None,
+    db: Optional[Session] = None,
+) -> Dict[str, Any]:
+    """``analyze_email`` with caching; without ``db`` only the memory tier is used."""
+    if not settings.ANALYSIS_CACHE_ENABLED:
+        return analyze_email(email_content, sender=sender, subject=subject, recipients=recipients)
+
+    key = make_analysis_key(email_content, sender=sender, subject=subject, recipients=recipients)
+    cached = analysis_cache.get(db, key)
+    if cached is not None:
+        return cached
+
+    result = analyze_email(email_content, sender=sender, subject=subject, recipients=recipients)
+    analysis_cache.put(db, key, result)
+    return result
+
+
+async def analyze_email_cached_async(
+    email_content, sender=None, subject=None, recipients=None
+) -> Dict[str, Any]:
+    """Async variant backed by the memory tier and the database tier.
+
+    Database access runs in a worker thread with its own session.
+    """
+    if not settings.ANALYSIS_CACHE_ENABLED:
+        return await analyze_email_async(
+            email_content, sender=sender, subject=subject, recipients=recipients
+        )
+
+    key = make_analysis_key(email_content, sender=sender, subject=subject, recipients=recipients)
+    cached = await asyncio.to_thread(_with_session, analysis_cache.get, key)
+    if cached is not None:
+        return cached
+
+    result = await analyze_email_async(
+        email_content, sender=sender, subject=subject, recipients=recipients
+    )
+    if result and result.get("success"):
+        await asyncio.to_thread(_with_session, analysis_cache.put, key, result)
+    return result
+
+
+async def analyze_email_batch_cached_async(
+    emails: List[Dict[str, Any]],
+    max_batch_tokens: int,
+    max_batch_emails: int,
+    concurrency: int,
+) -> Dict[str, Dict[str, Any]]:
+    """Cached ``analyze_email_batch`` for a list of {id, content, sender, subject, recipients}.
+
+    Cache hits are served directly; the misses are packed into batches which
+    run concurrently (at most ``concurrency`` requests in flight).
+    Returns ``{str(id): result}``.
+    """
+    use_cache = settings.ANALYSIS_CACHE_ENABLED
+    keys = {
+        str(item["id"]): make_analysis_key(
+            item.get("content", ""),
+            sender=item.get("sender"),
+            subject=item.get("subject"),
+            recipients=item.get("recipients"),
+        )
+        for item in emails
+    }
+
+    results: Dict[str, Dict[str, Any]] = {}
+    if use_cache:
+
+        def _lookup_all(db: Session) -> Dict[str, Dict[str, Any]]:
+            found = {}
+            for email_id, key in keys.items():
+                cached = analysis_cache.get(db, key)
+                if cached is not None:
+                    found[email_id] = cached
+            return found
+
+        results.update(await asyncio.to_thread(_with_session, _lookup_all))
+
+    misses = [item for item in emails if str(item["id"]) not in results]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run(batch: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        async with semaphore:
+            return await asyncio.to_thread(
+                analyze_email_batch, batch, max_batch_tokens, max_batch_emails
+            )
+
+    fresh: Dict[str, Dict[str, Any]] = {}
+    for batch_results in await asyncio.gather(
+        *(_run(batch) for batch in pack_email_batches(misses, max_batch_tokens, max_batch_emails))
+    ):
+        fresh.update(batch_results)
+    results.update(fresh)
+
+    if use_cache and fresh:
+
+        def _store_all(db: Session) -> None:
+            for email_id, result in fresh.items():
+                analysis_cache.put(db, keys[email_id], result)
+
+        await asyncio.to_thread(_with_session, _store_all)
+
+    return results
+
+
+def _with_session(fn, *args):
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+def _encode_result(result: Dict[str, Any]) -> str:
+    def _default(value: Any) -> str:
+        if isinstance(value, datetime):
+            return value.isoformat()
+        raise TypeError(f"Unserializable value: {value!r}")
+
+    # Token usage belongs to the original call, not to later cache hits
+    stored = {k: v for k, v in result.items() if k != "usage"}
+    return json.dumps(stored, default=_default, ensure_ascii=False)
+
+
+def _decode_result(encoded: str) -> Dict[str, Any]:
+    result = json.loads(encoded)
+    for event in (result.get("data") or {}).get("events", []):
+        for field in ("start_time", "end_time"):
+            if event.get(field):
+                event[field] = datetime.fromisoformat(event[field])
+    return result
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
@@ -1,17 +1,13 @@
 from typing import Any, Dict, List
 import re
 
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from sqlalchemy.orm import Session
 
-from app.core.config import settings
-from app.services.oauth import get_fresh_token
+from app.services.google_clients import calendar_service
 
 
 def create_event(db: Session, user_id: str, event_details: Dict[str, Any]) -> Dict[str, Any]:
-    creds = _get_creds(db, user_id)
-    service = build("calendar", "v3", credentials=creds)
+    service = calendar_service(db, user_id)
     timezone = event_details.get("timezone", "Asia/Shanghai")
     attendees = _normalize_attendees(event_details.get("attendees"))
     body = {
@@ -32,25 +28,12 @@ def find_free_slots(
     time_max: str,
     calendars: List[str] = None,
 ) -> Dict[str, Any]:
-    creds = _get_creds(db, user_id)
-    service = build("calendar", "v3", credentials=creds)
+    service = calendar_service(db, user_id)
     items = [{"id": "primary"}] if not calendars else [{"id": c} for c in calendars]
     body = {"timeMin": time_min, "timeMax": time_max, "items": items}
     return service.freebusy().query(body=body).execute()
 
 
-def _get_creds(db: Session, user_id: str) -> Credentials:
-    access_token = get_fresh_token(db, user_id)
-    creds = Credentials(
-        access_token,
-        token_uri=settings.GOOGLE_TOKEN_URI,
-        client_id=settings.GOOGLE_CLIENT_ID,
-        client_secret=settings.GOOGLE_CLIENT_SECRET,
-        scopes=settings.GOOGLE_SCOPES,
-    )
-    return creds
-
-
 def _normalize_attendees(value: Any) -> List[Dict[str, str]]:
     if value is None:
         return []
@@ -1,8 +1,10 @@
-from typing import List, Optional
+from datetime import datetime
+from typing import Iterable, List, Optional
 
 from sqlalchemy.orm import Session
 
 from app.models.calendar import CalendarEvent
+from app.models.calendar_invite import CalendarInviteEvent
 from app.models.email import Email
 from app.schemas.calendar import CalendarEventCreate, CalendarEventUpdate
 
@@ -76,3 +78,37 @@ def delete_calendar_event(db: Session, event_id: int) -> bool:
     db.delete(db_event)
     db.commit()
     return True
+
+
+def link_invite_event(
+    db: Session, user_id: int, uid: str, occurrence_start: datetime, event_id: int
+) -> None:
+    """Remember which invite UID and occurrence a calendar event was created from"""
+    db.add(
+        CalendarInviteEvent(
+            user_id=user_id, uid=uid, occurrence_start=occurrence_start, calendar_event_id=event_id
+        )
+    )
+    db.commit()
+
+
+def delete_invite_events(
+    db: Session,
+    user_id: int,
+    uid: str,
+    occurrence_starts: Optional[Iterable[datetime]] = None,
+) -> int:
+    """Delete events created from invite ``uid``: every occurrence, or only ``occurrence_starts``"""
+    query = db.query(CalendarInviteEvent).filter(
+        CalendarInviteEvent.user_id == user_id, CalendarInviteEvent.uid == uid
+    )
+    if occurrence_starts is not None:
+        query = query.filter(CalendarInviteEvent.occurrence_start.in_(list(occurrence_starts)))
+    links = query.all()
+    event_ids = [link.calendar_event_id for link in links]
+    for link in links:
+        db.delete(link)
+    if event_ids:
+        db.query(CalendarEvent).filter(CalendarEvent.id.in_(event_ids)).delete(synchronize_session=False)
+    db.commit()
+    return len(event_ids)
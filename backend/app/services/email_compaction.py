@@ -0,0 +1,229 @@
+"""Shrink email bodies before they are sent to the LLM for analysis.
+
+Quoted reply history, signatures, legal/unsubscribe footers and long
+tracking URLs carry no scheduling information but make up most of the input
+tokens. ``compact_email_body`` removes them, collapses whitespace and trims
+the result to a token budget measured with ``LLM.estimate_tokens``. The
+stored email keeps the original body; only the LLM input is compacted.
+
+Forwarded messages are not history: their body is usually what the forwarder
+wants acted on, so it is kept. Reply history is also kept when the new text
+has no date or time of its own but the quoted part does ("works for me" above
+an invitation).
+"""
+from __future__ import annotations
+
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from app.core.config import settings
+from LLM import estimate_tokens
+
+TRUNCATION_MARKER = "[...truncated]"
+
+# A line that starts the quoted history of a reply; everything from it
+# onwards is dropped.
+_QUOTE_HEADER_RE = re.compile(
+    r"^\s*("
+    r"on\b.{0,200}\bwrote:\s*$"
+    r"|-{2,}\s*original message\s*-{2,}"
+    r"|_{10,}\s*$"
+    r"|from:\s.+\n\s*(sent|date):\s"
+    r"|在.{0,200}写道[:：]\s*$"
+    r"|-{2,}\s*原始邮件\s*-{2,}"
+    r"|发件人[:：].+\n\s*(发送时间|日期)[:：]"
+    r")",
+    re.IGNORECASE | re.MULTILINE,
+)
+# 转发的邮件正文要保留；紧跟在这行后面的 From:/Date: 头部不是回复历史
+_FORWARD_MARKER_RE = re.compile(
+    r"^\s*-{2,}\s*(forwarded message|begin forwarded message|转发的邮件)\s*-{0,}\s*:?\s*$",
+    re.IGNORECASE,
+)
+_HEADER_LINE_RE = re.compile(
+    r"^\s*(from|sent|date|to|cc|subject|发件人|发送时间|日期|收件人|抄送|主题)\s*[:：]",
+    re.IGNORECASE,
+)
+# 日期/时间线索；回复正文里没有而引用里有时保留引用
+_DATETIME_RE = re.compile(
+    r"\d{1,2}:\d{2}|\d{4}[-/.年]\d{1,2}|\d{1,2}[/月]\d{1,2}|\d{1,2}\s*(am|pm)\b|"
+    r"\b(mon|tues?|wed(nes)?|thu(rs)?|fri|sat(ur)?|sun)(day)?\b|"
+    r"\b(jan|feb|mar|apr|jun|jul|aug|sept?|oct|nov|dec)[a-z]*\.?\s+\d{1,2}\b|"
+    r"\b(today|tomorrow|tonight|next week)\b|"
+    r"今天|明天|后天|下周|周[一二三四五六日天]|星期[一二三四五六日天]|[上下]午|\d+\s*[点号日]",
+    re.IGNORECASE,
+)
+_QUOTED_LINE_RE = re.compile(r"^\s*>.*$\n?", re.MULTILINE)
+# "-- " is the standard signature delimiter; mobile clients add their own.
+_SIGNATURE_RE = re.compile(
+    r"^(--[ \t]*|sent from my \w+.*|get outlook for \w+.*|发自我的\w+.*)$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_FOOTER_KEYWORDS_RE = re.compile(
+    r"unsubscribe|opt[ -]out|manage (your )?(email )?preferences|confidential|"
+    r"intended (solely )?for the (use of the )?(named )?(addressee|recipient)|"
+    r"this (e-?mail|message) (and any attachments )?(is|may)|privileged|"
+    r"view (this email )?in (your|a) browser|"
+    r"退订|取消订阅|免责声明|保密|此邮件.{0,10}(仅|只)",
+    re.IGNORECASE,
+)
+_URL_RE = re.compile(r"https?://[^\s<>\"')\]]+", re.IGNORECASE)
+_INLINE_WHITESPACE_RE = re.compile(r"[ \t\u00a0\u200b]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+# Footers are only looked for in the last paragraphs, so a body that
+# mentions "confidential" in its first line is not cut.
+_FOOTER_TAIL_PARAGRAPHS = 3
+
+
+def compact_email_body(
+    text: Optional[str], max_tokens: Optional[int] = None
+) -> Tuple[str, Dict[str, int]]:
+    """Return the compacted body and its before/after size in bytes and tokens."""
+    original = text or ""
+    compacted = original.replace("\r\n", "\n").replace("\r", "\n")
+
+    compacted = _strip_quoted_history(compacted)
+    compacted = _strip_signature(compacted)
+    compacted = _strip_footer(compacted)
+    compacted = _URL_RE.sub(_shorten_url, compacted)
+    compacted = _collapse_whitespace(compacted)
+    # 压缩后什么都不剩（例如整封都是引用），退回原文，交给 LLM 判断
+    if not compacted:
+        compacted = _collapse_whitespace(original)
+    if max_tokens:
+        compacted = truncate_to_tokens(compacted, max_tokens)
+
+    return compacted, {
+        "original_bytes": len(original.encode("utf-8")),
+        "compacted_bytes": len(compacted.encode("utf-8")),
+        "original_tokens": estimate_tokens(original),
+        "compacted_tokens": estimate_tokens(compacted),
+    }
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut ``text`` so that it (plus the marker) fits ``max_tokens``."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    budget = max_tokens - estimate_tokens(TRUNCATION_MARKER) - 1
+    if budget <= 0:
+        return ""
+    # estimate_tokens 随长度单调增加，二分查找最长的前缀
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+
+    head = text[:low]
+    cut = head.rfind("\n")
+    if cut > low // 2:
+        head = head[:cut]
+    return head.rstrip() + "\n" + TRUNCATION_MARKER
+
+
+def _strip_quoted_history(text: str) -> str:
+    cut = None
+    for match in _QUOTE_HEADER_RE.finditer(text):
+        if match.start() > 0 and not _after_forward_marker(text, match.start()):
+            cut = match.start()
+            break
+    kept = _QUOTED_LINE_RE.sub("", text if cut is None else text[:cut])
+    if not _DATETIME_RE.search(kept):
+        quoted = "".join(_QUOTED_LINE_RE.findall(text if cut is None else text[:cut]))
+        if cut is not None:
+            quoted += _history_body(text[cut:])
+        if _DATETIME_RE.search(quoted):
+            return text
+    return kept
+
+
+def _after_forward_marker(text: str, position: int) -> bool:
+    previous = [line for line in text[:position].split("\n") if line.strip()]
+    return bool(previous) and bool(_FORWARD_MARKER_RE.match(previous[-1]))
+
+
+def _history_body(history: str) -> str:
+    """Quoted history without its marker line and header block (their dates are the reply's own)."""
+    lines = history.split("\n")[1:]
+    while lines and (not lines[0].strip() or _HEADER_LINE_RE.match(lines[0])):
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def _strip_signature(text: str) -> str:
+    match = _SIGNATURE_RE.search(text)
+    if match and match.start() > 0:
+        return text[: match.start()]
+    return text
+
+
+def _strip_footer(text: str) -> str:
+    paragraphs = re.split(r"\n\s*\n", text)
+    keep = len(paragraphs)
+    for i in range(len(paragraphs) - 1, max(len(paragraphs) - 1 - _FOOTER_TAIL_PARAGRAPHS, 0), -1):
+        if _FOOTER_KEYWORDS_RE.search(paragraphs[i]):
+            keep = i
+    return "\n\n".join(paragraphs[:keep])
+
+
+def _shorten_url(match: re.Match) -> str:
+    host = urlsplit(match.group(0)).hostname or "link"
+    return f"[link:{host}]"
+
+
+def _collapse_whitespace(text: str) -> str:
+    lines: List[str] = [_INLINE_WHITESPACE_RE.sub(" ", line).strip() for line in text.split("\n")]
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+class CompactionStats:
+    """Running totals of what compaction removed from LLM input."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def record(self, stats: Dict[str, int]) -> None:
+        with self._lock:
+            self._totals["emails"] += 1
+            for key in ("original_bytes", "compacted_bytes", "original_tokens", "compacted_tokens"):
+                self._totals[key] += stats[key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            totals = dict(self._totals)
+        totals["bytes_saved"] = totals["original_bytes"] - totals["compacted_bytes"]
+        totals["tokens_saved"] = totals["original_tokens"] - totals["compacted_tokens"]
+        totals["token_reduction"] = (
+            round(totals["tokens_saved"] / totals["original_tokens"], 4) if totals["original_tokens"] else 0.0
+        )
+        return totals
+
+    def reset(self) -> None:
+        with self._lock:
+            self._totals = {
+                "emails": 0,
+                "original_bytes": 0,
+                "compacted_bytes": 0,
+                "original_tokens": 0,
+                "compacted_tokens": 0,
+            }
+
+
+compaction_stats = CompactionStats()
+
+
+def compact_for_analysis(text: Optional[str]) -> str:
+    """Compact a body with the configured budget and record the savings."""
+    if not settings.ANALYSIS_COMPACTION_ENABLED:
+        return text or ""
+    compacted, stats = compact_email_body(text, settings.ANALYSIS_BODY_TOKEN_BUDGET)
+    compaction_stats.record(stats)
+    return compacted
@@ -1,10 +1,10 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, Tuple
 import logging
 import re
 
 # 导入现有的LLM函数
 from LLM import generate_email as llm_generate_email
-from LLM import analyze_email
+from LLM import generate_email_stream as llm_generate_email_stream
 
 logger = logging.getLogger(__name__)
 
@@ -35,51 +35,28 @@ class EmailGenerationService:
             sender_name: 发件人姓名
             purpose: 邮件目的
             additional_context: 额外上下文信息
-            
+
+        只调用一次 LLM：事件信息（时间、地点等）由生成提示词在同一次
+        响应的【Event Details】段中给出，不再单独分析 brief_content。
+
         Returns:
             {
                 "success": bool,
                 "data": {
                     "subject": str,
                     "body": str,
-                    "body_html": str
+                    "body_html": str,
+                    "event": dict | None
                 },
                 "message": str
             }
         """
         try:
             # 构建生成邮件的输入信息
-            email_input = f"""
-            简要内容：{brief_content}
-            """
-            
-            if purpose:
-                email_input += f"\n邮件目的：{purpose}"
-                
-            if additional_context:
-                email_input += f"\n额外上下文：{additional_context}"
-            try:
-                analysis = analyze_email(
-                    email_content=brief_content,
-                    sender=sender_name,
-                    subject=subject,
-                    recipients=recipient_name,
-                )
-                if analysis and analysis.get("success"):
-                    data = analysis.get("data") or {}
-                    event = data.get("event") or ""
-                    location = data.get("location") or ""
-                    start_time = data.get("start_time")
-                    time_text = start_time.isoformat() if start_time else ""
-                    if event:
-                        email_input += f"\n事件：{event}"
-                    if time_text:
-                        email_input += f"\n时间：{time_text}"
-                    if location:
-                        email_input += f"\n地点：{location}"
-            except Exception:
-                pass
-            
+            email_input = EmailGenerationService._build_email_input(
+                brief_content, purpose, additional_context
+            )
+
             tone_norm = EmailGenerationService.validate_tone(tone)
             # 调用LLM生成邮件
             result = llm_generate_email(
@@ -119,7 +96,8 @@ class EmailGenerationService:
                 "data": {
                     "subject": generated_subject,
                     "body": generated_content,
-                    "body_html": body_html
+                    "body_html": body_html,
+                    "event": llm_data.get("event"),
                 },
                 "message": "邮件生成成功"
             }
@@ -133,6 +111,81 @@ class EmailGenerationService:
                 "message": error_msg
             }
     
+    @staticmethod
+    def generate_email_stream(
+        subject: Optional[str],
+        brief_content: str,
+        tone: str,
+        recipient_name: Optional[str] = None,
+        sender_name: Optional[str] = None,
+        sender_position: Optional[str] = None,
+        sender_contact: Optional[str] = None,
+        purpose: Optional[str] = None,
+        additional_context: Optional[str] = None
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        流式生成邮件
+
+        依次产出 (event, data)：
+            ("subject", {"subject": str})       主题生成完毕
+            ("delta", {"text": str})            正文增量（原始文本）
+            ("done", {"subject", "body", "body_html", "event"})  清理格式、补全签名后的最终结果
+            ("error", {"message": str})
+        """
+        email_input = EmailGenerationService._build_email_input(
+            brief_content, purpose, additional_context
+        )
+        tone_norm = EmailGenerationService.validate_tone(tone)
+
+        for event, payload in llm_generate_email_stream(
+            brief_info=email_input.strip(),
+            sender_name=sender_name,
+            recipient_name=recipient_name,
+            tone=tone_norm,
+        ):
+            if event == "subject":
+                yield "subject", {"subject": payload}
+            elif event == "delta":
+                yield "delta", {"text": payload}
+            elif event == "error":
+                logger.error(f"LLM邮件流式生成失败: {payload}")
+                yield "error", {"message": f"邮件生成失败: {payload}"}
+                return
+            elif event == "done":
+                content = EmailGenerationService._strip_markdown(payload.get("content", ""))
+                content = EmailGenerationService._apply_signature(
+                    content,
+                    sender_name=sender_name,
+                    sender_position=sender_position,
+                    sender_contact=sender_contact,
+                )
+                generated_subject = payload.get("subject") or subject or "通知"
+                logger.info(f"邮件流式生成成功 - 主题: {generated_subject}")
+                yield "done", {
+                    "subject": generated_subject,
+                    "body": content,
+                    "body_html": EmailGenerationService._convert_to_html(content),
+                    "event": payload.get("event"),
+                }
+
+    @staticmethod
+    def _build_email_input(
+        brief_content: str,
+        purpose: Optional[str] = None,
+        additional_context: Optional[str] = None,
+    ) -> str:
+        """构建生成邮件的输入信息"""
+        email_input = f"""
+            简要内容：{brief_content}
+            """
+
+        if purpose:
+            email_input += f"\n邮件目的：{purpose}"
+
+        if additional_context:
+            email_input += f"\n额外上下文：{additional_context}"
+        return email_input
+
     @staticmethod
     def _convert_to_html(text_content: str) -> str:
         """将纯文本转换为HTML格式"""
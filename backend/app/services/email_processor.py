@@ -1,159 +1,738 @@
 from __future__ import annotations
 
+import asyncio
+import fnmatch
+import time
 from datetime import datetime, timedelta
-from typing import Tuple, List
+from email.utils import parseaddr
+from typing import Any, Dict, Optional, Tuple, List
 import re
 
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
+from app.core.database import SessionLocal
 from app.core.logging_config import get_logger
 from app.schemas.calendar import CalendarEventCreate
 from app.schemas.email import EmailCreate
-from app.services import gmail
-from app.services.calendar_service import create_calendar_event
-from app.services.email_service import create_email, get_email_by_email_id
-from LLM import analyze_email
+from app.services import gmail, mailbox_sync
+from app.services.analysis_cache import (
+    analysis_cache,
+    analyze_email_batch_cached_async,
+    analyze_email_cached_async,
+)
+from app.services.calendar_service import create_calendar_event, delete_invite_events, link_invite_event
+from app.services.email_compaction import compact_for_analysis, compaction_stats
+from app.services.email_service import create_email, get_existing_email_ids
+from app.services.event_extractor import extract_schedule, fast_path_stats
+from app.services.ics_ingest import ingest_invite, invite_stats
+from app.services.llm_metrics import capture_llm_metrics
+from app.services.llm_provider import get_provider, run_async
+from app.services.llm_router import model_router
+from app.services.mime_body import body_parse_stats
+from app.services.spam_classifier import record_verdict, spam_filter
+from LLM import prompt_cache_stats
 
 logger = get_logger(__name__)
 
 
+class AnalysisFailed(RuntimeError):
+    """The LLM returned no usable analysis for a message."""
+
+
 def process_unread_emails(
     db: Session, user_id: int, max_results: int
 ) -> Tuple[int, int, str]:
-    messages = gmail.fetch_emails(db, str(user_id), max_results)
-    if not messages:
-        return 0, 0, "No new emails to process"
+    """Synchronous entry point; runs the concurrent engine to completion.
+
+    Must be called from a thread without a running event loop (FastAPI runs
+    sync endpoints in its threadpool, so the route handler qualifies).
+    """
+    return run_async(process_unread_emails_async(db, user_id, max_results))
+
+
+def process_unread_emails_with_stats(
+    db: Session, user_id: int, max_results: int
+) -> Tuple[int, int, str, Dict[str, Any]]:
+    """Like ``process_unread_emails`` but also returns stats for this run.
+
+    The stats hold message counts, wall time and the per-operation/per-model
+    LLM metrics (calls, outcomes, parse failures, latency and token
+    histograms) of the calls made during the run.
+    """
+    return run_async(_process_unread_emails(db, user_id, max_results, None))
+
+
+async def process_unread_emails_async(
+    db: Session,
+    user_id: int,
+    max_results: int,
+    concurrency: Optional[int] = None,
+) -> Tuple[int, int, str]:
+    """Fetch, analyze and store unread emails concurrently.
+
+    ``db`` is only used for the dedup queries and the sync cursor; every message task
+    opens its own session, so a slow or failing email never blocks the others.
+    At most ``concurrency`` messages (default ``EMAIL_PROCESS_CONCURRENCY``)
+    are in flight at once. With ``LLM_ANALYSIS_BATCH_SIZE`` > 1 the analysis
+    step packs several emails into each LLM request.
+    """
+    processed, created_events, message, _ = await _process_unread_emails(
+        db, user_id, max_results, concurrency
+    )
+    return processed, created_events, message
+
+
+async def _process_unread_emails(
+    db: Session,
+    user_id: int,
+    max_results: int,
+    concurrency: Optional[int],
+) -> Tuple[int, int, str, Dict[str, Any]]:
+    started = time.monotonic()
+    with capture_llm_metrics() as run_metrics:
+        processed, created_events, message, counts = await _run_pipeline(
+            db, user_id, max_results, concurrency
+        )
+    stats = {
+        **counts,
+        "duration_seconds": round(time.monotonic() - started, 3),
+        "llm": run_metrics.snapshot(),
+    }
+    return processed, created_events, message, stats
+
 
+async def _run_pipeline(
+    db: Session,
+    user_id: int,
+    max_results: int,
+    concurrency: Optional[int],
+) -> Tuple[int, int, str, Dict[str, Any]]:
+    """List unread mail page by page and process each page as it arrives.
+
+    While one page is being processed the next ``messages.list`` page is
+    already being fetched, and only those two pages are held in memory. The
+    listing runs on its own session because it overlaps with the dedup
+    queries on ``db``.
+    """
+    counts: Dict[str, Any] = {"listed": 0, "already_processed": 0, "failed": 0}
+    semaphore = asyncio.Semaphore(concurrency or settings.EMAIL_PROCESS_CONCURRENCY)
+    seen_message_ids: set = set()
+    handled: List[str] = []
     processed = 0
     created_events = 0
 
+    list_db = SessionLocal()
+    next_page = None
+    try:
+        batch = await asyncio.to_thread(_list_messages, list_db, user_id, max_results)
+        counts["sync_mode"] = batch.mode
+        next_page = asyncio.ensure_future(asyncio.to_thread(next, batch.pages, None))
+        while True:
+            page = await next_page
+            if page is None:
+                break
+            # 先发起下一页的请求，再处理当前页
+            next_page = asyncio.ensure_future(asyncio.to_thread(next, batch.pages, None))
+            page_processed, page_events = await _process_page(
+                db, user_id, page, semaphore, counts, seen_message_ids, handled
+            )
+            processed += page_processed
+            created_events += page_events
+    finally:
+        if next_page is not None and not next_page.done():
+            # 处理失败时等待进行中的翻页请求结束，再关闭它使用的 session
+            await asyncio.wait([next_page])
+        list_db.close()
+
+    # 有失败的邮件时不推进游标，下次增量同步还能列出它们（已处理的会被去重跳过）
+    if not counts["failed"]:
+        await asyncio.to_thread(_save_cursor, db, user_id, batch)
+    if handled and settings.GMAIL_MARK_PROCESSED_ENABLED:
+        counts["marked_processed"] = await asyncio.to_thread(_mark_processed, user_id, handled)
+    if not counts["listed"]:
+        return 0, 0, "No new emails to process", counts
+
+    logger.info("Analysis cache stats: %s", analysis_cache.stats())
+    logger.info("Spam classifier stats: %s", spam_filter.stats())
+    logger.info("Body compaction stats: %s", compaction_stats.snapshot())
+    logger.info("Body parsing stats: %s", body_parse_stats.snapshot())
+    logger.info("Fast-path extractor stats: %s", fast_path_stats())
+    logger.info("Calendar invite stats: %s", invite_stats())
+    logger.info("Prompt prefix cache stats: %s", prompt_cache_stats.snapshot())
+    logger.info("LLM provider stats: %s", get_provider().stats())
+    logger.info("LLM routing stats: %s", model_router.stats())
+    message = f"Successfully processed {processed} emails, created {created_events} calendar events"
+    return processed, created_events, message, counts
+
+
+async def _process_page(
+    db: Session,
+    user_id: int,
+    messages: List[Dict[str, Any]],
+    semaphore: asyncio.Semaphore,
+    counts: Dict[str, Any],
+    seen_message_ids: set,
+    handled: List[str],
+) -> Tuple[int, int]:
+    """Dedup, filter, fetch and analyze one listing page.
+
+    Ids the run is done with (stored now or before, judged spam, or dropped
+    on metadata) are appended to ``handled`` so they can be labelled in Gmail
+    after the run and are not listed again. Failed ids are left unlabelled.
+    """
+    email_ids: List[str] = []
     for msg in messages:
         email_id = msg.get("id")
         if not email_id:
             logger.warning("Skipping message with missing id")
             continue
+        email_ids.append(str(email_id))
+    if not email_ids:
+        return 0, 0
 
-        if get_email_by_email_id(db, str(email_id)):
+    existing = await asyncio.to_thread(get_existing_email_ids, db, email_ids)
+    for email_id in email_ids:
+        if email_id in existing:
             logger.info("Email %s already processed, skipping", email_id)
-            continue
+    pending = [email_id for email_id in email_ids if email_id not in existing]
+    handled.extend(email_id for email_id in email_ids if email_id in existing)
+    counts["listed"] += len(email_ids)
+    counts["already_processed"] += len(email_ids) - len(pending)
 
-        email_data = gmail.get_email(db, str(user_id), email_id)
-        result = analyze_email(
-            email_content=email_data.get("body_text", ""),
-            sender=email_data.get("from"),
-            subject=email_data.get("subject"),
-            recipients=email_data.get("to"),
+    prefetched: Dict[str, Dict[str, Any]] = {}
+    if settings.GMAIL_BATCH_FETCH_ENABLED and pending:
+        if settings.GMAIL_TWO_PHASE_FETCH_ENABLED:
+            # 第一阶段：只取头部和摘要，过滤掉的邮件不再下载正文
+            metadata = await asyncio.to_thread(_fetch_metadata_batch, user_id, pending)
+            survivors = _filter_on_metadata(pending, metadata, counts, seen_message_ids)
+            handled.extend(email_id for email_id in pending if email_id not in survivors)
+            pending = survivors
+        if pending:
+            prefetched = await asyncio.to_thread(_fetch_messages_batch, user_id, pending)
+
+    if settings.LLM_ANALYSIS_BATCH_SIZE > 1:
+        results = await _process_batched(user_id, pending, semaphore, prefetched)
+    else:
+        results = await asyncio.gather(
+            *(_process_message(user_id, email_id, semaphore, prefetched) for email_id in pending),
+            return_exceptions=True,
         )
 
-        if not result or not result.get("success"):
-            logger.warning("LLM analyze failed for email %s", email_id)
+    processed = 0
+    created_events = 0
+    for email_id, outcome in zip(pending, results):
+        if isinstance(outcome, AnalysisFailed):
+            logger.warning("%s", outcome)
+            counts["failed"] += 1
             continue
+        if isinstance(outcome, BaseException):
+            logger.error(
+                "Failed to process email %s: %s",
+                email_id,
+                outcome,
+                exc_info=outcome,
+            )
+            counts["failed"] += 1
+            continue
+        processed += outcome[0]
+        created_events += outcome[1]
+        # (0, 0) 是垃圾邮件，同样打标签，否则每次运行都会重新列出
+        handled.append(email_id)
+    return processed, created_events
 
-        data = result.get("data") or {}
-        is_spam = bool(data.get("is_spam"))
-        judge_reason = data.get("judge_reason") or ""
-        is_schedule = bool(data.get("is_schedule"))
-        events = data.get("events", [])
 
-        if is_spam:
-            logger.info(
-                "Skipping spam email %s: subject='%s'",
-                email_id,
-                email_data.get("subject"),
+async def _process_message(
+    user_id: int,
+    email_id: str,
+    semaphore: asyncio.Semaphore,
+    prefetched: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Tuple[int, int]:
+    """Run one message through fetch -> analyze -> store.
+
+    Messages already in ``prefetched`` (batch-fetched) skip the fetch.
+    Returns ``(processed, created_events)`` for this message.
+    """
+    async with semaphore:
+        email_data = (prefetched or {}).get(email_id)
+        if email_data is None:
+            email_data = await asyncio.to_thread(_fetch_message, user_id, email_id)
+        if _classified_as_spam(email_id, email_data, spam_filter.score_batch([email_data])[0]):
+            return 0, 0
+
+        result = await _invite_path(user_id, email_id, email_data)
+        if result is None:
+            content = compact_for_analysis(email_data.get("body_text"))
+            result = _fast_path(email_id, content, email_data)
+        if result is None:
+            result = await analyze_email_cached_async(
+                email_content=content,
+                sender=email_data.get("from"),
+                subject=email_data.get("subject"),
+                recipients=_recipients(email_data),
             )
+
+        return await _handle_analysis(user_id, email_id, email_data, result)
+
+
+async def _process_batched(
+    user_id: int,
+    email_ids: List[str],
+    semaphore: asyncio.Semaphore,
+    prefetched: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> List[Any]:
+    """Batch-mode pipeline: fetch all, analyze in packed requests, then store.
+
+    Returns one outcome per email id, aligned with ``email_ids``; failures
+    are returned as exceptions like ``asyncio.gather(return_exceptions=True)``.
+    """
+
+    async def _fetch(email_id: str) -> Dict[str, Any]:
+        if prefetched and email_id in prefetched:
+            return prefetched[email_id]
+        async with semaphore:
+            return await asyncio.to_thread(_fetch_message, user_id, email_id)
+
+    fetched = await asyncio.gather(*(_fetch(e) for e in email_ids), return_exceptions=True)
+    email_data_by_id = {
+        email_id: data
+        for email_id, data in zip(email_ids, fetched)
+        if not isinstance(data, BaseException)
+    }
+
+    # 本地分类器一次性给整批打分，高置信度垃圾邮件不再调用 LLM
+    scores = spam_filter.score_batch(list(email_data_by_id.values()))
+    skipped = {
+        email_id
+        for (email_id, data), score in zip(email_data_by_id.items(), scores)
+        if _classified_as_spam(email_id, data, score)
+    }
+
+    # 带日历邀请的邮件直接解析 ICS，不进入 LLM 批次
+    invite_ids = [
+        email_id
+        for email_id, data in email_data_by_id.items()
+        if email_id not in skipped and data.get("calendar_parts")
+    ]
+    invites = await asyncio.gather(
+        *(_invite_path(user_id, email_id, email_data_by_id[email_id]) for email_id in invite_ids)
+    )
+    invite_results = {
+        email_id: result for email_id, result in zip(invite_ids, invites) if result is not None
+    }
+
+    contents = {
+        email_id: compact_for_analysis(data.get("body_text"))
+        for email_id, data in email_data_by_id.items()
+        if email_id not in skipped and email_id not in invite_results
+    }
+    fast_results = {}
+    for email_id, content in contents.items():
+        result = _fast_path(email_id, content, email_data_by_id[email_id])
+        if result is not None:
+            fast_results[email_id] = result
+
+    analyses = await analyze_email_batch_cached_async(
+        [
+            {
+                "id": email_id,
+                "content": content,
+                "sender": email_data_by_id[email_id].get("from"),
+                "subject": email_data_by_id[email_id].get("subject"),
+                "recipients": _recipients(email_data_by_id[email_id]),
+            }
+            for email_id, content in contents.items()
+            if email_id not in fast_results
+        ],
+        max_batch_tokens=settings.LLM_BATCH_TOKEN_BUDGET,
+        max_batch_emails=settings.LLM_ANALYSIS_BATCH_SIZE,
+        concurrency=settings.EMAIL_PROCESS_CONCURRENCY,
+    )
+
+    analyses.update(fast_results)
+    analyses.update(invite_results)
+    analyzed = list(contents) + list(invite_results)
+    stored = await asyncio.gather(
+        *(
+            _handle_analysis(user_id, email_id, email_data_by_id[email_id], analyses.get(email_id))
+            for email_id in analyzed
+        ),
+        return_exceptions=True,
+    )
+    outcomes: Dict[str, Any] = dict.fromkeys(skipped, (0, 0))
+    outcomes.update(zip(analyzed, stored))
+    return [
+        outcomes.get(email_id, fetch_result)
+        for email_id, fetch_result in zip(email_ids, fetched)
+    ]
+
+
+async def _handle_analysis(
+    user_id: int,
+    email_id: str,
+    email_data: Dict[str, Any],
+    result: Optional[Dict[str, Any]],
+) -> Tuple[int, int]:
+    if not result or not result.get("success"):
+        # 按失败处理，这样同步游标不会越过这封邮件，下次还会重新列出
+        raise AnalysisFailed(f"LLM analyze failed for email {email_id}")
+
+    data = result.get("data") or {}
+    if bool(data.get("is_spam")):
+        logger.info(
+            "Skipping spam email %s: subject='%s'",
+            email_id,
+            email_data.get("subject"),
+        )
+        await asyncio.to_thread(_record_verdict, user_id, email_id, email_data, True)
+        return 0, 0
+
+    return await asyncio.to_thread(_store_analysis, user_id, email_id, email_data, data)
+
+
+async def _invite_path(
+    user_id: int, email_id: str, email_data: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    if not settings.ICS_INGEST_ENABLED or not email_data.get("calendar_parts"):
+        return None
+    result = await asyncio.to_thread(_ingest_invite, user_id, email_id, email_data)
+    if result is not None:
+        logger.info("Email %s carries a calendar invite, skipping LLM", email_id)
+    return result
+
+
+def _ingest_invite(
+    user_id: int, email_id: str, email_data: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    sessions: List[Session] = []
+
+    def _fetch_attachment(attachment_id: str) -> bytes:
+        # 只有内联部分解析不出事件时才下载附件
+        if not sessions:
+            sessions.append(SessionLocal())
+        return gmail.get_attachment(sessions[0], str(user_id), email_id, attachment_id)
+
+    try:
+        return ingest_invite(email_data["calendar_parts"], _fetch_attachment, email_data.get("subject"))
+    finally:
+        for db in sessions:
+            db.close()
+
+
+def _recipients(email_data: Dict[str, Any]) -> Optional[str]:
+    """To and Cc as one header value; the analysis extracts participants from both."""
+    return ", ".join(value for value in (email_data.get("to"), email_data.get("cc")) if value) or None
+
+
+def _fast_path(
+    email_id: str, content: str, email_data: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    if not settings.FAST_PATH_EXTRACTOR_ENABLED:
+        return None
+    result = extract_schedule(content, email_data.get("subject"))
+    if result is not None:
+        logger.info("Email %s matched a schedule template, skipping LLM", email_id)
+    return result
+
+
+def _classified_as_spam(
+    email_id: str, email_data: Dict[str, Any], probability: Optional[float]
+) -> bool:
+    if not spam_filter.is_confident_spam(probability):
+        return False
+    logger.info(
+        "Skipping spam email %s without LLM (p=%.3f): subject='%s'",
+        email_id,
+        probability,
+        email_data.get("subject"),
+    )
+    return True
+
+
+def _fetch_message(user_id: int, email_id: str) -> Dict[str, Any]:
+    db = SessionLocal()
+    try:
+        return gmail.get_email(db, str(user_id), email_id)
+    finally:
+        db.close()
+
+
+def _list_messages(db: Session, user_id: int, max_results: int) -> mailbox_sync.SyncBatch:
+    if settings.GMAIL_INCREMENTAL_SYNC_ENABLED:
+        return mailbox_sync.list_new_messages(db, user_id, max_results)
+    return mailbox_sync.SyncBatch(
+        gmail.iter_message_pages(db, str(user_id), max_results), mailbox_sync.FULL, None
+    )
+
+
+def _save_cursor(db: Session, user_id: int, batch: mailbox_sync.SyncBatch) -> None:
+    try:
+        mailbox_sync.save_cursor(db, user_id, batch)
+    except Exception as e:  # noqa: BLE001
+        db.rollback()
+        logger.warning("Failed to save sync cursor for user %s: %s", user_id, e)
+
+
+def _mark_processed(user_id: int, email_ids: List[str]) -> int:
+    """Best-effort: a failed batchModify only means the mail is listed again next run."""
+    db = SessionLocal()
+    try:
+        return gmail.mark_processed(db, str(user_id), email_ids)
+    except Exception as e:  # noqa: BLE001
+        logger.warning("Failed to label processed emails for user %s: %s", user_id, e)
+        return 0
+    finally:
+        db.close()
+
+
+def _fetch_messages_batch(user_id: int, email_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Batch-fetch message bodies; messages missing from the result are fetched one by one later."""
+    db = SessionLocal()
+    try:
+        return gmail.get_emails_batch(db, str(user_id), email_ids, fields=gmail.FULL_MESSAGE_FIELDS)
+    except Exception as e:  # noqa: BLE001
+        logger.warning("Batch fetch failed, falling back to per-message fetch: %s", e)
+        return {}
+    finally:
+        db.close()
+
+
+def _fetch_metadata_batch(user_id: int, email_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        return gmail.get_email_metadata_batch(db, str(user_id), email_ids)
+    except Exception as e:  # noqa: BLE001
+        logger.warning("Metadata fetch failed, skipping metadata filters: %s", e)
+        return {}
+    finally:
+        db.close()
+
+
+def _filter_on_metadata(
+    email_ids: List[str],
+    metadata: Dict[str, Dict[str, Any]],
+    counts: Dict[str, Any],
+    seen_message_ids: Optional[set] = None,
+) -> List[str]:
+    """Drop duplicates, skipped senders/labels and confident spam before the body fetch.
+
+    Messages without metadata are kept. Drop reasons are added to
+    ``counts["filtered_on_metadata"]``; pass the same ``seen_message_ids``
+    for every page of a run so duplicates across pages are caught too.
+    """
+    dropped: Dict[str, int] = counts.setdefault("filtered_on_metadata", {})
+    if seen_message_ids is None:
+        seen_message_ids = set()
+    candidates = []
+    for email_id in email_ids:
+        meta = metadata.get(email_id)
+        if meta is None:
+            candidates.append(email_id)
             continue
+        reason = None
+        rfc_id = meta.get("message_id")
+        if rfc_id and rfc_id in seen_message_ids:
+            reason = "duplicate"
+        elif _sender_skipped(meta.get("from")):
+            reason = "sender"
+        elif set(meta.get("labelIds") or ()) & set(settings.INGEST_SKIP_LABELS):
+            reason = "label"
+        if rfc_id:
+            seen_message_ids.add(rfc_id)
+        if reason:
+            logger.info("Dropping email %s on metadata (%s): subject='%s'", email_id, reason, meta.get("subject"))
+            dropped[reason] = dropped.get(reason, 0) + 1
+        else:
+            candidates.append(email_id)
+
+    with_meta = [email_id for email_id in candidates if email_id in metadata]
+    scores = dict(zip(with_meta, spam_filter.score_batch([metadata[e] for e in with_meta])))
+    survivors = []
+    for email_id in candidates:
+        if email_id in scores and _classified_as_spam(email_id, metadata[email_id], scores[email_id]):
+            dropped["spam"] = dropped.get("spam", 0) + 1
+        else:
+            survivors.append(email_id)
+    return survivors
+
+
+def _sender_skipped(sender: Optional[str]) -> bool:
+    address = parseaddr(sender or "")[1].lower()
+    return bool(address) and any(
+        fnmatch.fnmatch(address, pattern.lower()) for pattern in settings.INGEST_SKIP_SENDERS
+    )
+
+
+def _store_analysis(
+    user_id: int, email_id: str, email_data: Dict[str, Any], data: Dict[str, Any]
+) -> Tuple[int, int]:
+    db = SessionLocal()
+    try:
+        outcome = _store_email_and_events(db, user_id, email_id, email_data, data)
+        _save_verdict(db, user_id, email_id, email_data, False)
+        return outcome
+    finally:
+        db.close()
+
+
+def _record_verdict(
+    user_id: int, email_id: str, email_data: Dict[str, Any], is_spam: bool
+) -> None:
+    db = SessionLocal()
+    try:
+        _save_verdict(db, user_id, email_id, email_data, is_spam)
+    finally:
+        db.close()
+
+
+def _save_verdict(
+    db: Session, user_id: int, email_id: str, email_data: Dict[str, Any], is_spam: bool
+) -> None:
+    """Keep the LLM verdict as classifier training data; never fails the email."""
+    try:
+        record_verdict(db, user_id, email_id, email_data, is_spam)
+    except Exception as e:  # noqa: BLE001
+        db.rollback()
+        logger.warning("Failed to record spam verdict for email %s: %s", email_id, e)
+
+
+def _store_email_and_events(
+    db: Session,
+    user_id: int,
+    email_id: str,
+    email_data: Dict[str, Any],
+    data: Dict[str, Any],
+) -> Tuple[int, int]:
+    judge_reason = data.get("judge_reason") or ""
+    is_schedule = bool(data.get("is_schedule"))
+    events = data.get("events", [])
+    created_events = 0
+
+    received_at = None
+    if email_data.get("date"):
+        try:
+            from email.utils import parsedate_to_datetime
+
+            received_at = parsedate_to_datetime(email_data["date"])
+        except Exception as e:  # noqa: BLE001
+            logger.warning("Failed to parse date: %s", e)
+            received_at = datetime.now()
+
+    email_create = EmailCreate(
+        user_id=user_id,
+        email_id=email_id,
+        thread_id=email_data.get("threadId"),
+        from_address=email_data.get("from"),
+        to_address=email_data.get("to"),
+        subject=email_data.get("subject"),
+        received_at=received_at,
+        snippet=judge_reason[:500] if judge_reason else email_data.get("snippet"),
+        body_text=email_data.get("body_text"),
+    )
+    db_email = create_email(db, email_create)
+    _replace_invite_events(db, user_id, email_id, events if is_schedule else [], data.get("cancelled_events") or [])
+
+    if is_schedule and events:
+        for event in events:
+            event_name = event.get("event_name") or email_data.get("subject") or "Meeting"
+            start_time = event.get("start_time")
+            end_time = event.get("end_time")
+            location = event.get("location") or None
+            participants_info = event.get("participants") or ""
+
+            if not start_time:
+                logger.debug("Event '%s' has no start_time, skipping", event_name)
+                continue
+
+            if not end_time:
+                end_time = start_time + timedelta(hours=1)
+                logger.debug("Event '%s': end_time missing, defaulted to %s", event_name, end_time.isoformat())
+
+            participants_list: List[str] = [p.strip() for p in participants_info.split(",") if p.strip()]
+            emails: List[str] = []
+            for item in participants_list:
+                emails.extend(re.findall(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}", item))
+            seen: set[str] = set()
+            valid_emails = [e for e in emails if not (e in seen or seen.add(e))]
+            attendee_emails = ",".join(valid_emails) or None
 
-        received_at = None
-        if email_data.get("date"):
             try:
-                from email.utils import parsedate_to_datetime
-
-                received_at = parsedate_to_datetime(email_data["date"])
-            except Exception as e:  # noqa: BLE001
-                logger.warning("Failed to parse date: %s", e)
-                received_at = datetime.now()
-
-        email_create = EmailCreate(
-            user_id=user_id,
-            email_id=email_id,
-            thread_id=email_data.get("threadId"),
-            from_address=email_data.get("from"),
-            to_address=email_data.get("to"),
-            subject=email_data.get("subject"),
-            received_at=received_at,
-            snippet=judge_reason[:500] if judge_reason else email_data.get("snippet"),
-            body_text=email_data.get("body_text"),
-        )
-        db_email = create_email(db, email_create)
-        processed += 1
-
-        if is_schedule and events:
-            for event in events:
-                event_name = event.get("event_name") or email_data.get("subject") or "Meeting"
-                start_time = event.get("start_time")
-                end_time = event.get("end_time")
-                location = event.get("location") or None
-                participants_info = event.get("participants") or ""
-
-                if not start_time:
-                    logger.debug("Event '%s' has no start_time, skipping", event_name)
-                    continue
-
-                if not end_time:
-                    end_time = start_time + timedelta(hours=1)
-                    logger.debug("Event '%s': end_time missing, defaulted to %s", event_name, end_time.isoformat())
-
-                participants_list: List[str] = [p.strip() for p in participants_info.split(",") if p.strip()]
-                emails: List[str] = []
-                for item in participants_list:
-                    emails.extend(re.findall(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}", item))
-                seen: set[str] = set()
-                valid_emails = [e for e in emails if not (e in seen or seen.add(e))]
-                attendee_emails = ",".join(valid_emails) or None
-
-                try:
-                    description_text = (
-                        f"From: {email_data.get('from')}\n"
-                        f"Subject: {email_data.get('subject')}\n"
-                        f"Summary: {judge_reason}\n"
-                        f"Location: {location or 'None'}\n"
-                        f"Participants: {participants_info or 'None'}"
-                    )
-                    calendar_event_data = CalendarEventCreate(
-                        user_id=user_id,
-                        email_id=db_email.id,
-                        summary=event_name,
-                        description=description_text,
-                        start_time=start_time,
-                        end_time=end_time,
-                        location=location,
-                        attendees=attendee_emails,
-                    )
-                    db_event = create_calendar_event(db, calendar_event_data)
-                    created_events += 1
-                    logger.info(
-                        "Stored calendar event '%s' from email %s -> db_id=%s",
-                        event_name,
-                        email_id,
-                        db_event.id,
-                    )
-                except Exception as ce:  # noqa: BLE001
-                    logger.error(
-                        "Failed to store calendar event '%s' from email %s: %s",
-                        event_name,
-                        email_id,
-                        ce,
-                        exc_info=True,
+                description_text = (
+                    f"From: {email_data.get('from')}\n"
+                    f"Subject: {email_data.get('subject')}\n"
+                    f"Summary: {judge_reason}\n"
+                    f"Location: {location or 'None'}\n"
+                    f"Participants: {participants_info or 'None'}"
+                )
+                calendar_event_data = CalendarEventCreate(
+                    user_id=user_id,
+                    email_id=db_email.id,
+                    summary=event_name,
+                    description=description_text,
+                    start_time=start_time,
+                    end_time=end_time,
+                    location=location,
+                    attendees=attendee_emails,
+                )
+                db_event = create_calendar_event(db, calendar_event_data)
+                if event.get("uid"):
+                    link_invite_event(
+                        db, user_id, event["uid"], event.get("occurrence_start") or start_time, db_event.id
                     )
-        else:
-            logger.debug(
-                "Email %s: no schedulable events detected (is_schedule=%s, events_count=%d)",
-                email_id,
-                is_schedule,
-                len(events),
-            )
+                created_events += 1
+                logger.info(
+                    "Stored calendar event '%s' from email %s -> db_id=%s",
+                    event_name,
+                    email_id,
+                    db_event.id,
+                )
+            except Exception as ce:  # noqa: BLE001
+                logger.error(
+                    "Failed to store calendar event '%s' from email %s: %s",
+                    event_name,
+                    email_id,
+                    ce,
+                    exc_info=True,
+                )
+    else:
+        logger.debug(
+            "Email %s: no schedulable events detected (is_schedule=%s, events_count=%d)",
+            email_id,
+            is_schedule,
+            len(events),
+        )
 
-        logger.info("Processed email %s: schedule=%s, events_created=%d", email_id, is_schedule, created_events)
+    logger.info("Processed email %s: schedule=%s, events_created=%d", email_id, is_schedule, created_events)
+    return 1, created_events
 
-    message = f"Successfully processed {processed} emails, created {created_events} calendar events"
-    return processed, created_events, message
+
+def _replace_invite_events(
+    db: Session,
+    user_id: int,
+    email_id: str,
+    events: List[Dict[str, Any]],
+    cancelled: List[Dict[str, Any]],
+) -> None:
+    """Delete rows stored from earlier versions of the invites (by UID) this email updates or cancels.
+
+    A VEVENT without RECURRENCE-ID stands for the whole series; one with it
+    only for that occurrence.
+    """
+    scopes: Dict[str, Optional[set]] = {}
+    for item in [*events, *cancelled]:
+        uid = item.get("uid")
+        if not uid:
+            continue
+        if item.get("recurrence_id") is None:
+            scopes[uid] = None
+        elif scopes.get(uid, set()) is not None:
+            scopes.setdefault(uid, set()).add(item["recurrence_id"])
+    for uid, occurrences in scopes.items():
+        try:
+            removed = delete_invite_events(db, user_id, uid, occurrences)
+        except Exception as e:  # noqa: BLE001
+            db.rollback()
+            logger.error("Failed to replace events of invite %s from email %s: %s", uid, email_id, e, exc_info=True)
+            continue
+        if removed:
+            logger.info("Email %s replaces or cancels %d stored events of invite %s", email_id, removed, uid)
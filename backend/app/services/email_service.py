@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import List, Optional, Set
 
 from sqlalchemy.orm import Session
 
@@ -25,6 +25,14 @@ def get_email_by_email_id(db: Session, email_id: str) -> Optional[Email]:
     return db.query(Email).filter(Email.email_id == email_id).first()
 
 
+def get_existing_email_ids(db: Session, email_ids: List[str]) -> Set[str]:
+    """Return the subset of Gmail message IDs that are already stored"""
+    if not email_ids:
+        return set()
+    rows = db.query(Email.email_id).filter(Email.email_id.in_(email_ids)).all()
+    return {row[0] for row in rows}
+
+
 def get_user_emails(
     db: Session, user_id: int, skip: int = 0, limit: int = 100
 ) -> List[Email]:
@@ -0,0 +1,142 @@
+"""Rule-based fast path for templated schedule emails.
+
+Room bookings, HR notices and similar system mail state the event as an
+explicit ``YYYY-MM-DD HH:MM-HH:MM`` line. ``extract_schedule`` recognises
+that shape with compiled patterns and returns the same result dict as
+``LLM.parse_json_response``, so the LLM round-trip can be skipped. Anything
+ambiguous or incomplete (no explicit range, several candidate events,
+relative dates, no scheduling keyword) returns ``None`` and the caller falls
+back to ``analyze_email``.
+"""
+from __future__ import annotations
+
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+from LLM import _convert_analysis_data, parse_date_from_string
+
+_DATE = r"(?P<date>\d{4}-\d{1,2}-\d{1,2}|\d{4}/\d{1,2}/\d{1,2}|\d{4}年\d{1,2}月\d{1,2}日)"
+_TIME = r"(?:[01]?\d|2[0-3])[:：][0-5]\d"
+# 日期后允许星期注释，例如 "2025-01-20 (Mon)" 或 "2025年1月20日（周一）"
+_WEEKDAY = r"(?:\s*[(（][^)）\n]{1,12}[)）])?"
+_RANGE_SEP = r"\s*(?:-|–|—|~|～|to|至|到)\s*"
+
+_EVENT_RE = re.compile(
+    _DATE
+    + _WEEKDAY
+    + r"[\s,，]*(?:from\s+|时间[:：]?\s*)?"
+    + rf"(?P<start>{_TIME})"
+    + rf"(?:{_RANGE_SEP}(?P<end>{_TIME}))?",
+    re.IGNORECASE,
+)
+_FIELD_RE = {
+    "name": re.compile(
+        r"^\s*(?:event|meeting|title|topic|会议名称|会议主题|活动名称|主题)\s*[:：]\s*(?P<value>.+?)\s*$",
+        re.IGNORECASE | re.MULTILINE,
+    ),
+    "location": re.compile(
+        r"^\s*(?:location|venue|room|place|where|地点|会议室|地址)\s*[:：]\s*(?P<value>.+?)\s*$",
+        re.IGNORECASE | re.MULTILINE,
+    ),
+    "participants": re.compile(
+        r"^\s*(?:attendees|participants|invitees|参会人员|参与人员|参加人员|与会人员)\s*[:：]\s*(?P<value>.+?)\s*$",
+        re.IGNORECASE | re.MULTILINE,
+    ),
+}
+_SCHEDULE_KEYWORD_RE = re.compile(
+    r"meeting|booking|booked|reservation|reserved|interview|training|workshop|"
+    r"session|appointment|invitation|seminar|conference|review|"
+    r"会议|预订|预约|面试|培训|通知|讲座|活动|例会",
+    re.IGNORECASE,
+)
+_RELATIVE_DATE_RE = re.compile(
+    r"\b(today|tomorrow|tonight|next (week|month|monday|tuesday|wednesday|thursday|friday)|"
+    r"this (week|afternoon|morning|evening))\b|今天|明天|后天|下周|本周|下个月",
+    re.IGNORECASE,
+)
+_SUBJECT_PREFIX_RE = re.compile(r"^\s*((re|fw|fwd|回复|转发)\s*[:：]\s*)+", re.IGNORECASE)
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "fallbacks": 0}
+
+
+def extract_schedule(
+    email_content: Optional[str], subject: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """Return a ``parse_json_response``-shaped result, or None to use the LLM."""
+    result = _extract(email_content or "", subject or "")
+    with _stats_lock:
+        _stats["hits" if result else "fallbacks"] += 1
+    return result
+
+
+def fast_path_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats["hits"] + stats["fallbacks"]
+    stats["hit_rate"] = round(stats["hits"] / total, 4) if total else 0.0
+    return stats
+
+
+def _extract(content: str, subject: str) -> Optional[Dict[str, Any]]:
+    text = f"{subject}\n{content}"
+    if not _SCHEDULE_KEYWORD_RE.search(text) or _RELATIVE_DATE_RE.search(text):
+        return None
+
+    candidates = {
+        (match.group("date"), match.group("start"), match.group("end"))
+        for match in _EVENT_RE.finditer(content)
+    }
+    if len(candidates) != 1:
+        return None
+    date_str, start_str, end_str = candidates.pop()
+    if not end_str:
+        return None
+
+    event_date = parse_date_from_string(_normalize_date(date_str))
+    start, end = _normalize_time(start_str), _normalize_time(end_str)
+    if event_date is None or end <= start:
+        return None
+
+    fields = {key: _first_field(pattern, content) for key, pattern in _FIELD_RE.items()}
+    name = fields["name"] or _SUBJECT_PREFIX_RE.sub("", subject).strip()
+    if not name:
+        return None
+
+    location = fields["location"] or ""
+    return _convert_analysis_data(
+        {
+            "is_spam": False,
+            "summary": f"{name}: {event_date.isoformat()} {start}-{end}"
+            + (f" @ {location}" if location else ""),
+            "has_schedule": True,
+            "events": [
+                {
+                    "name": name,
+                    "date": event_date.isoformat(),
+                    "start_time": start,
+                    "end_time": end,
+                    "location": location,
+                    "participants": fields["participants"] or "",
+                }
+            ],
+        }
+    )
+
+
+def _first_field(pattern: re.Pattern, content: str) -> Optional[str]:
+    values: List[str] = [m.group("value") for m in pattern.finditer(content)]
+    # 同一字段出现多个不同的值，说明不是单一事件模板
+    return values[0] if len(set(values)) == 1 else None
+
+
+def _normalize_date(date_str: str) -> str:
+    parts = re.split(r"[-/年月日]", date_str)
+    year, month, day = (int(p) for p in parts if p)
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+
+def _normalize_time(time_str: str) -> str:
+    hour, minute = time_str.replace("：", ":").split(":")
+    return f"{int(hour):02d}:{minute}"
@@ -1,44 +1,443 @@
 from base64 import urlsafe_b64decode, urlsafe_b64encode
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 import email
+import email.errors
 import html as _html
 import re
+import threading
+import time
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
-from app.services.oauth import get_fresh_token
+from app.core.logging_config import get_logger
+from app.services.google_clients import gmail_service
+from app.services.message_store import message_store, store_enabled, view_for
+from app.services.mime_body import extract_body
+
+logger = get_logger(__name__)
+
+# Gmail 批量请求最多包含 100 个调用，messages.list 每页最多 500 条，batchModify 每次最多 1000 个 id
+GMAIL_BATCH_LIMIT = 100
+GMAIL_LIST_PAGE_LIMIT = 500
+GMAIL_MODIFY_LIMIT = 1000
+# 被限流的条目最多重试的轮数，每轮批次减半、等待时间翻倍
+_BATCH_MAX_ROUNDS = 4
+_BATCH_RETRY_BASE_DELAY = 1.0
+
+# 两阶段抓取第一阶段只取这些头部
+METADATA_HEADERS = ["From", "To", "Subject", "Date", "Message-ID"]
+
+
+def _part_fields(depth: int) -> str:
+    fields = "mimeType,filename,headers(name,value),body(attachmentId,data,size)"
+    if depth > 0:
+        fields += f",parts({_part_fields(depth - 1)})"
+    return fields
+
+
+# 第二阶段的 fields 掩码：去掉 labelIds、historyId、sizeEstimate 等正文解析用不到的字段
+FULL_MESSAGE_FIELDS = f"id,threadId,snippet,payload({_part_fields(4)})"
 
 
 def fetch_emails(
     db: Session, user_id: str, max_results: int = 10
 ) -> List[Dict[str, Any]]:
-    creds = _get_creds(db, user_id)
-    service = build("gmail", "v1", credentials=creds)
-    result = (
+    return [msg for page in iter_message_pages(db, user_id, max_results) for msg in page]
+
+
+def iter_message_pages(
+    db: Session,
+    user_id: str,
+    max_results: Optional[int] = None,
+    page_size: Optional[int] = None,
+    query: Optional[str] = None,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Yield ``messages.list`` pages lazily, following ``nextPageToken``.
+
+    Stops after ``max_results`` messages in total (None = the whole listing).
+    Each page is requested only when the previous one has been consumed.
+    ``query`` defaults to ``list_query()``. The generator returns True when
+    it stopped at ``max_results`` with a next page still pending.
+    """
+    service = gmail_service(db, user_id)
+    query = query if query is not None else list_query()
+    page_size = max(1, min(page_size or settings.GMAIL_LIST_PAGE_SIZE, GMAIL_LIST_PAGE_LIMIT))
+    remaining = max_results
+    page_token = None
+    while remaining is None or remaining > 0:
+        params: Dict[str, Any] = {
+            "userId": "me",
+            "labelIds": ["INBOX"],
+            "q": query,
+            "maxResults": page_size if remaining is None else min(page_size, remaining),
+        }
+        if page_token:
+            params["pageToken"] = page_token
+        result = service.users().messages().list(**params).execute()
+        messages = result.get("messages", [])
+        if remaining is not None:
+            remaining -= len(messages)
+        if messages:
+            yield messages
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            return False
+    return True
+
+
+def list_query() -> str:
+    """``GMAIL_LIST_QUERY``, excluding already-labelled mail when marking is enabled."""
+    query = settings.GMAIL_LIST_QUERY.strip()
+    if settings.GMAIL_MARK_PROCESSED_ENABLED and settings.GMAIL_PROCESSED_LABEL:
+        # Gmail 搜索里标签名的 "/" 和空格写作 "-"
+        label = re.sub(r"[/\s]+", "-", settings.GMAIL_PROCESSED_LABEL.strip())
+        query = f"{query} -label:{label}".strip()
+    return query
+
+
+_label_ids: Dict[Tuple[str, str], str] = {}
+_label_lock = threading.Lock()
+
+
+def ensure_label(db: Session, user_id: str, name: str) -> str:
+    """Id of the user label ``name``, creating it on first use (cached per process)."""
+    key = (str(user_id), name)
+    with _label_lock:
+        if key in _label_ids:
+            return _label_ids[key]
+    service = gmail_service(db, user_id)
+    labels = service.users().labels().list(userId="me").execute().get("labels", [])
+    label_id = next((label["id"] for label in labels if label.get("name") == name), None)
+    if label_id is None:
+        body = {"name": name, "labelListVisibility": "labelShow", "messageListVisibility": "show"}
+        label_id = service.users().labels().create(userId="me", body=body).execute()["id"]
+        logger.info("Created Gmail label '%s' for user %s", name, user_id)
+    with _label_lock:
+        _label_ids[key] = label_id
+    return label_id
+
+
+def mark_processed(
+    db: Session,
+    user_id: str,
+    email_ids: Iterable[str],
+    label_name: Optional[str] = None,
+    remove_unread: Optional[bool] = None,
+) -> int:
+    """Label handled messages (and optionally mark them read) with ``batchModify``.
+
+    Ids are sent in chunks of ``GMAIL_MODIFY_LIMIT``; returns how many were modified.
+    """
+    ids = list(dict.fromkeys(str(email_id) for email_id in email_ids))
+    if not ids:
+        return 0
+    label_name = label_name or settings.GMAIL_PROCESSED_LABEL
+    remove_unread = settings.GMAIL_MARK_PROCESSED_REMOVE_UNREAD if remove_unread is None else remove_unread
+    body: Dict[str, Any] = {}
+    if label_name:
+        body["addLabelIds"] = [ensure_label(db, user_id, label_name)]
+    if remove_unread:
+        body["removeLabelIds"] = ["UNREAD"]
+    if not body:
+        return 0
+    service = gmail_service(db, user_id)
+    for start in range(0, len(ids), GMAIL_MODIFY_LIMIT):
+        chunk = ids[start : start + GMAIL_MODIFY_LIMIT]
+        service.users().messages().batchModify(userId="me", body=dict(body, ids=chunk)).execute()
+    return len(ids)
+
+
+class HistoryExpiredError(Exception):
+    """The start historyId is older than Gmail keeps history for; a full sync is needed."""
+
+
+def watch_mailbox(
+    db: Session, user_id: str, topic_name: str, label_ids: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """Register push notifications (``users.watch``); returns ``{"historyId", "expiration"}``.
+
+    Gmail drops the watch after 7 days, so it has to be renewed periodically.
+    """
+    service = gmail_service(db, user_id)
+    body = {
+        "topicName": topic_name,
+        "labelIds": label_ids or ["INBOX"],
+        "labelFilterBehavior": "include",
+    }
+    return service.users().watch(userId="me", body=body).execute()
+
+
+def stop_watch(db: Session, user_id: str) -> None:
+    service = gmail_service(db, user_id)
+    service.users().stop(userId="me").execute()
+
+
+def get_history_id(db: Session, user_id: str) -> str:
+    """Current mailbox historyId (``users.getProfile``)."""
+    service = gmail_service(db, user_id)
+    return str(service.users().getProfile(userId="me").execute()["historyId"])
+
+
+def list_history(
+    db: Session, user_id: str, start_history_id: str, max_results: int = 100
+) -> Tuple[List[Dict[str, Any]], str]:
+    """Unread inbox messages added since ``start_history_id``.
+
+    Returns ``(messages, history_id)`` where messages have the same
+    ``{"id", "threadId"}`` shape as ``fetch_emails`` and ``history_id`` is
+    the cursor to resume from. When more than ``max_results`` messages were
+    added, listing stops after the history record that reached the cap and
+    the returned cursor points at that record, so nothing is skipped.
+    Raises ``HistoryExpiredError`` when Gmail no longer has the start point.
+    """
+    service = gmail_service(db, user_id)
+    messages: Dict[str, Dict[str, Any]] = {}
+    cursor = str(start_history_id)
+    page_token = None
+    while True:
+        try:
+            response = (
+                service.users()
+                .history()
+                .list(
+                    userId="me",
+                    startHistoryId=start_history_id,
+                    historyTypes=["messageAdded"],
+                    labelId="INBOX",
+                    pageToken=page_token,
+                )
+                .execute()
+            )
+        except HttpError as e:
+            if getattr(e.resp, "status", None) == 404:
+                raise HistoryExpiredError(f"historyId {start_history_id} has expired") from e
+            raise
+
+        for record in response.get("history", []):
+            for added in record.get("messagesAdded", []):
+                msg = added.get("message") or {}
+                labels = msg.get("labelIds")
+                if msg.get("id") and (labels is None or "UNREAD" in labels):
+                    messages.setdefault(msg["id"], {"id": msg["id"], "threadId": msg.get("threadId")})
+            cursor = str(record.get("id", cursor))
+            if len(messages) >= max_results:
+                return list(messages.values()), cursor
+
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return list(messages.values()), str(response.get("historyId", cursor))
+
+
+def get_email(db: Session, user_id: str, email_id: str) -> Dict[str, Any]:
+    return _parse_message(email_id, _get_raw_message(db, user_id, email_id))
+
+
+def _get_raw_message(db: Session, user_id: str, email_id: str) -> Dict[str, Any]:
+    """``messages.get`` (format=full), served from the local message store when possible."""
+    if store_enabled():
+        msg = message_store.get(user_id, email_id)
+        if msg is not None:
+            return msg
+    service = gmail_service(db, user_id)
+    msg = (
         service.users()
         .messages()
-        .list(userId="me", labelIds=["INBOX"], q="is:unread", maxResults=max_results)
+        .get(userId="me", id=email_id, format="full")
         .execute()
     )
-    return result.get("messages", [])
+    if store_enabled():
+        message_store.put(user_id, email_id, msg)
+    return msg
 
 
-def get_email(db: Session, user_id: str, email_id: str) -> Dict[str, Any]:
-    creds = _get_creds(db, user_id)
-    service = build("gmail", "v1", credentials=creds)
-    msg = (
+def get_emails_batch(
+    db: Session,
+    user_id: str,
+    email_ids: Iterable[str],
+    batch_size: Optional[int] = None,
+    fields: Optional[str] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Fetch many messages with batch HTTP requests.
+
+    Up to ``batch_size`` (default ``GMAIL_BATCH_SIZE``, at most 100)
+    ``messages.get`` calls share one round-trip. Results have the same shape
+    as ``get_email`` and are keyed by id. Rate-limited items are retried in
+    smaller batches after a backoff; items that still fail are logged and left
+    out, so callers can fall back to ``get_email`` for them. ``fields``
+    (e.g. ``FULL_MESSAGE_FIELDS``) trims the response to what parsing needs.
+    Messages already in the local message store are not requested; trimmed
+    responses are stored under their ``fields`` view so ``get_email`` never
+    sees them.
+    """
+    ids = list(dict.fromkeys(email_ids))
+    results: Dict[str, Dict[str, Any]] = {}
+    view = view_for(fields)
+    if store_enabled():
+        for email_id, msg in message_store.get_many(user_id, ids, view).items():
+            results[email_id] = _parse_message(email_id, msg)
+    missing = [email_id for email_id in ids if email_id not in results]
+    if not missing:
+        return results
+
+    fetched: Dict[str, Dict[str, Any]] = {}
+
+    def _parse_and_keep(email_id: str, msg: Dict[str, Any]) -> Dict[str, Any]:
+        fetched[email_id] = msg
+        return _parse_message(email_id, msg)
+
+    request_kwargs: Dict[str, Any] = {"format": "full"}
+    if fields:
+        request_kwargs["fields"] = fields
+    results.update(_batch_get(db, user_id, missing, batch_size, request_kwargs, _parse_and_keep))
+    if store_enabled():
+        message_store.put_many(user_id, fetched, view)
+    return results
+
+
+def get_email_metadata_batch(
+    db: Session,
+    user_id: str,
+    email_ids: Iterable[str],
+    batch_size: Optional[int] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Headers, labels and snippet of many messages (``format=metadata``), batched like ``get_emails_batch``.
+
+    Each result has the ``get_email`` keys with the snippet as ``body_text``,
+    plus ``message_id`` (RFC 822 Message-ID), ``labelIds`` and ``size_estimate``.
+    """
+    request_kwargs = {"format": "metadata", "metadataHeaders": METADATA_HEADERS}
+    return _batch_get(db, user_id, email_ids, batch_size, request_kwargs, _parse_metadata)
+
+
+def get_attachment(db: Session, user_id: str, email_id: str, attachment_id: str) -> bytes:
+    service = gmail_service(db, user_id)
+    result = (
         service.users()
         .messages()
-        .get(userId="me", id=email_id, format="full")
+        .attachments()
+        .get(userId="me", messageId=email_id, id=attachment_id)
         .execute()
     )
+    data = result.get("data") or ""
+    return urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _batch_get(
+    db: Session,
+    user_id: str,
+    email_ids: Iterable[str],
+    batch_size: Optional[int],
+    request_kwargs: Dict[str, Any],
+    parse: Callable[[str, Dict[str, Any]], Dict[str, Any]],
+) -> Dict[str, Dict[str, Any]]:
+    service = gmail_service(db, user_id)
+    batch_size = max(1, min(batch_size or settings.GMAIL_BATCH_SIZE, GMAIL_BATCH_LIMIT))
+    pending = list(dict.fromkeys(email_ids))
+    results: Dict[str, Dict[str, Any]] = {}
+    delay = _BATCH_RETRY_BASE_DELAY
+
+    for round_no in range(_BATCH_MAX_ROUNDS):
+        throttled: List[str] = []
+        for i in range(0, len(pending), batch_size):
+            throttled.extend(
+                _execute_batch(service, pending[i : i + batch_size], results, request_kwargs, parse)
+            )
+        if not throttled:
+            break
+        pending = throttled
+        if round_no + 1 < _BATCH_MAX_ROUNDS:
+            logger.info("Gmail batch rate limited for %d messages, retrying in %.1fs", len(pending), delay)
+            batch_size = max(1, batch_size // 2)
+            time.sleep(delay)
+            delay *= 2
+    else:
+        logger.warning("Gmail batch gave up on %d rate-limited messages", len(pending))
+    return results
+
+
+def _execute_batch(
+    service: Any,
+    email_ids: List[str],
+    results: Dict[str, Dict[str, Any]],
+    request_kwargs: Dict[str, Any],
+    parse: Callable[[str, Dict[str, Any]], Dict[str, Any]],
+) -> List[str]:
+    """Run one batch request; parsed messages go into ``results``, rate-limited ids are returned."""
+    throttled: List[str] = []
+
+    def _callback(request_id: str, response: Dict[str, Any], exception: Optional[Exception]) -> None:
+        if exception is None:
+            results[request_id] = parse(request_id, response)
+        elif _is_rate_limited(exception):
+            throttled.append(request_id)
+        else:
+            logger.warning("Gmail batch fetch failed for %s: %s", request_id, exception)
+
+    batch = service.new_batch_http_request(callback=_callback)
+    for email_id in email_ids:
+        batch.add(
+            service.users().messages().get(userId="me", id=email_id, **request_kwargs),
+            request_id=email_id,
+        )
+    try:
+        batch.execute()
+    except HttpError as e:
+        if _is_rate_limited(e):
+            return [email_id for email_id in email_ids if email_id not in results]
+        logger.warning("Gmail batch request failed: %s", e)
+    return throttled
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    if not isinstance(error, HttpError):
+        return False
+    status = getattr(error.resp, "status", None)
+    if status == 429:
+        return True
+    content = error.content or b""
+    return status == 403 and (b"rateLimitExceeded" in content or b"userRateLimitExceeded" in content)
+
+
+def is_permanent_send_error(error: Exception) -> bool:
+    """True when retrying the same send cannot succeed (bad request, invalid recipient).
+
+    Gmail answers those with a 4xx status (an invalid To header is a 400);
+    401 (token refresh), 408, 429 and rate-limit 403s are transient. A
+    message whose headers cannot be built is permanent too.
+    """
+    if isinstance(error, HttpError):
+        status = getattr(error.resp, "status", None)
+        return (
+            isinstance(status, int)
+            and 400 <= status < 500
+            and status not in (401, 408, 429)
+            and not _is_rate_limited(error)
+        )
+    return isinstance(error, email.errors.MessageError)
+
+
+def _parse_metadata(email_id: str, msg: Dict[str, Any]) -> Dict[str, Any]:
+    headers = {h["name"].lower(): h["value"] for h in msg.get("payload", {}).get("headers", [])}
+    return {
+        "id": email_id,
+        "threadId": msg.get("threadId"),
+        "snippet": msg.get("snippet"),
+        "from": headers.get("from"),
+        "to": headers.get("to"),
+        "subject": headers.get("subject"),
+        "date": headers.get("date"),
+        "body_text": _html.unescape(msg.get("snippet") or ""),
+        "message_id": headers.get("message-id"),
+        "labelIds": msg.get("labelIds", []),
+        "size_estimate": msg.get("sizeEstimate"),
+    }
+
 
+def _parse_message(email_id: str, msg: Dict[str, Any]) -> Dict[str, Any]:
     headers = {h["name"]: h["value"] for h in msg.get("payload", {}).get("headers", [])}
-    body_text = _extract_body(msg.get("payload", {}))
+    body = extract_body(msg.get("payload", {}))
 
     return {
         "id": email_id,
@@ -46,23 +445,21 @@ def get_email(db: Session, user_id: str, email_id: str) -> Dict[str, Any]:
         "snippet": msg.get("snippet"),
         "from": headers.get("From"),
         "to": headers.get("To"),
+        "cc": headers.get("Cc"),
         "subject": headers.get("Subject"),
         "date": headers.get("Date"),
-        "body_text": body_text,
+        "body_text": body.text,
+        "body_source": body.source,
+        "body_truncated": body.truncated,
+        "calendar_parts": body.calendar_parts,
     }
 
 
 def reply_email(
     db: Session, user_id: str, email_id: str, content: str
 ) -> Dict[str, Any]:
-    creds = _get_creds(db, user_id)
-    service = build("gmail", "v1", credentials=creds)
-    original = (
-        service.users()
-        .messages()
-        .get(userId="me", id=email_id, format="full")
-        .execute()
-    )
+    original = _get_raw_message(db, user_id, email_id)
+    service = gmail_service(db, user_id)
 
     headers = {
         h["name"]: h["value"] for h in original.get("payload", {}).get("headers", [])
@@ -88,32 +485,6 @@ def reply_email(
     )
 
 
-def _get_creds(db: Session, user_id: str) -> Credentials:
-    access_token = get_fresh_token(db, user_id)
-    creds = Credentials(
-        access_token,
-        token_uri=settings.GOOGLE_TOKEN_URI,
-        client_id=settings.GOOGLE_CLIENT_ID,
-        client_secret=settings.GOOGLE_CLIENT_SECRET,
-        scopes=settings.GOOGLE_SCOPES,
-    )
-    return creds
-
-
-def _extract_body(payload: Dict[str, Any]) -> str:
-    d = payload.get("body", {}).get("data")
-    if d:
-        return urlsafe_b64decode(d.encode("utf-8")).decode("utf-8", errors="ignore")
-    for part in payload.get("parts", []):
-        if part.get("mimeType") == "text/plain":
-            d = part.get("body", {}).get("data")
-            if d:
-                return urlsafe_b64decode(d.encode("utf-8")).decode(
-                    "utf-8", errors="ignore"
-                )
-    return ""
-
-
 def _text_to_html(s: str) -> str:
     if not s:
         return ""
@@ -159,8 +530,7 @@ def send_email(
         }
     """
     try:
-        creds = _get_creds(db, user_id)
-        service = build("gmail", "v1", credentials=creds)
+        service = gmail_service(db, user_id)
         
         # 创建邮件消息
         mime_msg = email.message.EmailMessage()
@@ -200,5 +570,6 @@ def send_email(
             "success": False,
             "message_id": None,
             "thread_id": None,
-            "message": error_msg
+            "message": error_msg,
+            "permanent": is_permanent_send_error(e),
         }
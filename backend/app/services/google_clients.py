@@ -0,0 +1,126 @@
+"""Cached Gmail / Calendar service objects.
+
+``googleapiclient.discovery.build`` loads and parses the discovery document
+and builds the resource tree on every call, which used to happen once per
+Gmail request. ``get_service`` instead builds from a static discovery
+document (``GOOGLE_DISCOVERY_DIR`` if set, otherwise the copies bundled with
+google-api-python-client, so there is never a network fetch) and caches the
+service per thread and user.
+
+The cached ``Credentials`` object is shared with the service's authorized
+HTTP wrapper, so when ``get_fresh_token`` returns a refreshed token it is
+swapped into the existing credentials instead of rebuilding. The cache is
+per thread because the httplib2 transport underneath is not thread-safe;
+``asyncio.to_thread`` reuses pool threads, so each worker builds once.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Tuple
+
+from google.oauth2.credentials import Credentials
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.services.oauth import get_fresh_token
+
+GMAIL = ("gmail", "v1")
+CALENDAR = ("calendar", "v3")
+
+# 每个线程缓存的 service 上限
+_MAX_SERVICES_PER_THREAD = 64
+
+
+@lru_cache(maxsize=None)
+def load_discovery_document(api: str, version: str) -> str:
+    """Discovery JSON for ``api``/``version``, read once per process."""
+    if settings.GOOGLE_DISCOVERY_DIR:
+        path = os.path.join(settings.GOOGLE_DISCOVERY_DIR, f"{api}.{version}.json")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+    document = discovery_cache.get_static_doc(api, version)
+    if not document:
+        raise RuntimeError(f"No static discovery document for {api} {version}")
+    return document
+
+
+class ServiceCache:
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {"builds": 0, "hits": 0, "token_swaps": 0}
+
+    def get(self, api: str, version: str, user_key: str, access_token: str) -> Any:
+        services = self._services()
+        key = (api, version, user_key)
+        entry = services.pop(key, None)
+        if entry is None:
+            creds = _credentials(access_token)
+            service = build_from_document(load_discovery_document(api, version), credentials=creds)
+            entry = (creds, service)
+            self._count("builds")
+        else:
+            creds = entry[0]
+            if creds.token != access_token:
+                # token 已刷新：原地替换，service 的 AuthorizedHttp 引用同一个对象
+                creds.token = access_token
+                creds.expiry = None
+                self._count("token_swaps")
+            self._count("hits")
+        services[key] = entry
+        while len(services) > _MAX_SERVICES_PER_THREAD:
+            services.popitem(last=False)
+        return entry[1]
+
+    def invalidate(self, user_key: str) -> None:
+        """Drop the calling thread's services for a user (e.g. after re-authorization)."""
+        services = self._services()
+        for key in [k for k in services if k[2] == user_key]:
+            del services[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _services(self) -> "OrderedDict[Tuple[str, str, str], Tuple[Credentials, Any]]":
+        services = getattr(self._local, "services", None)
+        if services is None:
+            services = self._local.services = OrderedDict()
+        return services
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+
+def _credentials(access_token: str) -> Credentials:
+    return Credentials(
+        access_token,
+        token_uri=settings.GOOGLE_TOKEN_URI,
+        client_id=settings.GOOGLE_CLIENT_ID,
+        client_secret=settings.GOOGLE_CLIENT_SECRET,
+        scopes=settings.GOOGLE_SCOPES,
+    )
+
+
+service_cache = ServiceCache()
+
+
+def get_service(db: Session, user_id: str, api: str, version: str) -> Any:
+    """Gmail/Calendar service for ``user_id`` with a fresh access token."""
+    access_token = get_fresh_token(db, user_id)
+    return service_cache.get(api, version, str(user_id), access_token)
+
+
+def gmail_service(db: Session, user_id: str) -> Any:
+    return get_service(db, user_id, *GMAIL)
+
+
+def calendar_service(db: Session, user_id: str) -> Any:
+    return get_service(db, user_id, *CALENDAR)
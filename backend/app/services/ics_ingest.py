@@ -0,0 +1,370 @@
+"""Calendar-invite ingestion straight from iCalendar data.
+
+Invites carry a ``text/calendar`` part or an ``.ics`` attachment with
+exact DTSTART/DTEND/ATTENDEE values, so guessing them from prose with the
+LLM is both slower and less precise. ``ingest_invite`` parses the VEVENTs
+(TZID / UTC / floating / all-day times, DURATION, RRULE with EXDATE) and
+returns the same result dict as ``LLM.parse_json_response``, so the
+processor stores it through the normal path and skips the model.
+
+Every event carries its ``uid`` and ``recurrence_id`` (RECURRENCE-ID of an
+overridden occurrence), and ``data["cancelled_events"]`` lists the UIDs a
+``METHOD:CANCEL`` or ``STATUS:CANCELLED`` VEVENT withdraws. The processor
+uses them to replace the rows stored from an earlier version of the same
+invite and to delete cancelled ones.
+
+Times are converted to ``ICS_LOCAL_TIMEZONE`` and stored naive like the
+LLM-extracted events. Recurring events are expanded into at most
+``ICS_RECURRENCE_MAX_OCCURRENCES`` rows within
+``ICS_RECURRENCE_HORIZON_DAYS``. Rules this parser does not expand (e.g.
+``BYDAY=2TU`` or BYSETPOS) keep only their first occurrence.
+"""
+from __future__ import annotations
+
+import re
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from app.core.config import settings
+from app.core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+_LINE_RE = re.compile(r"^(?P<name>[A-Za-z0-9-]+)(?P<params>(?:;[^:;=]+=(?:\"[^\"]*\"|[^:;]*))*):(?P<value>.*)$")
+_PARAM_RE = re.compile(r";([^:;=]+)=(\"[^\"]*\"|[^:;]*)")
+_DURATION_RE = re.compile(
+    r"^(?P<sign>[+-])?P(?:(?P<weeks>\d+)W)?(?:(?P<days>\d+)D)?"
+    r"(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?$"
+)
+_MAILTO_RE = re.compile(r"^mailto:", re.IGNORECASE)
+_WEEKDAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+# Outlook 常用 Windows 时区名，ZoneInfo 不认识
+_WINDOWS_ZONES = {
+    "china standard time": "Asia/Shanghai",
+    "taipei standard time": "Asia/Taipei",
+    "tokyo standard time": "Asia/Tokyo",
+    "singapore standard time": "Asia/Singapore",
+    "india standard time": "Asia/Kolkata",
+    "gmt standard time": "Europe/London",
+    "w. europe standard time": "Europe/Berlin",
+    "romance standard time": "Europe/Paris",
+    "eastern standard time": "America/New_York",
+    "central standard time": "America/Chicago",
+    "mountain standard time": "America/Denver",
+    "pacific standard time": "America/Los_Angeles",
+    "utc": "UTC",
+}
+
+_stats_lock = threading.Lock()
+_stats = {"invites": 0, "events": 0, "cancellations": 0, "fallbacks": 0}
+
+
+class _Property:
+    def __init__(self, name: str, params: Dict[str, str], value: str):
+        self.name = name
+        self.params = params
+        self.value = value
+
+
+def ingest_invite(
+    calendar_parts: List[Dict[str, Any]],
+    fetch_attachment: Callable[[str], bytes],
+    subject: Optional[str] = None,
+    now: Optional[datetime] = None,
+) -> Optional[Dict[str, Any]]:
+    """Analysis result built from an email's calendar parts, or None to fall back to the LLM.
+
+    ``fetch_attachment(attachment_id)`` is only called when no inline part
+    yielded an event.
+    """
+    result = None
+    for part in sorted(calendar_parts, key=lambda p: p.get("data") is None):
+        text = part.get("data")
+        try:
+            if text is None:
+                text = fetch_attachment(part["attachment_id"]).decode("utf-8", "replace")
+            result = _build_result(text, subject, now)
+        except Exception as e:  # noqa: BLE001
+            logger.warning("Failed to parse calendar part %s: %s", part.get("filename") or "(inline)", e)
+            continue
+        if result is not None:
+            break
+
+    with _stats_lock:
+        if result is None:
+            _stats["fallbacks"] += 1
+        else:
+            _stats["invites"] += 1
+            _stats["events"] += len(result["data"]["events"])
+            _stats["cancellations"] += len(result["data"]["cancelled_events"])
+    return result
+
+
+def invite_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _build_result(text: str, subject: Optional[str], now: Optional[datetime]) -> Optional[Dict[str, Any]]:
+    method, vevents = _parse_calendar(text)
+    if not vevents:
+        return None
+
+    local_tz = _zone(settings.ICS_LOCAL_TIMEZONE) or timezone.utc
+    now = now or datetime.now(local_tz).replace(tzinfo=None)
+    events: List[Dict[str, Any]] = []
+    cancelled: List[Dict[str, Any]] = []
+    cancelled_any = False
+    for props in vevents:
+        if method == "CANCEL" or _value(props, "STATUS").upper() == "CANCELLED":
+            cancelled_any = True
+            if _value(props, "UID"):
+                cancelled.append({"uid": _value(props, "UID"), "recurrence_id": _recurrence_id(props, local_tz)})
+            continue
+        events.extend(_vevent_events(props, subject, local_tz, now))
+    if not events:
+        if not cancelled_any:
+            return None
+        name = _text(_value(vevents[0], "SUMMARY")) or subject or ""
+        return _result(f"Cancelled: {name}".strip(), [], cancelled)
+    first = events[0]
+    summary = f"{first['event_name']}: {first['start_time']:%Y-%m-%d %H:%M}" + (
+        f" @ {first['location']}" if first["location"] else ""
+    )
+    return _result(summary, events, cancelled)
+
+
+def _result(summary: str, events: List[Dict[str, Any]], cancelled: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "success": True,
+        "data": {
+            "is_spam": False,
+            "judge_reason": summary,
+            "is_schedule": bool(events),
+            "events": events,
+            # [{"uid": str, "recurrence_id": datetime | None}]，None 表示整个系列
+            "cancelled_events": cancelled,
+        },
+    }
+
+
+def _parse_calendar(text: str) -> Tuple[str, List[Dict[str, List[_Property]]]]:
+    """``(METHOD, [VEVENT properties by name])``; nested VALARMs are ignored."""
+    unfolded = re.sub(r"\r?\n[ \t]", "", text)
+    method = ""
+    vevents: List[Dict[str, List[_Property]]] = []
+    stack: List[str] = []
+    current: Optional[Dict[str, List[_Property]]] = None
+    for line in unfolded.splitlines():
+        match = _LINE_RE.match(line.strip())
+        if not match:
+            continue
+        name = match.group("name").upper()
+        value = match.group("value")
+        if name == "BEGIN":
+            stack.append(value.upper())
+            if stack == ["VCALENDAR", "VEVENT"]:
+                current = {}
+            continue
+        if name == "END":
+            if stack and stack[-1] == value.upper():
+                stack.pop()
+            if current is not None and value.upper() == "VEVENT":
+                vevents.append(current)
+                current = None
+            continue
+        if stack == ["VCALENDAR"] and name == "METHOD":
+            method = value.strip().upper()
+        elif current is not None and stack == ["VCALENDAR", "VEVENT"]:
+            params = {
+                key.upper(): val.strip('"') for key, val in _PARAM_RE.findall(match.group("params") or "")
+            }
+            current.setdefault(name, []).append(_Property(name, params, value))
+    return method, vevents
+
+
+def _vevent_events(
+    props: Dict[str, List[_Property]], subject: Optional[str], local_tz: Any, now: datetime
+) -> List[Dict[str, Any]]:
+    dtstart = props.get("DTSTART")
+    if not dtstart:
+        return []
+    start, all_day = _parse_datetime(dtstart[0], local_tz)
+    if "DTEND" in props:
+        end, _ = _parse_datetime(props["DTEND"][0], local_tz)
+    elif "DURATION" in props:
+        end = start + _parse_duration(props["DURATION"][0].value)
+    else:
+        end = start + (timedelta(days=1) if all_day else timedelta(hours=1))
+    length = max(end - start, timedelta(0))
+
+    attendees = []
+    for prop in props.get("ATTENDEE", []):
+        address = _MAILTO_RE.sub("", prop.value.strip())
+        if "@" in address and address not in attendees:
+            attendees.append(address)
+    base = {
+        "event_name": _text(_value(props, "SUMMARY")) or subject or "Meeting",
+        "location": _text(_value(props, "LOCATION")),
+        "participants": ", ".join(attendees),
+        "uid": _value(props, "UID") or None,
+        "recurrence": _value(props, "RRULE") or None,
+        "recurrence_id": _recurrence_id(props, local_tz),
+    }
+
+    starts = [start]
+    if base["recurrence"]:
+        excluded = set()
+        for prop in props.get("EXDATE", []):
+            for item in prop.value.split(","):
+                excluded.add(_parse_datetime(_Property("EXDATE", prop.params, item), local_tz)[0])
+        starts = [s for s in _expand_rrule(dtstart[0], base["recurrence"], local_tz, now) if s not in excluded]
+    # occurrence_start 是这次发生在系列中的原始时间，改期的单次发生以 RECURRENCE-ID 为准
+    return [
+        dict(base, start_time=s, end_time=s + length, occurrence_start=base["recurrence_id"] or s)
+        for s in starts
+    ]
+
+
+def _recurrence_id(props: Dict[str, List[_Property]], local_tz: Any) -> Optional[datetime]:
+    """Original start of the single occurrence this VEVENT overrides, if any."""
+    values = props.get("RECURRENCE-ID")
+    return _parse_datetime(values[0], local_tz)[0] if values else None
+
+
+def _expand_rrule(dtstart: _Property, rrule: str, local_tz: Any, now: datetime) -> List[datetime]:
+    """Occurrence starts (local, naive) of a recurring event within the configured window."""
+    rule = dict(part.split("=", 1) for part in rrule.upper().split(";") if "=" in part)
+    first, _ = _parse_datetime(dtstart, local_tz)
+    unsupported = set(rule) - {"FREQ", "INTERVAL", "COUNT", "UNTIL", "BYDAY", "WKST"}
+    byday = [day for day in rule.get("BYDAY", "").split(",") if day]
+    if unsupported or any(day not in _WEEKDAYS for day in byday) or (byday and rule.get("FREQ") != "WEEKLY"):
+        logger.info("RRULE '%s' is not expanded; storing the first occurrence only", rrule)
+        return [first]
+
+    # 在事件自己的时区里按墙上时间递推，跨夏令时仍保持同一时刻
+    zone = _event_zone(dtstart, local_tz)
+    anchor = _parse_raw(dtstart.value, zone)
+    until = None
+    if "UNTIL" in rule:
+        until = _parse_raw(rule["UNTIL"], zone)
+    count = int(rule["COUNT"]) if "COUNT" in rule else None
+    interval = max(1, int(rule.get("INTERVAL", "1")))
+    horizon = now + timedelta(days=settings.ICS_RECURRENCE_HORIZON_DAYS)
+    limit = max(1, settings.ICS_RECURRENCE_MAX_OCCURRENCES)
+
+    starts: List[datetime] = []
+    for index, occurrence in enumerate(_occurrences(anchor, rule.get("FREQ", ""), interval, byday)):
+        if count is not None and index >= count:
+            break
+        if until is not None and occurrence > until:
+            break
+        local = _to_local(occurrence, local_tz)
+        if local > horizon:
+            break
+        # 已经过去的重复实例不入库；整个系列都已过去时只保留首个实例
+        if local.date() >= now.date():
+            starts.append(local)
+        if len(starts) >= limit:
+            break
+    return starts or [first]
+
+
+def _occurrences(anchor: datetime, freq: str, interval: int, byday: List[str]) -> Iterator[datetime]:
+    if freq == "DAILY":
+        step = 0
+        while True:
+            yield anchor + timedelta(days=step)
+            step += interval
+    elif freq == "WEEKLY":
+        days = sorted(_WEEKDAYS[day] for day in byday) or [anchor.weekday()]
+        week_start = anchor - timedelta(days=anchor.weekday())
+        while True:
+            for weekday in days:
+                candidate = week_start + timedelta(days=weekday)
+                if candidate >= anchor:
+                    yield candidate
+            week_start += timedelta(weeks=interval)
+    elif freq in ("MONTHLY", "YEARLY"):
+        months = interval if freq == "MONTHLY" else 12 * interval
+        step = 0
+        while step < 12 * 200:
+            month_index = anchor.month - 1 + step
+            try:
+                yield anchor.replace(year=anchor.year + month_index // 12, month=month_index % 12 + 1)
+            except ValueError:
+                pass  # 该月没有这一天（如 31 日、2 月 29 日），按 RFC 5545 跳过
+            step += months
+    else:
+        yield anchor
+
+
+def _parse_datetime(prop: _Property, local_tz: Any) -> Tuple[datetime, bool]:
+    """``(local naive datetime, is_all_day)`` for a DTSTART/DTEND-like property."""
+    value = prop.value.strip()
+    if prop.params.get("VALUE", "").upper() == "DATE" or len(value) == 8:
+        return datetime.combine(date(int(value[:4]), int(value[4:6]), int(value[6:8])), time()), True
+    return _to_local(_parse_raw(value, _event_zone(prop, local_tz)), local_tz), False
+
+
+def _parse_raw(value: str, zone: Any) -> datetime:
+    value = value.strip()
+    if len(value) == 8:
+        return datetime.strptime(value, "%Y%m%d").replace(tzinfo=zone)
+    if value.endswith("Z"):
+        return datetime.strptime(value[:-1], "%Y%m%dT%H%M%S").replace(tzinfo=timezone.utc)
+    return datetime.strptime(value, "%Y%m%dT%H%M%S").replace(tzinfo=zone)
+
+
+def _event_zone(prop: _Property, local_tz: Any) -> Any:
+    if prop.value.strip().endswith("Z"):
+        return timezone.utc
+    tzid = prop.params.get("TZID")
+    # 没有 TZID 的浮动时间按本地时间处理
+    return (_zone(tzid) if tzid else None) or local_tz
+
+
+def _to_local(value: datetime, local_tz: Any) -> datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(local_tz).replace(tzinfo=None)
+
+
+def _zone(tzid: Optional[str]) -> Any:
+    if not tzid:
+        return None
+    name = tzid.strip().strip("/")
+    name = _WINDOWS_ZONES.get(name.lower(), name)
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.debug("Unknown TZID '%s', treating time as local", tzid)
+        return None
+
+
+def _parse_duration(value: str) -> timedelta:
+    match = _DURATION_RE.match(value.strip().upper())
+    if not match:
+        return timedelta(hours=1)
+    parts = {key: int(val) for key, val in match.groupdict().items() if val and key != "sign"}
+    duration = timedelta(
+        weeks=parts.get("weeks", 0),
+        days=parts.get("days", 0),
+        hours=parts.get("hours", 0),
+        minutes=parts.get("minutes", 0),
+        seconds=parts.get("seconds", 0),
+    )
+    return -duration if match.group("sign") == "-" else duration
+
+
+def _value(props: Dict[str, List[_Property]], name: str) -> str:
+    values = props.get(name)
+    return values[0].value if values else ""
+
+
+def _text(value: str) -> str:
+    return (
+        value.replace("\\n", "\n").replace("\\N", "\n").replace("\\,", ",").replace("\\;", ";").replace("\\\\", "\\").strip()
+    )
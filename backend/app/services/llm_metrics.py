@@ -0,0 +1,194 @@
+"""Per-call LLM metrics: counters and histograms by operation and model.
+
+``LLM.py`` calls ``record_llm_call`` once per request with wall time, token
+usage, outcome and whether the output parsed. Samples go to the
+process-wide ``llm_metrics`` (served by ``/metrics``) and to any collector
+opened with ``capture_llm_metrics()``, which is how a single
+``process_unread_emails`` run reports its own numbers. The collector lives in
+a ContextVar, so tasks and ``asyncio.to_thread`` calls started inside the
+block are included.
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+class Histogram:
+    """Fixed-bucket histogram; percentiles are interpolated within a bucket."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = pct / 100 * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "p50": _round(self.percentile(50)),
+            "p95": _round(self.percentile(95)),
+            "p99": _round(self.percentile(99)),
+        }
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """(le, count) pairs in Prometheus order, ending with +Inf."""
+        total = 0
+        pairs = []
+        for bucket, bucket_count in zip(self.buckets, self.counts):
+            total += bucket_count
+            pairs.append((_format_le(bucket), total))
+        pairs.append(("+Inf", self.count))
+        return pairs
+
+
+class _Series:
+    def __init__(self):
+        self.outcomes: Dict[str, int] = {}
+        self.parse_failures = 0
+        self.cached_tokens = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.prompt_tokens = Histogram(TOKEN_BUCKETS)
+        self.completion_tokens = Histogram(TOKEN_BUCKETS)
+
+
+class LLMMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], _Series] = {}
+
+    def record(
+        self,
+        operation: str,
+        model: str,
+        seconds: float,
+        usage: Optional[Dict[str, Any]],
+        outcome: str,
+        parse_ok: Optional[bool],
+    ) -> None:
+        with self._lock:
+            series = self._series.get((operation, model))
+            if series is None:
+                series = self._series[(operation, model)] = _Series()
+            series.outcomes[outcome] = series.outcomes.get(outcome, 0) + 1
+            if parse_ok is False:
+                series.parse_failures += 1
+            series.latency.observe(seconds)
+            if usage:
+                series.prompt_tokens.observe(usage.get("prompt_tokens", 0))
+                series.completion_tokens.observe(usage.get("completion_tokens", 0))
+                series.cached_tokens += usage.get("cached_tokens", 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {}
+            for (operation, model), series in sorted(self._series.items()):
+                calls = sum(series.outcomes.values())
+                result[f"{operation}:{model}"] = {
+                    "operation": operation,
+                    "model": model,
+                    "calls": calls,
+                    "outcomes": dict(series.outcomes),
+                    "parse_failures": series.parse_failures,
+                    "parse_failure_rate": round(series.parse_failures / calls, 4) if calls else 0.0,
+                    "latency_seconds": series.latency.snapshot(),
+                    "prompt_tokens": series.prompt_tokens.snapshot(),
+                    "completion_tokens": series.completion_tokens.snapshot(),
+                    "cached_tokens": series.cached_tokens,
+                }
+            return result
+
+    def render_prometheus(self) -> str:
+        """Text exposition format for scraping."""
+        lines = [
+            "# TYPE llm_calls_total counter",
+            "# TYPE llm_parse_failures_total counter",
+            "# TYPE llm_cached_tokens_total counter",
+            "# TYPE llm_latency_seconds histogram",
+            "# TYPE llm_prompt_tokens histogram",
+            "# TYPE llm_completion_tokens histogram",
+        ]
+        with self._lock:
+            for (operation, model), series in sorted(self._series.items()):
+                labels = f'operation="{operation}",model="{model}"'
+                for outcome, count in sorted(series.outcomes.items()):
+                    lines.append(f'llm_calls_total{{{labels},outcome="{outcome}"}} {count}')
+                lines.append(f"llm_parse_failures_total{{{labels}}} {series.parse_failures}")
+                lines.append(f"llm_cached_tokens_total{{{labels}}} {series.cached_tokens}")
+                for name, histogram in (
+                    ("llm_latency_seconds", series.latency),
+                    ("llm_prompt_tokens", series.prompt_tokens),
+                    ("llm_completion_tokens", series.completion_tokens),
+                ):
+                    for le, count in histogram.cumulative():
+                        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {count}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+
+llm_metrics = LLMMetrics()
+_run_collector: ContextVar[Optional[LLMMetrics]] = ContextVar("llm_run_collector", default=None)
+
+
+def record_llm_call(
+    operation: str,
+    model: str,
+    seconds: float,
+    usage: Optional[Dict[str, Any]] = None,
+    outcome: str = "ok",
+    parse_ok: Optional[bool] = None,
+) -> None:
+    """Record one LLM request; ``parse_ok`` is None when nothing was parsed."""
+    llm_metrics.record(operation, model, seconds, usage, outcome, parse_ok)
+    collector = _run_collector.get()
+    if collector is not None:
+        collector.record(operation, model, seconds, usage, outcome, parse_ok)
+
+
+@contextmanager
+def capture_llm_metrics() -> Iterator[LLMMetrics]:
+    """Collect the LLM calls made inside the block into a fresh ``LLMMetrics``."""
+    collector = LLMMetrics()
+    token = _run_collector.set(collector)
+    try:
+        yield collector
+    finally:
+        _run_collector.reset(token)
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 4)
+
+
+def _format_le(bucket: float) -> str:
+    return str(int(bucket)) if float(bucket).is_integer() else str(bucket)
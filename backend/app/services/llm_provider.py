@@ -0,0 +1,304 @@
+"""LLM provider registry.
+
+Each provider is an OpenAI-compatible endpoint with its own model, timeout
+and concurrency limit, configured in ``Settings`` (``DEEPSEEK_*`` for the
+production API, ``LOCAL_LLM_*`` for the stub server in ``devtools``).
+``LLM_PROVIDER`` selects the default; ``LLM.py`` only talks to
+``get_provider()`` so the whole pipeline can run offline against the stub.
+
+Setting ``LLM_RECORD_PATH`` appends every non-streaming exchange to a JSONL
+file that the stub server can replay.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import threading
+import weakref
+from typing import Any, Awaitable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from openai import AsyncOpenAI, OpenAI
+
+from app.core.config import settings
+from app.core.logging_config import get_logger
+from app.services.llm_resilience import (
+    CircuitBreaker,
+    LatencyTracker,
+    ResiliencePolicy,
+    ResilienceStats,
+    call_async,
+    call_sync,
+)
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# provider name -> settings prefix
+PROVIDER_SETTINGS = {
+    "deepseek": "DEEPSEEK",
+    "local": "LOCAL_LLM",
+}
+
+
+class MissingAPIKeyError(RuntimeError):
+    """The provider has no API key configured (``<PREFIX>_API_KEY`` is empty)."""
+
+
+class LLMProvider:
+    """One OpenAI-compatible endpoint plus its concurrency limit.
+
+    ``client``/``async_client`` or ``http_client``/``async_http_client`` may
+    be injected (tests, the in-process stub); otherwise clients are created
+    lazily on first use. Async clients and semaphores are kept per event
+    loop because ``process_unread_emails`` starts a new loop on every run;
+    ``run_async`` closes the loop's clients before the loop shuts down, so
+    their connection pools do not leak.
+
+    Every call runs under ``policy`` (deadline, retries, hedging) and the
+    provider's circuit breaker; latency percentiles are tracked per
+    ``operation`` (e.g. "analysis", "generation").
+    """
+
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        timeout: float = 60.0,
+        max_concurrency: int = 16,
+        record_path: Optional[str] = None,
+        client: Any = None,
+        async_client: Any = None,
+        http_client: Any = None,
+        async_http_client: Any = None,
+        policy: Optional[ResiliencePolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.name = name
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.record_path = record_path
+        self._client = client
+        self._async_client = async_client
+        self._http_client = http_client
+        self._async_http_client = async_http_client
+        self.policy = policy or ResiliencePolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.resilience_stats = ResilienceStats()
+        self._latency: Dict[str, LatencyTracker] = {}
+        self._lock = threading.Lock()
+        self._sync_slots = threading.BoundedSemaphore(max_concurrency)
+        self._loop_state: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[Any, asyncio.Semaphore]]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    @property
+    def client(self) -> Any:
+        with self._lock:
+            if self._client is None:
+                self._require_api_key()
+                self._client = OpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    timeout=self.timeout,
+                    max_retries=0,
+                    http_client=self._http_client,
+                )
+            return self._client
+
+    def _async_state(self) -> Tuple[Any, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._loop_state.get(loop)
+            if state is None:
+                if self._async_client is None:
+                    self._require_api_key()
+                async_client = self._async_client or AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    timeout=self.timeout,
+                    max_retries=0,
+                    http_client=self._async_http_client,
+                )
+                state = (async_client, asyncio.Semaphore(self.max_concurrency))
+                self._loop_state[loop] = state
+            return state
+
+    def _require_api_key(self) -> None:
+        if not self.api_key:
+            prefix = PROVIDER_SETTINGS.get(self.name, self.name.upper())
+            raise MissingAPIKeyError(
+                f"{prefix}_API_KEY is not set; add it to backend/.env or the environment "
+                f"(see .env.example) before using the '{self.name}' LLM provider"
+            )
+
+    def complete(self, messages: List[Dict[str, str]], operation: str = "default", **kwargs: Any) -> Any:
+        """Blocking chat completion (``stream=False``)."""
+        kwargs.setdefault("model", self.model)
+
+        def _attempt(timeout: float) -> Any:
+            with self._sync_slots:
+                return self.client.chat.completions.create(
+                    messages=messages, stream=False, timeout=timeout, **kwargs
+                )
+
+        response = call_sync(_attempt, **self._resilience(operation))
+        self._record(messages, response)
+        return response
+
+    async def acomplete(
+        self, messages: List[Dict[str, str]], operation: str = "default", **kwargs: Any
+    ) -> Any:
+        kwargs.setdefault("model", self.model)
+        async_client, slots = self._async_state()
+
+        async def _attempt(timeout: float) -> Any:
+            async with slots:
+                return await async_client.chat.completions.create(
+                    messages=messages, stream=False, timeout=timeout, **kwargs
+                )
+
+        response = await call_async(_attempt, **self._resilience(operation))
+        self._record(messages, response)
+        return response
+
+    def stream(
+        self, messages: List[Dict[str, str]], operation: str = "default", **kwargs: Any
+    ) -> Iterator[Any]:
+        """Streaming chat completion; holds a concurrency slot until exhausted.
+
+        Retries only cover opening the stream; a failure mid-stream is raised
+        to the caller, which has already forwarded part of the output.
+        """
+        kwargs.setdefault("model", self.model)
+        with self._sync_slots:
+            stream = call_sync(
+                lambda timeout: self.client.chat.completions.create(
+                    messages=messages, stream=True, timeout=timeout, **kwargs
+                ),
+                hedge=False,
+                **self._resilience(operation),
+            )
+            yield from stream
+
+    async def aclose_loop_client(self) -> None:
+        """Close the async client this provider created for the running loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._loop_state.pop(loop, None)
+        # 注入的客户端（测试、进程内 stub）由调用方负责关闭
+        if state is None or self._async_client is not None or self._async_http_client is not None:
+            return
+        try:
+            await state[0].close()
+        except Exception as e:  # noqa: BLE001
+            logger.warning("Failed to close async client of LLM provider %s: %s", self.name, e)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            trackers = dict(self._latency)
+        return {
+            "provider": self.name,
+            "model": self.model,
+            "circuit": self.breaker.state,
+            **self.resilience_stats.snapshot(),
+            "p95_seconds": {
+                operation: round(tracker.percentile(95) or 0.0, 3) for operation, tracker in trackers.items()
+            },
+        }
+
+    def _resilience(self, operation: str) -> Dict[str, Any]:
+        with self._lock:
+            tracker = self._latency.get(operation)
+            if tracker is None:
+                tracker = self._latency[operation] = LatencyTracker()
+        return {
+            "timeout": self.timeout,
+            "policy": self.policy,
+            "breaker": self.breaker,
+            "tracker": tracker,
+            "stats": self.resilience_stats,
+        }
+
+    def _record(self, messages: List[Dict[str, str]], response: Any) -> None:
+        if not self.record_path:
+            return
+        try:
+            record = {"key": request_key(messages), "content": response.choices[0].message.content}
+            with self._lock, open(self.record_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:  # noqa: BLE001
+            logger.warning("Failed to record LLM response to %s: %s", self.record_path, e)
+
+    def __repr__(self):
+        return f"<LLMProvider(name='{self.name}', model='{self.model}', base_url='{self.base_url}')>"
+
+
+def request_key(messages: List[Dict[str, str]]) -> str:
+    """Stable key of a request, shared by the recorder and the stub's replay."""
+    payload = json.dumps(
+        [[m.get("role"), m.get("content")] for m in messages], ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def build_provider(name: str) -> LLMProvider:
+    """Create a provider from its ``<PREFIX>_*`` settings."""
+    prefix = PROVIDER_SETTINGS.get(name)
+    if prefix is None:
+        raise ValueError(f"Unknown LLM provider '{name}', expected one of {sorted(PROVIDER_SETTINGS)}")
+    return LLMProvider(
+        name=name,
+        model=getattr(settings, f"{prefix}_MODEL"),
+        base_url=getattr(settings, f"{prefix}_BASE_URL"),
+        api_key=getattr(settings, f"{prefix}_API_KEY"),
+        timeout=getattr(settings, f"{prefix}_TIMEOUT_SECONDS"),
+        max_concurrency=getattr(settings, f"{prefix}_MAX_CONCURRENCY"),
+        record_path=settings.LLM_RECORD_PATH or None,
+    )
+
+
+_providers: Dict[str, LLMProvider] = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(name: Optional[str] = None) -> LLMProvider:
+    """Return the named provider (default ``LLM_PROVIDER``), creating it once."""
+    name = name or settings.LLM_PROVIDER
+    with _providers_lock:
+        provider = _providers.get(name)
+        if provider is None:
+            provider = _providers[name] = build_provider(name)
+        return provider
+
+
+def register_provider(provider: LLMProvider) -> None:
+    """Install or replace a provider under ``provider.name``."""
+    with _providers_lock:
+        _providers[provider.name] = provider
+
+
+async def close_loop_clients() -> None:
+    """Close every registered provider's async client on the running loop."""
+    with _providers_lock:
+        providers = list(_providers.values())
+    for provider in providers:
+        await provider.aclose_loop_client()
+
+
+def run_async(main: Awaitable[T]) -> T:
+    """``asyncio.run`` that closes the loop's async LLM clients before the loop shuts down."""
+
+    async def _run() -> T:
+        try:
+            return await main
+        finally:
+            await close_loop_clients()
+
+    return asyncio.run(_run())
@@ -0,0 +1,383 @@
+"""Deadlines, retries, circuit breaking and hedging for LLM calls.
+
+``LLMProvider`` wraps every request in ``call_sync`` / ``call_async``:
+
+- each attempt gets the provider timeout, capped by what is left of the
+  overall ``LLM_TOTAL_DEADLINE_SECONDS``;
+- timeouts, connection errors, 429s and 5xx are retried with exponential
+  backoff and full jitter (``Retry-After`` is honoured when present);
+- after ``LLM_CIRCUIT_FAILURE_THRESHOLD`` consecutive failed calls the
+  circuit opens and calls fail fast until ``LLM_CIRCUIT_RESET_SECONDS`` have
+  passed, then one probe request is let through. A call counts once, when it
+  gives up after its retries, not once per attempt;
+- with ``LLM_HEDGE_ENABLED`` a second identical request is sent once the
+  first has been outstanding longer than the observed p95 latency, and the
+  first answer wins.
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import openai
+
+from app.core.config import settings
+from app.core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the provider while its circuit is open."""
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when the overall deadline for a call has passed."""
+
+
+class ResiliencePolicy:
+    """Retry/deadline/hedging knobs; defaults come from ``Settings``."""
+
+    def __init__(
+        self,
+        total_deadline: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        base_delay: Optional[float] = None,
+        max_delay: Optional[float] = None,
+        hedge_enabled: Optional[bool] = None,
+        hedge_percentile: Optional[float] = None,
+        hedge_min_samples: Optional[int] = None,
+        hedge_min_delay: Optional[float] = None,
+    ):
+        self.total_deadline = settings.LLM_TOTAL_DEADLINE_SECONDS if total_deadline is None else total_deadline
+        self.max_retries = settings.LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.base_delay = settings.LLM_RETRY_BASE_DELAY_SECONDS if base_delay is None else base_delay
+        self.max_delay = settings.LLM_RETRY_MAX_DELAY_SECONDS if max_delay is None else max_delay
+        self.hedge_enabled = settings.LLM_HEDGE_ENABLED if hedge_enabled is None else hedge_enabled
+        self.hedge_percentile = settings.LLM_HEDGE_PERCENTILE if hedge_percentile is None else hedge_percentile
+        self.hedge_min_samples = (
+            settings.LLM_HEDGE_MIN_SAMPLES if hedge_min_samples is None else hedge_min_samples
+        )
+        self.hedge_min_delay = settings.LLM_HEDGE_MIN_DELAY_SECONDS if hedge_min_delay is None else hedge_min_delay
+
+    def backoff(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        """Full-jitter exponential backoff before retry number ``attempt + 1``."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2**attempt)))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open probe."""
+
+    def __init__(self, failure_threshold: Optional[int] = None, reset_timeout: Optional[float] = None):
+        self.failure_threshold = (
+            settings.LLM_CIRCUIT_FAILURE_THRESHOLD if failure_threshold is None else failure_threshold
+        )
+        self.reset_timeout = settings.LLM_CIRCUIT_RESET_SECONDS if reset_timeout is None else reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> None:
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return
+            if state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+        raise CircuitOpenError("LLM circuit is open; failing fast")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """Give back the half-open probe slot without a verdict (cancelled call)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            probe_failed = self._probe_in_flight
+            self._probe_in_flight = False
+            if probe_failed or (self.failure_threshold > 0 and self._failures >= self.failure_threshold):
+                if self._opened_at is None:
+                    logger.warning("LLM circuit opened after %d consecutive failures", self._failures)
+                self._opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies for one operation."""
+
+    def __init__(self, window: int = 200):
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, math.ceil(pct / 100 * len(samples)) - 1))
+        return samples[index]
+
+    def hedge_delay(self, policy: ResiliencePolicy) -> Optional[float]:
+        if not policy.hedge_enabled:
+            return None
+        with self._lock:
+            enough = len(self._samples) >= policy.hedge_min_samples
+        if not enough:
+            return None
+        return max(self.percentile(policy.hedge_percentile) or 0.0, policy.hedge_min_delay)
+
+
+class ResilienceStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {"calls": 0, "retries": 0, "failures": 0, "circuit_rejections": 0, "hedges": 0, "hedge_wins": 0}
+
+    def incr(self, key: str) -> None:
+        with self._lock:
+            self._counts[key] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code in (408, 409)
+    return isinstance(error, (TimeoutError, asyncio.TimeoutError)) and not isinstance(
+        error, DeadlineExceededError
+    )
+
+
+def _retry_after(error: Optional[BaseException]) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_hedge_executor_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+        return _hedge_executor
+
+
+def call_sync(
+    attempt: Callable[[float], Any],
+    *,
+    timeout: float,
+    policy: ResiliencePolicy,
+    breaker: CircuitBreaker,
+    tracker: LatencyTracker,
+    stats: ResilienceStats,
+    hedge: bool = True,
+) -> Any:
+    """Run ``attempt(timeout_seconds)`` under the policy (blocking)."""
+    deadline = time.monotonic() + policy.total_deadline
+    stats.incr("calls")
+    for attempt_no in range(policy.max_retries + 1):
+        attempt_timeout = _attempt_timeout(timeout, deadline)
+        _enter_breaker(breaker, stats)
+        started = time.monotonic()
+        try:
+            hedge_delay = tracker.hedge_delay(policy) if hedge else None
+            if hedge_delay is not None and hedge_delay < attempt_timeout:
+                result = _hedged_sync(attempt, attempt_timeout, hedge_delay, stats)
+            else:
+                result = attempt(attempt_timeout)
+        except Exception as e:
+            delay = _on_failure(e, attempt_no, deadline, policy, breaker, stats)
+            time.sleep(delay)
+            continue
+        except BaseException:
+            # 取消或中断不算成功也不算失败，但要释放半开探测名额，否则后续调用全被拒绝
+            breaker.release_probe()
+            raise
+        breaker.record_success()
+        tracker.observe(time.monotonic() - started)
+        return result
+    raise AssertionError("unreachable")  # pragma: no cover
+
+
+async def call_async(
+    attempt: Callable[[float], Awaitable[Any]],
+    *,
+    timeout: float,
+    policy: ResiliencePolicy,
+    breaker: CircuitBreaker,
+    tracker: LatencyTracker,
+    stats: ResilienceStats,
+    hedge: bool = True,
+) -> Any:
+    """Async counterpart of ``call_sync``; attempts are bounded by ``asyncio.wait_for``."""
+    deadline = time.monotonic() + policy.total_deadline
+    stats.incr("calls")
+    for attempt_no in range(policy.max_retries + 1):
+        attempt_timeout = _attempt_timeout(timeout, deadline)
+        _enter_breaker(breaker, stats)
+        started = time.monotonic()
+        try:
+            hedge_delay = tracker.hedge_delay(policy) if hedge else None
+            if hedge_delay is not None and hedge_delay < attempt_timeout:
+                result = await _hedged_async(attempt, attempt_timeout, hedge_delay, stats)
+            else:
+                result = await asyncio.wait_for(attempt(attempt_timeout), attempt_timeout)
+        except Exception as e:
+            delay = _on_failure(e, attempt_no, deadline, policy, breaker, stats)
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # 取消或中断不算成功也不算失败，但要释放半开探测名额，否则后续调用全被拒绝
+            breaker.release_probe()
+            raise
+        breaker.record_success()
+        tracker.observe(time.monotonic() - started)
+        return result
+    raise AssertionError("unreachable")  # pragma: no cover
+
+
+def _attempt_timeout(timeout: float, deadline: float) -> float:
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceededError("LLM call deadline exceeded")
+    return min(timeout, remaining)
+
+
+def _enter_breaker(breaker: CircuitBreaker, stats: ResilienceStats) -> None:
+    try:
+        breaker.before_call()
+    except CircuitOpenError:
+        stats.incr("circuit_rejections")
+        raise
+
+
+def _on_failure(
+    error: Exception,
+    attempt_no: int,
+    deadline: float,
+    policy: ResiliencePolicy,
+    breaker: CircuitBreaker,
+    stats: ResilienceStats,
+) -> float:
+    """Decide whether to retry; returns the backoff delay or re-raises ``error``."""
+    if not is_retryable(error):
+        # 4xx 等非瞬时错误说明服务本身可用，不计入熔断
+        breaker.record_success()
+        raise error
+    stats.incr("failures")
+    delay = policy.backoff(attempt_no, error)
+    if (
+        attempt_no >= policy.max_retries
+        or time.monotonic() + delay >= deadline
+        or breaker.state != "closed"
+    ):
+        # 一次逻辑调用只在放弃时计一次失败；半开探测失败也在这里重新打开熔断
+        breaker.record_failure()
+        raise error
+    stats.incr("retries")
+    logger.warning("LLM call failed (%s), retry %d in %.2fs", error, attempt_no + 1, delay)
+    return delay
+
+
+def _hedged_sync(
+    attempt: Callable[[float], Any], timeout: float, hedge_delay: float, stats: ResilienceStats
+) -> Any:
+    executor = _executor()
+    primary = executor.submit(attempt, timeout)
+    done, _ = wait([primary], timeout=hedge_delay)
+    if done:
+        return primary.result()
+
+    stats.incr("hedges")
+    secondary = executor.submit(attempt, timeout - hedge_delay)
+    pending = {primary, secondary}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is secondary:
+                    stats.incr("hedge_wins")
+                for other in pending:
+                    other.cancel()
+                return future.result()
+            error = future.exception()
+    raise error  # type: ignore[misc]
+
+
+async def _hedged_async(
+    attempt: Callable[[float], Awaitable[Any]],
+    timeout: float,
+    hedge_delay: float,
+    stats: ResilienceStats,
+) -> Any:
+    primary = asyncio.create_task(asyncio.wait_for(attempt(timeout), timeout))
+    done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+    if done:
+        return primary.result()
+
+    stats.incr("hedges")
+    secondary = asyncio.create_task(asyncio.wait_for(attempt(timeout - hedge_delay), timeout - hedge_delay))
+    pending = {primary, secondary}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is secondary:
+                        stats.incr("hedge_wins")
+                    return task.result()
+                error = task.exception()
+        raise error  # type: ignore[misc]
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,198 @@
+"""Cost-aware model routing for ``analyze_email`` and ``generate_email``.
+
+Each request goes to the "fast" route (a cheaper/faster model, configured by
+``LLM_FAST_PROVIDER`` / ``LLM_FAST_MODEL``) or the "full" route (the default
+provider and model). An analysis goes to the full route when any of these holds:
+
+- the input is larger than ``LLM_ROUTE_MAX_FAST_TOKENS``;
+- a light complexity check sees several dates/times (multi-event mail is
+  where small models drop events);
+- the sender's recent mail repeatedly failed validation on the fast route.
+
+A fast-route answer that fails validation (``parse_json_response`` /
+``parse_email_generation_response``) is retried once on the full route.
+Routing turns itself off (with a warning) when no fast provider or model is
+configured, since both routes would then call the same model.
+Per-route latency, token and fallback counters are kept for tuning.
+"""
+from __future__ import annotations
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.core.logging_config import get_logger
+from app.services.llm_resilience import LatencyTracker
+
+logger = get_logger(__name__)
+
+FAST_ROUTE = "fast"
+FULL_ROUTE = "full"
+
+_DATE_MENTION_RE = re.compile(
+    r"\d{4}[-/年]\d{1,2}[-/月]\d{1,2}|\d{1,2}/\d{1,2}|"
+    r"\b(mon|tues|wednes|thurs|fri|satur|sun)day\b|\b(today|tomorrow)\b|"
+    r"(周|星期)[一二三四五六日天]|今天|明天|后天",
+    re.IGNORECASE,
+)
+_TIME_MENTION_RE = re.compile(
+    r"\b\d{1,2}[:：]\d{2}\b|\b\d{1,2}\s?(am|pm)\b|\d{1,2}点", re.IGNORECASE
+)
+_ADDRESS_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+
+# 发件人历史只保留最近的若干个发件人
+_MAX_TRACKED_SENDERS = 5000
+# 至少尝试这么多次快速路由后，才按失败率把发件人切到完整模型
+_MIN_SENDER_ATTEMPTS = 3
+# 提到多个日期的邮件通常包含多个日程
+_MAX_FAST_DATE_MENTIONS = 2
+
+
+class Route:
+    def __init__(self, name: str, provider: Optional[str], model: Optional[str]):
+        self.name = name
+        self.provider = provider
+        self.model = model
+
+    def __repr__(self):
+        return f"<Route(name='{self.name}', provider='{self.provider}', model='{self.model}')>"
+
+
+def estimate_complexity(text: Optional[str]) -> Dict[str, int]:
+    """Cheap signals of how hard an email is to extract events from."""
+    text = text or ""
+    return {
+        "date_mentions": len(_DATE_MENTION_RE.findall(text)),
+        "time_mentions": len(_TIME_MENTION_RE.findall(text)),
+    }
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        max_fast_tokens: Optional[int] = None,
+        max_fast_brief_tokens: Optional[int] = None,
+        max_fast_time_mentions: Optional[int] = None,
+        sender_failure_rate: Optional[float] = None,
+    ):
+        self.enabled = settings.LLM_ROUTING_ENABLED if enabled is None else enabled
+        self.max_fast_tokens = settings.LLM_ROUTE_MAX_FAST_TOKENS if max_fast_tokens is None else max_fast_tokens
+        self.max_fast_brief_tokens = (
+            settings.LLM_ROUTE_MAX_FAST_BRIEF_TOKENS if max_fast_brief_tokens is None else max_fast_brief_tokens
+        )
+        self.max_fast_time_mentions = (
+            settings.LLM_ROUTE_MAX_FAST_TIME_MENTIONS
+            if max_fast_time_mentions is None
+            else max_fast_time_mentions
+        )
+        self.sender_failure_rate = (
+            settings.LLM_ROUTE_SENDER_FAILURE_RATE if sender_failure_rate is None else sender_failure_rate
+        )
+        self.fast_route = Route(FAST_ROUTE, settings.LLM_FAST_PROVIDER or None, settings.LLM_FAST_MODEL or None)
+        self.full_route = Route(FULL_ROUTE, None, None)
+        if (
+            self.enabled
+            and self.fast_route.provider in (None, settings.LLM_PROVIDER)
+            and self.fast_route.model is None
+        ):
+            # 快速路由和完整路由是同一个模型，回退只会重复调用它
+            logger.warning(
+                "LLM_ROUTING_ENABLED is set but no LLM_FAST_PROVIDER/LLM_FAST_MODEL is configured; "
+                "routing is disabled"
+            )
+            self.enabled = False
+
+        self._lock = threading.Lock()
+        # sender -> [fast attempts, fast validation failures]
+        self._senders: "OrderedDict[str, list]" = OrderedDict()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._latency: Dict[str, LatencyTracker] = {}
+
+    def route_analysis(self, email_content: Optional[str], sender: Optional[str], input_tokens: int) -> Route:
+        if not self.enabled:
+            return self.full_route
+        if input_tokens > self.max_fast_tokens:
+            return self.full_route
+        complexity = estimate_complexity(email_content)
+        if complexity["time_mentions"] > self.max_fast_time_mentions or complexity["date_mentions"] > _MAX_FAST_DATE_MENTIONS:
+            return self.full_route
+        if self._sender_needs_full(sender):
+            return self.full_route
+        return self.fast_route
+
+    def route_generation(self, input_tokens: int) -> Route:
+        if self.enabled and input_tokens <= self.max_fast_brief_tokens:
+            return self.fast_route
+        return self.full_route
+
+    def record(
+        self,
+        route: Route,
+        operation: str,
+        seconds: float,
+        usage: Optional[Dict[str, Any]],
+        valid: bool,
+        sender: Optional[str] = None,
+    ) -> None:
+        """Record one routed call; fast-route validation results feed sender history."""
+        key = f"{operation}:{route.name}"
+        with self._lock:
+            stats = self._route_stats(key)
+            stats["calls"] += 1
+            stats["invalid"] += 0 if valid else 1
+            if usage:
+                stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                stats["completion_tokens"] += usage.get("completion_tokens", 0)
+            tracker = self._latency.setdefault(key, LatencyTracker())
+
+            normalized = _normalize_sender(sender)
+            if route.name == FAST_ROUTE and normalized:
+                history = self._senders.pop(normalized, [0, 0])
+                history[0] += 1
+                history[1] += 0 if valid else 1
+                self._senders[normalized] = history
+                while len(self._senders) > _MAX_TRACKED_SENDERS:
+                    self._senders.popitem(last=False)
+        tracker.observe(seconds)
+
+    def record_fallback(self, operation: str) -> None:
+        with self._lock:
+            self._route_stats(f"{operation}:{FAST_ROUTE}")["fallbacks"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = {key: dict(value) for key, value in self._stats.items()}
+            trackers = dict(self._latency)
+        for key, value in snapshot.items():
+            tracker = trackers.get(key)
+            if tracker:
+                value["p50_seconds"] = round(tracker.percentile(50) or 0.0, 3)
+                value["p95_seconds"] = round(tracker.percentile(95) or 0.0, 3)
+        return snapshot
+
+    def _route_stats(self, key: str) -> Dict[str, Any]:
+        return self._stats.setdefault(
+            key,
+            {"calls": 0, "invalid": 0, "fallbacks": 0, "prompt_tokens": 0, "completion_tokens": 0},
+        )
+
+    def _sender_needs_full(self, sender: Optional[str]) -> bool:
+        normalized = _normalize_sender(sender)
+        if not normalized:
+            return False
+        with self._lock:
+            attempts, failures = self._senders.get(normalized, (0, 0))
+        return attempts >= _MIN_SENDER_ATTEMPTS and failures / attempts >= self.sender_failure_rate
+
+
+def _normalize_sender(sender: Optional[str]) -> Optional[str]:
+    if not sender:
+        return None
+    match = _ADDRESS_RE.search(sender)
+    return (match.group(0) if match else sender).strip().lower()
+
+
+model_router = ModelRouter()
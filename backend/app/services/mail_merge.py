@@ -0,0 +1,166 @@
+"""Mail-merge bulk generation.
+
+One LLM call writes a template with ``{{first_name}}`` / ``{{name}}`` /
+``{{company}}`` slots; every recipient's variant is rendered locally from
+its ``EmailRecipient`` fields. With ``refine`` enabled, recipients that have
+notes are additionally personalized by the LLM, packed
+``MAIL_MERGE_REFINE_BATCH_SIZE`` to a request with at most
+``MAIL_MERGE_REFINE_CONCURRENCY`` requests in flight. A campaign of N
+recipients therefore costs 1 call, or 1 + ceil(noted / batch size) calls.
+"""
+from __future__ import annotations
+
+import asyncio
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.core.config import settings
+from app.core.logging_config import get_logger
+from app.services.email_generation import EmailGenerationService
+from app.services.llm_provider import run_async
+from LLM import generate_email_template, refine_merge_batch_async
+
+logger = get_logger(__name__)
+
+_PLACEHOLDER_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+# 收件人缺少对应字段时使用的替换文本
+_FIELD_DEFAULTS = {
+    "first_name": "there",
+    "name": "there",
+    "company": "your organization",
+}
+
+
+def recipient_fields(recipient: Any) -> Dict[str, str]:
+    """Template fields of one ``EmailRecipient`` (or any object with the same attributes)."""
+    name = (getattr(recipient, "name", None) or "").strip()
+    return {
+        "name": name,
+        "first_name": name.split()[0] if name else "",
+        "company": (getattr(recipient, "company", None) or "").strip(),
+    }
+
+
+def render_template(text: str, fields: Dict[str, str]) -> str:
+    """Fill ``{{field}}`` slots; unknown or empty fields fall back to neutral wording."""
+
+    def _substitute(match: "re.Match[str]") -> str:
+        key = match.group(1).lower()
+        return fields.get(key) or _FIELD_DEFAULTS.get(key, "")
+
+    return _PLACEHOLDER_RE.sub(_substitute, text or "")
+
+
+def generate_bulk(
+    recipients: Sequence[Any],
+    brief_content: str,
+    tone: str,
+    subject: Optional[str] = None,
+    sender_name: Optional[str] = None,
+    sender_position: Optional[str] = None,
+    sender_contact: Optional[str] = None,
+    purpose: Optional[str] = None,
+    additional_context: Optional[str] = None,
+    refine: bool = False,
+) -> Dict[str, Any]:
+    """Generate one personalized email per recipient.
+
+    Returns::
+
+        {
+            "success": bool,
+            "message": str,
+            "data": {
+                "template_subject": str,
+                "template_body": str,
+                "items": [{"recipient_id", "email", "subject", "body", "body_html", "refined"}],
+                "llm_calls": int,
+            } | None,
+        }
+    """
+    tone_norm = EmailGenerationService.validate_tone(tone)
+    brief = EmailGenerationService._build_email_input(brief_content, purpose, additional_context)
+    template = generate_email_template(brief.strip(), sender_name=sender_name, tone=tone_norm)
+    if not template.get("success") or not (template.get("data") or {}).get("content"):
+        message = template.get("message") or "empty template"
+        logger.error("Mail-merge template generation failed: %s", message)
+        return {"success": False, "data": None, "message": f"邮件生成失败: {message}"}
+
+    template_subject = template["data"].get("subject") or subject or "通知"
+    template_body = EmailGenerationService._strip_markdown(template["data"]["content"])
+
+    drafts: List[Dict[str, Any]] = []
+    for recipient in recipients:
+        fields = recipient_fields(recipient)
+        drafts.append(
+            {
+                "id": str(recipient.id),
+                "recipient": recipient,
+                "name": fields["name"],
+                "company": fields["company"],
+                "notes": (getattr(recipient, "notes", None) or "").strip(),
+                "subject": render_template(template_subject, fields),
+                "content": render_template(template_body, fields),
+                "refined": False,
+            }
+        )
+
+    llm_calls = 1
+    if refine:
+        llm_calls += run_async(_refine_drafts(drafts, tone_norm))
+
+    items = []
+    for draft in drafts:
+        body = EmailGenerationService._apply_signature(
+            draft["content"],
+            sender_name=sender_name,
+            sender_position=sender_position,
+            sender_contact=sender_contact,
+        )
+        items.append(
+            {
+                "recipient_id": draft["recipient"].id,
+                "email": draft["recipient"].email,
+                "subject": draft["subject"],
+                "body": body,
+                "body_html": EmailGenerationService._convert_to_html(body),
+                "refined": draft["refined"],
+            }
+        )
+
+    logger.info(
+        "Mail-merge generated %d emails with %d LLM calls", len(items), llm_calls
+    )
+    return {
+        "success": True,
+        "message": f"Generated {len(items)} emails",
+        "data": {
+            "template_subject": template_subject,
+            "template_body": template_body,
+            "items": items,
+            "llm_calls": llm_calls,
+        },
+    }
+
+
+async def _refine_drafts(drafts: List[Dict[str, Any]], tone: str) -> int:
+    """Refine drafts that have notes in place; returns the number of LLM calls made."""
+    noted = [draft for draft in drafts if draft["notes"]]
+    if not noted:
+        return 0
+    batch_size = max(1, settings.MAIL_MERGE_REFINE_BATCH_SIZE)
+    batches = [noted[i : i + batch_size] for i in range(0, len(noted), batch_size)]
+    semaphore = asyncio.Semaphore(max(1, settings.MAIL_MERGE_REFINE_CONCURRENCY))
+
+    async def _run(batch: List[Dict[str, Any]]) -> None:
+        async with semaphore:
+            results = await refine_merge_batch_async(batch, tone=tone)
+        for draft in batch:
+            refined = results.get(draft["id"])
+            if refined:
+                draft["subject"] = refined["subject"] or draft["subject"]
+                draft["content"] = EmailGenerationService._strip_markdown(refined["content"])
+                draft["refined"] = True
+
+    await asyncio.gather(*(_run(batch) for batch in batches))
+    return len(batches)
@@ -0,0 +1,107 @@
+"""Incremental mailbox sync using the Gmail history API.
+
+Each user has a ``MailboxSyncState`` holding the last historyId whose new
+messages were handed to the processor. A run lists only ``messagesAdded``
+since that cursor (``gmail.list_history``), so its cost follows the amount of
+new mail rather than the size of the unread backlog.
+
+A full ``is:unread`` listing is used when there is no cursor yet or Gmail
+reports it expired. The current historyId is read *before* that listing, so
+mail arriving during the run is picked up next time. If the full listing was
+cut off at ``max_results``, the cursor is not stored and the next run lists
+again until the backlog is drained. "Cut off" means Gmail still had a next
+page, not that exactly ``max_results`` messages were listed.
+
+``SyncBatch.pages`` is consumed lazily: a full listing requests each
+``messages.list`` page only when the processor asks for it.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logging_config import get_logger
+from app.models.mailbox_sync import MailboxSyncState
+from app.services import gmail
+
+logger = get_logger(__name__)
+
+INCREMENTAL = "incremental"
+FULL = "full"
+
+
+class SyncBatch:
+    def __init__(
+        self,
+        pages: Iterable[List[Dict[str, Any]]],
+        mode: str,
+        next_history_id: Optional[str],
+    ):
+        self.pages = iter(pages)
+        self.mode = mode
+        # 处理完成后要保存的游标；None 表示保持原状
+        self.next_history_id = next_history_id
+
+    def __repr__(self):
+        return f"<SyncBatch(mode='{self.mode}', next_history_id='{self.next_history_id}')>"
+
+
+def get_sync_state(db: Session, user_id: int) -> Optional[MailboxSyncState]:
+    return db.query(MailboxSyncState).filter(MailboxSyncState.user_id == user_id).first()
+
+
+def list_new_messages(db: Session, user_id: int, max_results: int) -> SyncBatch:
+    """Messages to process for ``user_id``: incremental when possible, otherwise a full listing."""
+    state = get_sync_state(db, user_id)
+    if state is not None and state.history_id:
+        try:
+            messages, history_id = gmail.list_history(
+                db, str(user_id), state.history_id, max_results
+            )
+            return SyncBatch(_chunk(messages), INCREMENTAL, history_id)
+        except gmail.HistoryExpiredError:
+            logger.info("History cursor for user %s expired, running a full sync", user_id)
+
+    batch = SyncBatch((), FULL, gmail.get_history_id(db, str(user_id)))
+    batch.pages = _full_listing(db, user_id, max_results, batch)
+    return batch
+
+
+def _full_listing(
+    db: Session, user_id: int, max_results: int, batch: SyncBatch
+) -> Iterator[List[Dict[str, Any]]]:
+    truncated = yield from gmail.iter_message_pages(db, str(user_id), max_results)
+    if truncated:
+        # 还有下一页，列表被截断，不保存游标
+        batch.next_history_id = None
+
+
+def _chunk(messages: List[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+    size = max(1, settings.GMAIL_LIST_PAGE_SIZE)
+    for start in range(0, len(messages), size):
+        yield messages[start : start + size]
+
+
+def save_cursor(db: Session, user_id: int, batch: SyncBatch) -> None:
+    """Advance the user's cursor after ``batch`` has been processed."""
+    if batch.next_history_id is None:
+        return
+    state = get_sync_state(db, user_id)
+    if state is None:
+        state = MailboxSyncState(user_id=user_id)
+        db.add(state)
+    state.history_id = batch.next_history_id
+    if batch.mode == FULL:
+        state.last_full_sync_at = datetime.now(timezone.utc)
+    db.commit()
+
+
+def reset_cursor(db: Session, user_id: int) -> None:
+    """Forget the cursor so the next run does a full listing."""
+    state = get_sync_state(db, user_id)
+    if state is not None:
+        state.history_id = None
+        db.commit()
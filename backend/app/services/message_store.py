@@ -0,0 +1,246 @@
+"""Local store of raw Gmail message resources.
+
+``get_email``, ``get_emails_batch`` and ``reply_email`` read a message here
+before asking Google, and save what they fetch. The message content never
+changes after delivery, so a stored copy stays valid; only labels move, and
+the stored resources are not used for those.
+
+Each copy is kept under the *view* it was fetched with: ``"full"`` for a
+plain ``format=full`` response, or ``view_for(fields)`` for one trimmed by a
+``fields`` mask. A trimmed copy is only handed back to callers asking for
+the same mask, never to ``get_email``; a full copy can serve any request.
+
+Storage is a SQLite file (``GMAIL_MESSAGE_STORE_PATH``) with two tables.
+``blobs`` holds zlib-compressed JSON keyed by its SHA-256, so identical
+payloads are kept once. ``stored_messages`` maps (user, Gmail id, view) to
+a blob and records the last access; a blob nothing points to any more is
+deleted. When the compressed total exceeds
+``GMAIL_MESSAGE_STORE_MAX_BYTES``, the least recently read copies are
+dropped until the store is back under 90% of the limit. Connections are
+per thread, and the database runs in WAL mode so readers do not block the
+writer.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, Optional
+
+from app.core.config import settings
+from app.core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stored_messages (
+    user_key TEXT NOT NULL,
+    gmail_id TEXT NOT NULL,
+    view TEXT NOT NULL,
+    hash TEXT NOT NULL REFERENCES blobs(hash),
+    last_access REAL NOT NULL,
+    PRIMARY KEY (user_key, gmail_id, view)
+);
+CREATE INDEX IF NOT EXISTS ix_stored_messages_last_access ON stored_messages(last_access);
+CREATE INDEX IF NOT EXISTS ix_stored_messages_hash ON stored_messages(hash);
+-- 旧版本不区分 view，可能把 fields 裁剪过的副本当成完整邮件，直接丢弃
+DROP TABLE IF EXISTS messages;
+DELETE FROM blobs WHERE NOT EXISTS (SELECT 1 FROM stored_messages m WHERE m.hash = blobs.hash);
+"""
+
+FULL_VIEW = "full"
+
+# 清理时降到上限的这个比例，避免每次写入都触发淘汰
+_EVICT_TARGET = 0.9
+
+
+def view_for(fields: Optional[str]) -> str:
+    """Store view of a ``messages.get`` response requested with ``fields``."""
+    if not fields:
+        return FULL_VIEW
+    return "fields:" + hashlib.sha1(fields.encode("utf-8")).hexdigest()[:16]
+
+
+class MessageStore:
+    def __init__(self, path: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.path = path or settings.GMAIL_MESSAGE_STORE_PATH
+        self.max_bytes = max_bytes if max_bytes is not None else settings.GMAIL_MESSAGE_STORE_MAX_BYTES
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0, "errors": 0}
+
+    def get(self, user_id: str, gmail_id: str, view: str = FULL_VIEW) -> Optional[Dict[str, Any]]:
+        """The stored message resource, or None (also when the store is unusable)."""
+        return self.get_many(user_id, [gmail_id], view).get(gmail_id)
+
+    def get_many(
+        self, user_id: str, gmail_ids: Iterable[str], view: str = FULL_VIEW
+    ) -> Dict[str, Dict[str, Any]]:
+        """Stored copies in ``view``; a full copy is returned when the trimmed one is missing."""
+        ids = list(dict.fromkeys(str(gmail_id) for gmail_id in gmail_ids))
+        if not ids:
+            return {}
+        # 完整副本是任何 fields 掩码的超集，可以代替裁剪过的副本
+        views = [view] if view == FULL_VIEW else [view, FULL_VIEW]
+        found: Dict[str, Dict[str, Any]] = {}
+        chosen: Dict[str, str] = {}
+        try:
+            conn = self._connection()
+            for start in range(0, len(ids), 500):
+                chunk = ids[start : start + 500]
+                rows = conn.execute(
+                    "SELECT m.gmail_id, m.view, b.data FROM stored_messages m JOIN blobs b ON b.hash = m.hash "
+                    f"WHERE m.user_key = ? AND m.view IN ({','.join('?' * len(views))}) "
+                    f"AND m.gmail_id IN ({','.join('?' * len(chunk))})",
+                    [str(user_id), *views, *chunk],
+                ).fetchall()
+                for gmail_id, row_view, data in rows:
+                    if gmail_id in chosen and views.index(chosen[gmail_id]) <= views.index(row_view):
+                        continue
+                    found[gmail_id] = json.loads(zlib.decompress(data))
+                    chosen[gmail_id] = row_view
+            if found:
+                with self._write_lock, conn:
+                    conn.executemany(
+                        "UPDATE stored_messages SET last_access = ? WHERE user_key = ? AND gmail_id = ? AND view = ?",
+                        [(time.time(), str(user_id), gmail_id, row_view) for gmail_id, row_view in chosen.items()],
+                    )
+        except (sqlite3.Error, OSError, ValueError, zlib.error) as e:
+            self._count("errors")
+            logger.warning("Message store read failed: %s", e)
+            found = {}
+        self._count("hits", len(found))
+        self._count("misses", len(ids) - len(found))
+        return found
+
+    def put(self, user_id: str, gmail_id: str, message: Dict[str, Any], view: str = FULL_VIEW) -> None:
+        self.put_many(user_id, {gmail_id: message}, view)
+
+    def put_many(self, user_id: str, messages: Dict[str, Dict[str, Any]], view: str = FULL_VIEW) -> None:
+        if not messages:
+            return
+        now = time.time()
+        blobs = []
+        links = []
+        for gmail_id, message in messages.items():
+            raw = json.dumps(message, separators=(",", ":"), sort_keys=True).encode("utf-8")
+            digest = hashlib.sha256(raw).hexdigest()
+            data = zlib.compress(raw, 6)
+            blobs.append((digest, data, len(data)))
+            links.append((str(user_id), str(gmail_id), view, digest, now))
+        try:
+            conn = self._connection()
+            with self._write_lock, conn:
+                replaced = set()
+                for user_key, gmail_id, link_view, _, _ in links:
+                    row = conn.execute(
+                        "SELECT hash FROM stored_messages WHERE user_key = ? AND gmail_id = ? AND view = ?",
+                        (user_key, gmail_id, link_view),
+                    ).fetchone()
+                    if row is not None:
+                        replaced.add(row[0])
+                conn.executemany("INSERT OR IGNORE INTO blobs (hash, data, size) VALUES (?, ?, ?)", blobs)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO stored_messages (user_key, gmail_id, view, hash, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    links,
+                )
+                # 被覆盖的副本原来指向的 blob 可能已经没人引用
+                for digest in replaced:
+                    self._drop_blob_if_unused(conn, digest)
+                evicted = self._evict(conn)
+        except (sqlite3.Error, OSError) as e:
+            self._count("errors")
+            logger.warning("Message store write failed: %s", e)
+            return
+        self._count("puts", len(links))
+        self._count("evictions", evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        reads = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / reads, 4) if reads else 0.0
+        try:
+            stored_bytes, messages = self._connection().execute(
+                "SELECT COALESCE(SUM(size), 0), (SELECT COUNT(*) FROM stored_messages) FROM blobs"
+            ).fetchone()
+            stats.update(stored_bytes=stored_bytes, messages=messages)
+        except (sqlite3.Error, OSError):
+            pass
+        return stats
+
+    def clear(self) -> None:
+        conn = self._connection()
+        with self._write_lock, conn:
+            conn.execute("DELETE FROM stored_messages")
+            conn.execute("DELETE FROM blobs")
+        with self._lock:
+            self._stats = dict.fromkeys(self._stats, 0)
+
+    def _evict(self, conn: sqlite3.Connection) -> int:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        target = self.max_bytes * _EVICT_TARGET
+        evicted = 0
+        rows = conn.execute(
+            "SELECT m.user_key, m.gmail_id, m.view, m.hash FROM stored_messages m ORDER BY m.last_access"
+        ).fetchall()
+        for user_key, gmail_id, view, digest in rows:
+            if total <= target:
+                break
+            conn.execute(
+                "DELETE FROM stored_messages WHERE user_key = ? AND gmail_id = ? AND view = ?",
+                (user_key, gmail_id, view),
+            )
+            evicted += 1
+            total -= self._drop_blob_if_unused(conn, digest)
+        return evicted
+
+    def _drop_blob_if_unused(self, conn: sqlite3.Connection, digest: str) -> int:
+        """Delete the blob when no stored copy refers to it; returns the bytes freed."""
+        # 同一内容可能被多个邮件引用，没人引用时才删除 blob
+        if conn.execute("SELECT 1 FROM stored_messages WHERE hash = ? LIMIT 1", (digest,)).fetchone() is not None:
+            return 0
+        row = conn.execute("SELECT size FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            return 0
+        conn.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+        return row[0]
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "path", None) != self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.path = self.path
+        return conn
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        if amount:
+            with self._lock:
+                self._stats[name] += amount
+
+
+message_store = MessageStore()
+
+
+def store_enabled() -> bool:
+    return settings.GMAIL_MESSAGE_STORE_ENABLED
@@ -0,0 +1,261 @@
+"""Single-pass body extraction from a Gmail ``format=full`` payload.
+
+``extract_body`` walks the MIME tree recursively and picks one text
+representation per ``multipart/alternative`` (``text/plain`` unless it is
+empty, otherwise ``text/html`` converted to text). The readable parts of
+``multipart/mixed`` / ``related`` are joined in order, and attachments are
+skipped. Calendar invites (``text/calendar`` parts and ``.ics``
+attachments) are never treated as body text; they are returned in
+``calendar_parts``, inline ones decoded and attached ones by attachment id,
+so ``ics_ingest`` can fetch them lazily.
+
+Parts are base64url-decoded only up to what is left of the per-message
+byte cap (``GMAIL_BODY_MAX_BYTES``). A huge newsletter therefore never
+decodes more than the cap, and the decoded bytes are sliced through a
+``memoryview`` instead of being copied again before charset decoding.
+"""
+from __future__ import annotations
+
+import html as _html
+import re
+import threading
+import time
+from base64 import urlsafe_b64decode
+from binascii import Error as BinasciiError
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+# 超过这个深度的嵌套 multipart 不再展开
+_MAX_DEPTH = 16
+# 日历邀请单独解码，不占正文的字节配额
+_MAX_CALENDAR_BYTES = 1024 * 1024
+_CALENDAR_TYPES = ("text/calendar", "application/ics")
+
+_CHARSET_RE = re.compile(r"charset\s*=\s*\"?([\w.:-]+)", re.IGNORECASE)
+_DROP_BLOCKS_RE = re.compile(
+    r"<(script|style|head|title)\b[^>]*>.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL
+)
+_BREAK_TAGS_RE = re.compile(
+    r"<\s*(br|/p|/div|/tr|/li|/h[1-6]|/table|/blockquote|hr)\b[^>]*>", re.IGNORECASE
+)
+_CELL_TAGS_RE = re.compile(r"<\s*/t[dh]\s*>", re.IGNORECASE)
+_TAG_RE = re.compile(r"<[^>]+>")
+_INLINE_WHITESPACE_RE = re.compile(r"[ \t\r\f\v\u00a0\u200b]+")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n\s*(\n\s*)+")
+
+
+class ExtractedBody:
+    def __init__(
+        self,
+        text: str,
+        source: Optional[str],
+        bytes_decoded: int,
+        truncated: bool,
+        parse_seconds: float,
+        calendar_parts: Optional[List[Dict[str, Any]]] = None,
+    ):
+        self.text = text
+        # 最终采用的表示："text/plain"、"text/html" 或 None（没有可读正文）
+        self.source = source
+        self.bytes_decoded = bytes_decoded
+        self.truncated = truncated
+        self.parse_seconds = parse_seconds
+        # [{"data": str | None, "attachment_id": str | None, "filename": str}]
+        self.calendar_parts = calendar_parts or []
+
+    def __repr__(self):
+        return (
+            f"<ExtractedBody(source='{self.source}', bytes={self.bytes_decoded}, "
+            f"truncated={self.truncated}, seconds={self.parse_seconds:.6f})>"
+        )
+
+
+class _WalkState:
+    def __init__(self, max_bytes: int):
+        self.remaining = max_bytes
+        self.decoded = 0
+        self.truncated = False
+        self.calendar_parts: List[Dict[str, Any]] = []
+
+
+def extract_body(payload: Dict[str, Any], max_bytes: Optional[int] = None) -> ExtractedBody:
+    """Best readable text of a message payload, decoding at most ``max_bytes`` bytes."""
+    started = time.perf_counter()
+    state = _WalkState(max(0, max_bytes if max_bytes is not None else settings.GMAIL_BODY_MAX_BYTES))
+    text, source = _walk(payload or {}, state, 0)
+    result = ExtractedBody(
+        text=text,
+        source=source,
+        bytes_decoded=state.decoded,
+        truncated=state.truncated,
+        parse_seconds=time.perf_counter() - started,
+        calendar_parts=state.calendar_parts,
+    )
+    body_parse_stats.record(result)
+    return result
+
+
+def _walk(part: Dict[str, Any], state: _WalkState, depth: int) -> "tuple[str, Optional[str]]":
+    mime_type = (part.get("mimeType") or "").lower()
+    children: List[Dict[str, Any]] = part.get("parts") or []
+
+    if children and depth < _MAX_DEPTH:
+        if mime_type == "multipart/alternative":
+            return _pick_alternative(children, state, depth)
+        texts: List[str] = []
+        source = None
+        for child in children:
+            if state.remaining <= 0 and not (child.get("parts") or _is_calendar(child)):
+                # 正文配额用完后不再解码文本，但后面的邀请（.ics）仍要收集
+                state.truncated = True
+                continue
+            text, child_source = _walk(child, state, depth + 1)
+            if text:
+                texts.append(text)
+                source = source or child_source
+        return "\n\n".join(texts), source
+
+    if _is_calendar(part):
+        _collect_calendar(part, state)
+        return "", None
+    if _is_attachment(part):
+        return "", None
+    # 顶层 payload 没有 mimeType 时按纯文本处理（兼容旧数据）
+    if mime_type in ("text/plain", "") or (mime_type.startswith("text/") and mime_type != "text/html"):
+        return _decode_part(part, state).strip(), "text/plain"
+    if mime_type == "text/html":
+        return html_to_text(_decode_part(part, state)), "text/html"
+    return "", None
+
+
+def _pick_alternative(children: List[Dict[str, Any]], state: _WalkState, depth: int) -> "tuple[str, Optional[str]]":
+    # 邀请通常是 alternative 的第三种表示，先收集，正文选择时不考虑它
+    for child in children:
+        if _is_calendar(child):
+            _collect_calendar(child, state)
+    readable = [child for child in children if not _is_calendar(child)]
+    # 优先纯文本；只有纯文本为空时才解码 HTML，避免两种表示都占用字节配额
+    ordered = sorted(readable, key=lambda child: 1 if (child.get("mimeType") or "").lower() == "text/html" else 0)
+    for child in ordered:
+        text, source = _walk(child, state, depth + 1)
+        if text:
+            return text, source
+    return "", None
+
+
+def _is_calendar(part: Dict[str, Any]) -> bool:
+    mime_type = (part.get("mimeType") or "").lower()
+    return mime_type in _CALENDAR_TYPES or (part.get("filename") or "").lower().endswith(".ics")
+
+
+def _collect_calendar(part: Dict[str, Any], state: _WalkState) -> None:
+    body = part.get("body") or {}
+    data = None
+    if body.get("data"):
+        data = _decode_part(part, _WalkState(_MAX_CALENDAR_BYTES))
+    elif not body.get("attachmentId"):
+        return
+    state.calendar_parts.append(
+        {"data": data, "attachment_id": body.get("attachmentId"), "filename": part.get("filename") or ""}
+    )
+
+
+def _is_attachment(part: Dict[str, Any]) -> bool:
+    if part.get("filename"):
+        return True
+    for header in part.get("headers") or ():
+        if header.get("name", "").lower() == "content-disposition":
+            return header.get("value", "").lower().startswith("attachment")
+    return False
+
+
+def _decode_part(part: Dict[str, Any], state: _WalkState) -> str:
+    encoded = (part.get("body") or {}).get("data")
+    if not encoded:
+        return ""
+    if state.remaining <= 0:
+        state.truncated = True
+        return ""
+    # 只解码配额内需要的 base64 字符（每 4 个字符对应 3 个字节）
+    chunk = encoded[: -(-state.remaining // 3) * 4]
+    try:
+        raw = urlsafe_b64decode(chunk + "=" * (-len(chunk) % 4))
+    except (BinasciiError, ValueError):
+        return ""
+    view = memoryview(raw)[: state.remaining]
+    if len(chunk) < len(encoded) or len(raw) > len(view):
+        state.truncated = True
+    state.remaining -= len(view)
+    state.decoded += len(view)
+    return str(view, _charset(part), "ignore")
+
+
+def _charset(part: Dict[str, Any]) -> str:
+    for header in part.get("headers") or ():
+        if header.get("name", "").lower() == "content-type":
+            match = _CHARSET_RE.search(header.get("value", ""))
+            if match:
+                charset = match.group(1).lower()
+                try:
+                    "".encode(charset)
+                    return charset
+                except LookupError:
+                    break
+    return "utf-8"
+
+
+def html_to_text(markup: str) -> str:
+    """Cheap HTML → text: drop scripts/styles, keep line structure, unescape entities."""
+    if not markup:
+        return ""
+    text = _DROP_BLOCKS_RE.sub("", markup)
+    text = _BREAK_TAGS_RE.sub("\n", text)
+    text = _CELL_TAGS_RE.sub(" ", text)
+    text = _TAG_RE.sub("", text)
+    text = _html.unescape(text)
+    text = "\n".join(_INLINE_WHITESPACE_RE.sub(" ", line).strip() for line in text.split("\n"))
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+class BodyParseStats:
+    """Running totals of body extraction: volume, fallbacks, truncation and time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def record(self, result: ExtractedBody) -> None:
+        with self._lock:
+            self._totals["messages"] += 1
+            self._totals["bytes_decoded"] += result.bytes_decoded
+            self._totals["html_fallbacks"] += 1 if result.source == "text/html" else 0
+            self._totals["truncated"] += 1 if result.truncated else 0
+            self._totals["empty"] += 0 if result.text else 1
+            self._totals["parse_seconds"] += result.parse_seconds
+            self._max_seconds = max(self._max_seconds, result.parse_seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            totals = dict(self._totals)
+            max_seconds = self._max_seconds
+        messages = totals["messages"]
+        totals["parse_seconds"] = round(totals["parse_seconds"], 6)
+        totals["avg_parse_ms"] = round(totals["parse_seconds"] * 1000 / messages, 3) if messages else 0.0
+        totals["max_parse_ms"] = round(max_seconds * 1000, 3)
+        return totals
+
+    def reset(self) -> None:
+        with self._lock:
+            self._totals = {
+                "messages": 0,
+                "bytes_decoded": 0,
+                "html_fallbacks": 0,
+                "truncated": 0,
+                "empty": 0,
+                "parse_seconds": 0.0,
+            }
+            self._max_seconds = 0.0
+
+
+body_parse_stats = BodyParseStats()
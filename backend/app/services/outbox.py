@@ -0,0 +1,297 @@
+"""Durable outbox for outgoing mail.
+
+``/emails/send`` and ``/emails/generate-and-send`` only insert an
+``OutboxMessage`` and return 202 with its id. ``outbox_sender`` worker
+threads pick due rows, claim each with a conditional UPDATE (so several
+workers or processes never send the same row), and call
+``gmail.send_email``. A failed send is retried with exponential backoff up
+to ``OUTBOX_MAX_ATTEMPTS``; a permanent error (a 4xx such as an invalid
+recipient, see ``gmail.is_permanent_send_error``) fails the row at once.
+Sends are paced per user with a token bucket
+(``OUTBOX_SEND_RATE_PER_SECOND`` / ``OUTBOX_SEND_BURST``) so bursts stay
+under Gmail's per-user quota.
+
+Rows survive restarts. Rows left in ``sending`` longer than
+``OUTBOX_SENDING_LEASE_SECONDS`` (a process died mid-send) go back to the
+queue; the sender checks when it starts and then every half lease from the
+worker loop. That makes delivery at-least-once.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.logging_config import get_logger
+from app.models.outbox import OutboxMessage
+from app.services import gmail
+
+logger = get_logger(__name__)
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+# 每轮最多领取的到期消息数
+_CLAIM_BATCH = 20
+# 与 OutboxMessage.subject 的列长度一致
+MAX_SUBJECT_LENGTH = 500
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def enqueue_email(
+    db: Session,
+    user_id: int,
+    to_email: str,
+    subject: str,
+    body: str,
+    body_html: Optional[str] = None,
+) -> OutboxMessage:
+    """Persist an email for background sending and wake the sender."""
+    message = OutboxMessage(
+        user_id=user_id,
+        to_address=to_email,
+        subject=subject,
+        body=body,
+        body_html=body_html,
+        status=QUEUED,
+        attempts=0,
+        next_attempt_at=_utcnow(),
+    )
+    db.add(message)
+    db.commit()
+    db.refresh(message)
+    outbox_sender.notify()
+    return message
+
+
+def get_outbox_message(db: Session, user_id: int, outbox_id: int) -> Optional[OutboxMessage]:
+    return (
+        db.query(OutboxMessage)
+        .filter(OutboxMessage.id == outbox_id, OutboxMessage.user_id == user_id)
+        .first()
+    )
+
+
+class TokenBucket:
+    """``rate`` tokens per second, at most ``capacity`` banked."""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = max(rate, 1e-6)
+        self.capacity = max(capacity, 1.0)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        # 同一用户的桶被多个 worker 线程共用
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """Take a token and return 0, or return the seconds until one is available."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class OutboxSender:
+    def __init__(
+        self,
+        send: Optional[Callable[..., Dict[str, Any]]] = None,
+        session_factory: Optional[Callable[[], Session]] = None,
+        workers: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._send = send
+        self._session_factory = session_factory or SessionLocal
+        self._workers = max(1, workers or settings.OUTBOX_WORKERS)
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._threads: list = []
+        self._lock = threading.Lock()
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._clock = clock
+        self._next_recovery = 0.0
+        self._stats = {"sent": 0, "failed": 0, "retried": 0, "throttled": 0, "recovered": 0}
+
+    def start(self) -> None:
+        """Recover interrupted sends and start the worker threads (idempotent)."""
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if self._threads:
+                return
+            self._stopped.clear()
+        self._recover_if_due()
+        with self._lock:
+            while len(self._threads) < self._workers:
+                thread = threading.Thread(target=self._work, name="outbox-sender", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, workers=sum(t.is_alive() for t in self._threads))
+
+    def recover_stale(self) -> int:
+        """Requeue rows stuck in ``sending`` past the lease."""
+        cutoff = _utcnow() - timedelta(seconds=settings.OUTBOX_SENDING_LEASE_SECONDS)
+        db = self._session_factory()
+        try:
+            recovered = (
+                db.query(OutboxMessage)
+                .filter(OutboxMessage.status == SENDING, OutboxMessage.updated_at < cutoff)
+                .update({"status": QUEUED, "next_attempt_at": _utcnow()}, synchronize_session=False)
+            )
+            db.commit()
+        finally:
+            db.close()
+        if recovered:
+            logger.warning("Requeued %d outbox messages interrupted while sending", recovered)
+            self._count("recovered", recovered)
+        return recovered
+
+    def _recover_if_due(self) -> None:
+        """Run ``recover_stale`` at most once per half lease across all workers."""
+        now = self._clock()
+        with self._lock:
+            if now < self._next_recovery:
+                return
+            self._next_recovery = now + settings.OUTBOX_SENDING_LEASE_SECONDS / 2
+        try:
+            self.recover_stale()
+        except Exception as e:  # noqa: BLE001
+            logger.error("Outbox recovery failed: %s", e, exc_info=True)
+
+    def run_once(self) -> int:
+        """Send every due message the rate limits allow; returns how many were attempted."""
+        db = self._session_factory()
+        try:
+            due = (
+                db.query(OutboxMessage.id, OutboxMessage.user_id)
+                .filter(OutboxMessage.status == QUEUED, OutboxMessage.next_attempt_at <= _utcnow())
+                .order_by(OutboxMessage.next_attempt_at, OutboxMessage.id)
+                .limit(_CLAIM_BATCH)
+                .all()
+            )
+            attempted = 0
+            for outbox_id, user_id in due:
+                wait = self._bucket(user_id).try_acquire()
+                if wait > 0:
+                    # 超出该用户的发送速率，推迟到下一个令牌可用的时间
+                    self._update_if_queued(db, outbox_id, {"next_attempt_at": _utcnow() + timedelta(seconds=wait)})
+                    self._count("throttled")
+                    continue
+                if not self._update_if_queued(
+                    db, outbox_id, {"status": SENDING, "attempts": OutboxMessage.attempts + 1, "updated_at": _utcnow()}
+                ):
+                    continue  # 已被其他 worker 领取
+                message = db.query(OutboxMessage).filter(OutboxMessage.id == outbox_id).one()
+                self._deliver(db, message)
+                attempted += 1
+            return attempted
+        finally:
+            db.close()
+
+    def _deliver(self, db: Session, message: OutboxMessage) -> None:
+        send = self._send or gmail.send_email
+        try:
+            result = send(
+                db=db,
+                user_id=str(message.user_id),
+                to_email=message.to_address,
+                subject=message.subject,
+                body=message.body,
+                body_html=message.body_html,
+            )
+        except Exception as e:  # noqa: BLE001
+            result = {"success": False, "message": str(e), "permanent": gmail.is_permanent_send_error(e)}
+
+        now = _utcnow()
+        if result.get("success"):
+            message.status = SENT
+            message.gmail_message_id = result.get("message_id")
+            message.thread_id = result.get("thread_id")
+            message.last_error = None
+            message.sent_at = now
+            self._count("sent")
+            logger.info("Outbox message %s sent as %s", message.id, message.gmail_message_id)
+        else:
+            message.last_error = (result.get("message") or "unknown error")[:2000]
+            if result.get("permanent"):
+                # 4xx / 收件人无效等，重试也不会成功
+                message.status = FAILED
+                self._count("failed")
+                logger.error("Outbox message %s failed permanently: %s", message.id, message.last_error)
+            elif message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                message.status = FAILED
+                self._count("failed")
+                logger.error("Outbox message %s failed after %d attempts: %s", message.id, message.attempts, message.last_error)
+            else:
+                message.status = QUEUED
+                message.next_attempt_at = now + timedelta(seconds=_backoff(message.attempts))
+                self._count("retried")
+                logger.warning("Outbox message %s attempt %d failed, retrying: %s", message.id, message.attempts, message.last_error)
+        db.commit()
+
+    def _update_if_queued(self, db: Session, outbox_id: int, values: Dict[str, Any]) -> bool:
+        updated = (
+            db.query(OutboxMessage)
+            .filter(OutboxMessage.id == outbox_id, OutboxMessage.status == QUEUED)
+            .update(values, synchronize_session=False)
+        )
+        db.commit()
+        return bool(updated)
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = TokenBucket(
+                    settings.OUTBOX_SEND_RATE_PER_SECOND, settings.OUTBOX_SEND_BURST
+                )
+            return bucket
+
+    def _work(self) -> None:
+        while not self._stopped.is_set():
+            # 先清除再领取：领取期间到达的 notify() 会让下面的 wait 立即返回
+            self._wake.clear()
+            # 运行中也要回收：其他进程在发送途中退出留下的 sending 行
+            self._recover_if_due()
+            try:
+                attempted = self.run_once()
+            except Exception as e:  # noqa: BLE001
+                logger.error("Outbox sender iteration failed: %s", e, exc_info=True)
+                attempted = 0
+            if not attempted:
+                self._wake.wait(settings.OUTBOX_POLL_INTERVAL_SECONDS)
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += amount
+
+
+def _backoff(attempts: int) -> float:
+    delay = settings.OUTBOX_RETRY_BASE_DELAY_SECONDS * (2 ** max(0, attempts - 1))
+    return min(delay, settings.OUTBOX_RETRY_MAX_DELAY_SECONDS)
+
+
+outbox_sender = OutboxSender()
@@ -0,0 +1,164 @@
+"""Push-driven ingestion for Gmail watch notifications.
+
+``users.watch`` makes Gmail publish ``{"emailAddress", "historyId"}`` to a
+Pub/Sub topic whenever the mailbox changes; a push subscription forwards it
+to ``POST /gmail/push``. The endpoint only decodes the envelope and calls
+``sync_queue.enqueue``. Worker threads then run the normal
+``process_unread_emails`` (an incremental history sync) for that user.
+
+Notifications for a user that is already queued are coalesced into the queued
+run. A notification arriving while that user's sync is running schedules
+exactly one follow-up run, so mail that lands mid-run is not missed.
+"""
+from __future__ import annotations
+
+import base64
+import binascii
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.logging_config import get_logger
+from app.db import get_user
+from app.services import mailbox_sync
+
+logger = get_logger(__name__)
+
+
+class InvalidPushMessage(ValueError):
+    """The push body is not a Pub/Sub envelope carrying a Gmail notification."""
+
+
+def decode_push_envelope(envelope: Dict[str, Any]) -> Tuple[str, str]:
+    """Return ``(email_address, history_id)`` from a Pub/Sub push body."""
+    message = envelope.get("message") if isinstance(envelope, dict) else None
+    data = message.get("data") if isinstance(message, dict) else None
+    if not data:
+        raise InvalidPushMessage("missing message.data")
+    try:
+        payload = json.loads(base64.b64decode(data + "=" * (-len(data) % 4)))
+    except (binascii.Error, ValueError) as e:
+        raise InvalidPushMessage(f"undecodable message.data: {e}") from e
+    email_address = payload.get("emailAddress") if isinstance(payload, dict) else None
+    history_id = payload.get("historyId") if isinstance(payload, dict) else None
+    if not email_address or history_id is None:
+        raise InvalidPushMessage("notification lacks emailAddress or historyId")
+    return str(email_address), str(history_id)
+
+
+class SyncQueue:
+    """Coalescing per-user queue drained by a small pool of daemon threads."""
+
+    def __init__(self, runner: Optional[Callable[[int], Any]] = None, workers: Optional[int] = None):
+        self._runner = runner or _run_sync
+        self._workers = max(1, workers or settings.GMAIL_PUSH_WORKERS)
+        self._cond = threading.Condition()
+        self._pending: "OrderedDict[int, None]" = OrderedDict()
+        self._running: Set[int] = set()
+        self._rerun: Set[int] = set()
+        self._threads: list = []
+        self._stopped = False
+        self._stats = {"enqueued": 0, "coalesced": 0, "runs": 0, "failures": 0}
+
+    def enqueue(self, user_id: int) -> bool:
+        """Schedule a sync; returns False when it was merged into one already scheduled."""
+        with self._cond:
+            if user_id in self._pending or user_id in self._rerun:
+                self._stats["coalesced"] += 1
+                return False
+            if user_id in self._running:
+                self._rerun.add(user_id)
+            else:
+                self._pending[user_id] = None
+                self._cond.notify()
+            self._stats["enqueued"] += 1
+            self._ensure_workers()
+            return True
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Block until nothing is queued or running (used by tests and shutdown)."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pending and not self._running and not self._rerun, timeout
+            )
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return dict(self._stats, queued=len(self._pending), running=len(self._running))
+
+    def _ensure_workers(self) -> None:
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self._workers:
+            thread = threading.Thread(target=self._work, name="gmail-push-sync", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopped)
+                if self._stopped:
+                    return
+                user_id, _ = self._pending.popitem(last=False)
+                self._running.add(user_id)
+            failed = False
+            try:
+                self._runner(user_id)
+            except Exception as e:  # noqa: BLE001
+                failed = True
+                logger.error("Push-triggered sync failed for user %s: %s", user_id, e, exc_info=True)
+            with self._cond:
+                self._running.discard(user_id)
+                self._stats["runs"] += 1
+                self._stats["failures"] += 1 if failed else 0
+                if user_id in self._rerun:
+                    self._rerun.discard(user_id)
+                    self._pending[user_id] = None
+                self._cond.notify_all()
+
+
+def _run_sync(user_id: int) -> None:
+    from app.services.email_processor import process_unread_emails
+
+    db = SessionLocal()
+    try:
+        _, _, message = process_unread_emails(db, user_id, settings.GMAIL_PUSH_MAX_RESULTS)
+        logger.info("Push-triggered sync for user %s: %s", user_id, message)
+    finally:
+        db.close()
+
+
+sync_queue = SyncQueue()
+
+
+def handle_notification(db: Session, envelope: Dict[str, Any]) -> str:
+    """Route one push notification; returns what happened ("queued", "coalesced", ...)."""
+    email_address, history_id = decode_push_envelope(envelope)
+    user = get_user(db, email_address)
+    if user is None:
+        logger.info("Ignoring Gmail push for unknown mailbox %s", email_address)
+        return "unknown_user"
+
+    state = mailbox_sync.get_sync_state(db, user.id)
+    if state is not None and state.history_id and _history_le(history_id, state.history_id):
+        # 游标已经越过这次通知的 historyId，说明对应的邮件已处理过
+        return "already_synced"
+
+    return "queued" if sync_queue.enqueue(user.id) else "coalesced"
+
+
+def _history_le(left: str, right: str) -> bool:
+    try:
+        return int(left) <= int(right)
+    except ValueError:
+        return False
@@ -0,0 +1,344 @@
+"""Local spam classifier that runs before ``LLM.analyze_email``.
+
+A multinomial naive Bayes model over hashed token features, trained from the
+spam verdicts the LLM already produced (``spam_verdicts`` table). Emails
+scored at or above ``SPAM_CLASSIFIER_THRESHOLD`` are dropped without an LLM
+round-trip; everything else still goes to the LLM, whose verdict is stored
+as new training data.
+
+Retrain from the command line (run from ``backend/``)::
+
+    python -m app.services.spam_classifier retrain
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import threading
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logging_config import get_logger
+from app.models.spam_verdict import SpamVerdict
+
+logger = get_logger(__name__)
+
+DEFAULT_HASH_FEATURES = 1 << 18
+
+# Bodies are truncated before tokenizing; the opening of a message carries
+# nearly all of the spam signal and this bounds the per-email cost.
+_MAX_BODY_CHARS = 4000
+
+_WORD_RE = re.compile(r"[a-z0-9$€£¥%]{2,24}")
+_CJK_RUN_RE = re.compile(r"[一-鿿]+")
+_URL_RE = re.compile(r"https?://", re.IGNORECASE)
+_ADDRESS_RE = re.compile(r"[A-Za-z0-9._%+-]+@([A-Za-z0-9.-]+\.[A-Za-z]{2,})")
+
+
+def tokenize_email(
+    sender: Optional[str], subject: Optional[str], body: Optional[str]
+) -> List[str]:
+    """Turn one email into the distinct feature strings the model hashes."""
+    tokens: set[str] = set()
+
+    sender = (sender or "").lower()
+    match = _ADDRESS_RE.search(sender)
+    if match:
+        tokens.add(f"from:{match.group(0)}")
+        tokens.add(f"domain:{match.group(1)}")
+
+    for prefix, text in (("s:", subject or ""), ("", (body or "")[:_MAX_BODY_CHARS])):
+        lowered = text.lower()
+        tokens.update(prefix + word for word in _WORD_RE.findall(lowered))
+        # 中文没有空格分词，用相邻字的二元组
+        for run in _CJK_RUN_RE.findall(lowered):
+            if len(run) == 1:
+                tokens.add(prefix + run)
+            tokens.update(prefix + run[i : i + 2] for i in range(len(run) - 1))
+
+    tokens.add(f"urls:{min(len(_URL_RE.findall(body or '')), 5)}")
+    return list(tokens)
+
+
+class SpamModel:
+    """Hashed-feature naive Bayes; ``weights`` holds per-feature log-odds."""
+
+    def __init__(
+        self,
+        weights: np.ndarray,
+        log_prior: float,
+        samples: int = 0,
+        spam_samples: int = 0,
+        trained_at: Optional[datetime] = None,
+    ):
+        self.weights = weights.astype(np.float32, copy=False)
+        self.log_prior = float(log_prior)
+        self.samples = samples
+        self.spam_samples = spam_samples
+        self.trained_at = trained_at
+
+    @property
+    def n_features(self) -> int:
+        return int(self.weights.shape[0])
+
+    @classmethod
+    def train(
+        cls,
+        documents: Sequence[Sequence[str]],
+        labels: Sequence[bool],
+        n_features: int = DEFAULT_HASH_FEATURES,
+        alpha: float = 1.0,
+    ) -> "SpamModel":
+        """Fit on tokenized documents; ``labels`` are True for spam."""
+        is_spam = np.asarray(labels, dtype=bool)
+        n_spam = int(is_spam.sum())
+        n_ham = len(is_spam) - n_spam
+        if n_spam == 0 or n_ham == 0:
+            raise ValueError("Training data must contain both spam and non-spam emails")
+
+        indices, doc_ids = _hash_documents(documents, n_features)
+        token_is_spam = is_spam[doc_ids]
+        spam_counts = np.bincount(indices[token_is_spam], minlength=n_features)
+        ham_counts = np.bincount(indices[~token_is_spam], minlength=n_features)
+
+        spam_log = np.log(spam_counts + alpha) - np.log(spam_counts.sum() + alpha * n_features)
+        ham_log = np.log(ham_counts + alpha) - np.log(ham_counts.sum() + alpha * n_features)
+
+        return cls(
+            weights=spam_log - ham_log,
+            log_prior=np.log(n_spam) - np.log(n_ham),
+            samples=len(is_spam),
+            spam_samples=n_spam,
+            trained_at=datetime.now(timezone.utc),
+        )
+
+    def predict_proba(self, documents: Sequence[Sequence[str]]) -> np.ndarray:
+        """Spam probability for each tokenized document, in one vectorized pass."""
+        if not documents:
+            return np.zeros(0, dtype=np.float64)
+        indices, doc_ids = _hash_documents(documents, self.n_features)
+        logits = self.log_prior + np.bincount(
+            doc_ids, weights=self.weights[indices], minlength=len(documents)
+        )
+        return 1.0 / (1.0 + np.exp(-np.clip(logits, -50.0, 50.0)))
+
+    def save(self, path: str | Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp.npz")
+        np.savez_compressed(
+            tmp_path,
+            weights=self.weights,
+            log_prior=np.float64(self.log_prior),
+            samples=np.int64(self.samples),
+            spam_samples=np.int64(self.spam_samples),
+            trained_at=np.float64(self.trained_at.timestamp() if self.trained_at else 0.0),
+        )
+        # 原子替换，正在运行的进程不会读到写了一半的文件
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "SpamModel":
+        with np.load(path) as data:
+            trained_at = float(data["trained_at"])
+            return cls(
+                weights=data["weights"],
+                log_prior=float(data["log_prior"]),
+                samples=int(data["samples"]),
+                spam_samples=int(data["spam_samples"]),
+                trained_at=datetime.fromtimestamp(trained_at, timezone.utc) if trained_at else None,
+            )
+
+
+def _hash_documents(
+    documents: Sequence[Sequence[str]], n_features: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Flatten documents into parallel (feature index, document index) arrays."""
+    # zlib.crc32 rather than hash(): str hashes are salted per process.
+    hashed = [[zlib.crc32(token.encode("utf-8")) for token in doc] for doc in documents]
+    lengths = np.fromiter((len(doc) for doc in hashed), dtype=np.int64, count=len(hashed))
+    flat = np.fromiter(
+        (h for doc in hashed for h in doc), dtype=np.int64, count=int(lengths.sum())
+    )
+    return flat % n_features, np.repeat(np.arange(len(hashed)), lengths)
+
+
+def _email_tokens(email_data: Dict[str, Any]) -> List[str]:
+    return tokenize_email(
+        email_data.get("from"), email_data.get("subject"), email_data.get("body_text")
+    )
+
+
+class SpamFilter:
+    """Loads the trained model on demand and tracks how many LLM calls it saves.
+
+    The model file is re-read when its mtime changes, so a retrain from the
+    CLI takes effect without restarting the server.
+    """
+
+    def __init__(self, model_path: str, threshold: float, enabled: bool = True):
+        self.model_path = model_path
+        self.threshold = threshold
+        self.enabled = enabled
+        self._model: Optional[SpamModel] = None
+        self._model_mtime: Optional[float] = None
+        self._lock = threading.Lock()
+        self._stats = {"scored": 0, "llm_calls_saved": 0}
+
+    @property
+    def model(self) -> Optional[SpamModel]:
+        try:
+            mtime = os.path.getmtime(self.model_path)
+        except OSError:
+            return self._model
+        with self._lock:
+            if mtime != self._model_mtime:
+                try:
+                    self._model = SpamModel.load(self.model_path)
+                    self._model_mtime = mtime
+                    logger.info(
+                        "Loaded spam classifier from %s (%d samples)",
+                        self.model_path,
+                        self._model.samples,
+                    )
+                except Exception as e:  # noqa: BLE001
+                    logger.warning("Failed to load spam classifier %s: %s", self.model_path, e)
+            return self._model
+
+    def set_model(self, model: Optional[SpamModel]) -> None:
+        with self._lock:
+            self._model = model
+
+    def score_batch(self, emails: Sequence[Dict[str, Any]]) -> List[Optional[float]]:
+        """Spam probability per email, or None for all when no model is available."""
+        model = self.model if self.enabled else None
+        if model is None or not emails:
+            return [None] * len(emails)
+        probabilities = model.predict_proba([_email_tokens(e) for e in emails])
+        with self._lock:
+            self._stats["scored"] += len(emails)
+        return [float(p) for p in probabilities]
+
+    def is_confident_spam(self, probability: Optional[float]) -> bool:
+        """True if the LLM call should be skipped; counts the saved call."""
+        if probability is None or probability < self.threshold:
+            return False
+        with self._lock:
+            self._stats["llm_calls_saved"] += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            model = self._model
+        stats["threshold"] = self.threshold
+        stats["model_samples"] = model.samples if model else 0
+        stats["skip_rate"] = round(stats["llm_calls_saved"] / stats["scored"], 4) if stats["scored"] else 0.0
+        return stats
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {"scored": 0, "llm_calls_saved": 0}
+
+
+spam_filter = SpamFilter(
+    model_path=settings.SPAM_CLASSIFIER_MODEL_PATH,
+    threshold=settings.SPAM_CLASSIFIER_THRESHOLD,
+    enabled=settings.SPAM_CLASSIFIER_ENABLED,
+)
+
+
+def record_verdict(
+    db: Session,
+    user_id: int,
+    email_id: str,
+    email_data: Dict[str, Any],
+    is_spam: bool,
+) -> None:
+    """Store an LLM spam verdict as training data (once per email)."""
+    exists = db.query(SpamVerdict.id).filter(SpamVerdict.email_id == email_id).first()
+    if exists:
+        return
+    db.add(
+        SpamVerdict(
+            user_id=user_id,
+            email_id=email_id,
+            sender=(email_data.get("from") or "")[:500],
+            subject=(email_data.get("subject") or "")[:500],
+            body_excerpt=(email_data.get("body_text") or "")[:_MAX_BODY_CHARS],
+            is_spam=is_spam,
+        )
+    )
+    db.commit()
+
+
+def retrain(
+    db: Session,
+    model_path: Optional[str] = None,
+    min_samples: Optional[int] = None,
+    n_features: int = DEFAULT_HASH_FEATURES,
+) -> Dict[str, Any]:
+    """Train a model from all stored verdicts and write it to ``model_path``."""
+    model_path = model_path or settings.SPAM_CLASSIFIER_MODEL_PATH
+    min_samples = settings.SPAM_CLASSIFIER_MIN_SAMPLES if min_samples is None else min_samples
+
+    rows = db.query(
+        SpamVerdict.sender, SpamVerdict.subject, SpamVerdict.body_excerpt, SpamVerdict.is_spam
+    ).all()
+    if len(rows) < min_samples:
+        raise ValueError(f"Need at least {min_samples} stored verdicts to train, found {len(rows)}")
+
+    documents = [tokenize_email(sender, subject, body) for sender, subject, body, _ in rows]
+    labels = [bool(row.is_spam) for row in rows]
+    model = SpamModel.train(documents, labels, n_features=n_features)
+    model.save(model_path)
+
+    predictions = model.predict_proba(documents)
+    threshold = settings.SPAM_CLASSIFIER_THRESHOLD
+    skipped = predictions >= threshold
+    label_array = np.asarray(labels)
+    report = {
+        "model_path": str(model_path),
+        "samples": model.samples,
+        "spam_samples": model.spam_samples,
+        "train_accuracy": round(float(((predictions >= 0.5) == label_array).mean()), 4),
+        "would_skip": int(skipped.sum()),
+        "false_skips": int((skipped & ~label_array).sum()),
+    }
+    logger.info("Retrained spam classifier: %s", report)
+    return report
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.services.spam_classifier")
+    sub = parser.add_subparsers(dest="command", required=True)
+    retrain_parser = sub.add_parser("retrain", help="Train the model from stored LLM verdicts")
+    retrain_parser.add_argument("--model-path", default=None)
+    retrain_parser.add_argument("--min-samples", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from app.core.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        report = retrain(db, model_path=args.model_path, min_samples=args.min_samples)
+    except ValueError as e:
+        print(f"Retrain skipped: {e}")
+        return 1
+    finally:
+        db.close()
+
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
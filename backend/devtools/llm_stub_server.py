@@ -0,0 +1,237 @@
+"""Local OpenAI-compatible stand-in for the LLM API.
+
+Serves ``POST /v1/chat/completions`` (plain and streaming) with a
+configurable latency, so ``process_unread_emails`` and ``/emails/generate``
+can be benchmarked offline and reproducibly. Responses come from, in order:
+
+1. a recording (``--responses``): JSONL lines ``{"key": ..., "content": ...}``
+   written by ``LLM_RECORD_PATH``, matched on the exact request messages;
+2. canned answers that follow the analysis / batch / generation prompt
+   formats in ``LLM.py``.
+
+Run from ``backend/`` and point the app at it with ``LLM_PROVIDER=local``::
+
+    python -m devtools.llm_stub_server --port 8787 --latency-ms 400 --jitter-ms 200
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.services.llm_provider import request_key
+from LLM import (
+    ANALYSIS_SYSTEM_PROMPT,
+    BATCH_ANALYSIS_INSTRUCTIONS,
+    GENERATION_SYSTEM_PROMPT,
+    MERGE_REFINE_SYSTEM_PROMPT,
+    estimate_tokens,
+)
+
+_MESSAGE_ID_RE = re.compile(r"^=== Message ID: (.+?) ===$", re.MULTILINE)
+_SUBJECT_RE = re.compile(r"^Subject:\s*(.+)$", re.MULTILINE)
+_BRIEF_RE = re.compile(r"Brief information:\s*(.+)", re.DOTALL)
+_RECIPIENT_BLOCK_RE = re.compile(
+    r"^=== Recipient ID: (.+?) ===$.*?^Subject: (.*?)$\s*^Content:\n(.*?)(?=^=== Recipient ID:|\Z)",
+    re.MULTILINE | re.DOTALL,
+)
+
+# 流式响应每个分片的字符数
+_STREAM_CHUNK_CHARS = 12
+
+
+def load_recording(path: str) -> Dict[str, str]:
+    recorded: Dict[str, str] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                recorded[entry["key"]] = entry["content"]
+    return recorded
+
+
+def canned_response(messages: List[Dict[str, Any]]) -> str:
+    """Produce a well-formed answer for whichever prompt ``LLM.py`` sent."""
+    system = messages[0].get("content", "") if messages else ""
+    user = messages[-1].get("content", "") if messages else ""
+
+    if system.startswith(ANALYSIS_SYSTEM_PROMPT + BATCH_ANALYSIS_INSTRUCTIONS):
+        return json.dumps(
+            {"results": [dict(_canned_analysis(""), message_id=i) for i in _MESSAGE_ID_RE.findall(user)]}
+        )
+    if system.startswith(ANALYSIS_SYSTEM_PROMPT):
+        subject = _SUBJECT_RE.search(user)
+        return json.dumps(_canned_analysis(subject.group(1) if subject else ""))
+    if system.startswith(MERGE_REFINE_SYSTEM_PROMPT):
+        # 原样返回已渲染的邮件
+        return json.dumps(
+            {
+                "results": [
+                    {"recipient_id": rid, "subject": subj, "content": content.strip()}
+                    for rid, subj, content in _RECIPIENT_BLOCK_RE.findall(user)
+                ]
+            },
+            ensure_ascii=False,
+        )
+    if system.startswith(GENERATION_SYSTEM_PROMPT):
+        brief = _BRIEF_RE.search(user)
+        brief_text = brief.group(1).strip().splitlines()[0] if brief else "your request"
+        return (
+            f"【Email Subject】：Re: {brief_text[:60]}\n"
+            f"【Email Content】：\nHello,\n\nThis is a generated reply about {brief_text}.\n\n"
+            "Best regards,\n[Your Name]\n"
+            "【Event Details】：none"
+        )
+    return "OK"
+
+
+def _canned_analysis(subject: str) -> Dict[str, Any]:
+    return {
+        "is_spam": False,
+        "summary": f"Stub summary of '{subject}'" if subject else "Stub summary",
+        "has_schedule": False,
+        "events": [],
+    }
+
+
+def create_app(
+    latency_ms: float = 0.0,
+    jitter_ms: float = 0.0,
+    chunk_delay_ms: float = 0.0,
+    recording: Optional[Dict[str, str]] = None,
+    seed: Optional[int] = None,
+) -> FastAPI:
+    """Build the stub app; all delays are simulated with ``asyncio.sleep``."""
+    app = FastAPI(title="LLM stub server")
+    rng = random.Random(seed)
+    recording = recording or {}
+    stats = {"requests": 0, "recorded_hits": 0, "streamed": 0}
+
+    async def _delay() -> None:
+        delay = latency_ms + (rng.uniform(0, jitter_ms) if jitter_ms else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "stub-chat", "object": "model", "owned_by": "local"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        model = body.get("model", "stub-chat")
+        stats["requests"] += 1
+
+        content = recording.get(request_key(messages))
+        if content is not None:
+            stats["recorded_hits"] += 1
+        else:
+            content = canned_response(messages)
+
+        prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in messages)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": estimate_tokens(content),
+            "total_tokens": prompt_tokens + estimate_tokens(content),
+            "prompt_cache_hit_tokens": 0,
+            "prompt_cache_miss_tokens": prompt_tokens,
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        await _delay()
+
+        if not body.get("stream"):
+            return JSONResponse(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                }
+            )
+
+        stats["streamed"] += 1
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        def _chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        async def _events():
+            yield _chunk({"role": "assistant", "content": ""})
+            for i in range(0, len(content), _STREAM_CHUNK_CHARS):
+                if chunk_delay_ms:
+                    await asyncio.sleep(chunk_delay_ms / 1000)
+                yield _chunk({"content": content[i : i + _STREAM_CHUNK_CHARS]})
+            yield _chunk({}, finish_reason="stop")
+            if include_usage:
+                payload = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [],
+                    "usage": usage,
+                }
+                yield f"data: {json.dumps(payload)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(_events(), media_type="text/event-stream")
+
+    return app
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m devtools.llm_stub_server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Base delay before each response")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Extra uniform random delay")
+    parser.add_argument("--chunk-delay-ms", type=float, default=20.0, help="Delay between streamed chunks")
+    parser.add_argument("--responses", default=None, help="JSONL recording written via LLM_RECORD_PATH")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible jitter")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    app = create_app(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        chunk_delay_ms=args.chunk_delay_ms,
+        recording=load_recording(args.responses) if args.responses else None,
+        seed=args.seed,
+    )
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
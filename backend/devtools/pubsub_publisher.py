@@ -0,0 +1,57 @@
+"""Local stand-in for the Pub/Sub push subscription that delivers Gmail watch notifications.
+
+Builds the same envelope Pub/Sub POSTs to a push endpoint and sends it to
+``/gmail/push``, so push ingestion can be exercised without Google Cloud::
+
+    python -m devtools.pubsub_publisher --email alice@example.com --history-id 12345 \\
+        --token "$GMAIL_PUSH_VERIFICATION_TOKEN"
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+DEFAULT_URL = "http://127.0.0.1:8000/api/v1/gmail/push"
+DEFAULT_SUBSCRIPTION = "projects/local/subscriptions/gmail-push"
+
+
+def build_push_envelope(
+    email_address: str, history_id: int | str, subscription: str = DEFAULT_SUBSCRIPTION
+) -> Dict[str, Any]:
+    """Pub/Sub push body carrying a Gmail ``{"emailAddress", "historyId"}`` notification."""
+    data = json.dumps({"emailAddress": email_address, "historyId": int(history_id)})
+    return {
+        "message": {
+            "data": base64.b64encode(data.encode("utf-8")).decode("ascii"),
+            "messageId": uuid.uuid4().hex,
+            "publishTime": datetime.now(timezone.utc).isoformat(),
+        },
+        "subscription": subscription,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m devtools.pubsub_publisher")
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--token", default="", help="GMAIL_PUSH_VERIFICATION_TOKEN of the target app")
+    parser.add_argument("--email", required=True, help="Mailbox address the notification is for")
+    parser.add_argument("--history-id", required=True, help="historyId carried by the notification")
+    args = parser.parse_args(argv)
+
+    import requests
+
+    resp = requests.post(
+        args.url,
+        params={"token": args.token},
+        json=build_push_envelope(args.email, args.history_id),
+        timeout=10,
+    )
+    print(resp.status_code, resp.text)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,9 @@ from app.api.middleware import LoggingMiddleware
 from app.core.config import settings
 from app.core.database import init_db
 from app.core.logging_config import get_logger, setup_logging
+from app.services.llm_provider import close_loop_clients
+from app.services.outbox import outbox_sender
+from app.services.push_ingestion import sync_queue
 
 setup_logging(
     log_level=settings.LOG_LEVEL,
@@ -23,8 +26,12 @@ async def lifespan(app: FastAPI):
     logger.info("Initializing database tables...")
     init_db()
     logger.info("Database tables initialized successfully")
+    outbox_sender.start()
     yield
     logger.info("Shutting down...")
+    sync_queue.stop()
+    outbox_sender.stop()
+    await close_loop_clients()
 
 
 app = FastAPI(
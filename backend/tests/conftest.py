@@ -50,3 +50,12 @@ def fresh_store():
     # 重置内存型 TokenStore，避免跨测试污染
     main.store = TokenStore()
     yield
+
+
+@pytest.fixture(autouse=True)
+def isolated_message_store(tmp_path, monkeypatch):
+    # 每个测试使用独立的本地邮件库，避免缓存命中掩盖 Gmail 调用
+    from app.services.message_store import message_store
+
+    monkeypatch.setattr(message_store, "path", str(tmp_path / "message_store.sqlite3"))
+    yield
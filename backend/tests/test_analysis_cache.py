@@ -0,0 +1,101 @@
+import sys
+from datetime import date, datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models.llm_cache import AnalysisCacheEntry
+from app.services import analysis_cache as ac
+
+
+RESULT = {
+    "success": True,
+    "data": {
+        "is_spam": False,
+        "judge_reason": "Team sync",
+        "is_schedule": True,
+        "events": [
+            {
+                "event_name": "Sync",
+                "start_time": datetime(2025, 1, 20, 9, 0),
+                "end_time": datetime(2025, 1, 20, 10, 0),
+                "location": "",
+                "participants": "",
+            }
+        ],
+    },
+}
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    AnalysisCacheEntry.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def test_key_normalizes_subject_sender_and_whitespace():
+    day = date(2025, 1, 1)
+    a = ac.make_analysis_key("Hello   world\n", "Bob <BOB@example.com>", "Re: Sync", day)
+    b = ac.make_analysis_key("Hello world", "bob@example.com", "FWD: re: sync", day)
+    assert a == b
+    assert a != ac.make_analysis_key("Hello world", "bob@example.com", "Sync", date(2025, 1, 2))
+
+
+def test_key_depends_on_the_recipient_set():
+    day = date(2025, 1, 1)
+    a = ac.make_analysis_key("Hi", "bob@example.com", "Sync", day, "Ann <ANN@example.com>, cid@example.com")
+    assert a == ac.make_analysis_key("Hi", "bob@example.com", "Sync", day, "cid@example.com, ann@example.com")
+    assert a != ac.make_analysis_key("Hi", "bob@example.com", "Sync", day, "ann@example.com")
+    assert a != ac.make_analysis_key("Hi", "bob@example.com", "Sync", day)
+
+
+def test_db_tier_roundtrip_restores_datetimes(db):
+    cache = ac.AnalysisCache(memory_size=8, ttl_seconds=60, max_entries=10)
+    assert cache.get(db, "k") is None
+
+    cache.put(db, "k", RESULT)
+    cache.clear_memory()
+
+    cached = cache.get(db, "k")
+    assert cached == RESULT
+    assert cache.get(db, "k") == RESULT
+
+    stats = cache.stats()
+    assert (stats["misses"], stats["db_hits"], stats["memory_hits"]) == (1, 1, 1)
+    assert db.query(AnalysisCacheEntry).one().hit_count == 1
+
+
+def test_failed_results_are_not_cached(db):
+    cache = ac.AnalysisCache(memory_size=8, ttl_seconds=60, max_entries=10)
+    cache.put(db, "k", {"success": False, "data": None, "message": "boom"})
+    assert cache.get(db, "k") is None
+    assert db.query(AnalysisCacheEntry).count() == 0
+
+
+def test_prune_evicts_least_recently_used(db):
+    cache = ac.AnalysisCache(memory_size=8, ttl_seconds=60, max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.put(db, key, RESULT)
+    cache.clear_memory()
+    cache.get(db, "a")
+
+    assert cache.prune(db) == 1
+    remaining = {row.cache_key for row in db.query(AnalysisCacheEntry).all()}
+    assert remaining == {"a", "c"}
+
+
+def test_analyze_email_cached_skips_llm_on_repeat(monkeypatch, db):
+    calls = []
+    monkeypatch.setattr(ac, "analysis_cache", ac.AnalysisCache(8, 60, 10))
+    monkeypatch.setattr(ac, "analyze_email", lambda *args, **kwargs: calls.append(1) or RESULT)
+
+    for _ in range(3):
+        assert ac.analyze_email_cached("body", "a@b.com", "subj", db=db) == RESULT
+    assert len(calls) == 1
@@ -0,0 +1,98 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import LLM
+from app.services import email_compaction as ec
+
+
+REPLY = """Hi Bob,
+
+Let's   move the review to Friday 2025-01-24 at 15:00.
+Details: https://tracking.example.com/c/abc123?utm_source=mail&utm_medium=email
+
+Thanks,
+Alice
+--
+Alice Chen | Product Manager
++1 555 0100
+
+On Mon, Jan 20, 2025 at 9:00 AM Bob <bob@example.com> wrote:
+> Can we meet on Thursday?
+> Bob
+
+CONFIDENTIALITY NOTICE: This email and any attachments may contain privileged information.
+"""
+
+
+def test_strips_history_signature_and_shortens_urls():
+    compacted, stats = ec.compact_email_body(REPLY)
+
+    assert "Friday 2025-01-24 at 15:00" in compacted
+    assert "Let's move" in compacted
+    assert "[link:tracking.example.com]" in compacted
+    assert "utm_source" not in compacted
+    assert "Thursday" not in compacted
+    assert "Product Manager" not in compacted
+    assert "CONFIDENTIALITY" not in compacted
+    assert stats["compacted_tokens"] < stats["original_tokens"]
+    assert stats["compacted_bytes"] < stats["original_bytes"]
+
+
+def test_footer_paragraph_is_removed_but_early_mentions_are_kept():
+    body = "Confidential: board meeting on 2025-02-01.\n\nAgenda attached.\n\nTo unsubscribe click here."
+    compacted, _ = ec.compact_email_body(body)
+    assert compacted == "Confidential: board meeting on 2025-02-01.\n\nAgenda attached."
+
+
+def test_chinese_quote_header_is_stripped():
+    body = "好的，周五下午三点见。\n\n在 2025年1月20日 周一 09:00，张三 <zs@example.com> 写道：\n周四可以吗？"
+    compacted, _ = ec.compact_email_body(body)
+    assert compacted == "好的，周五下午三点见。"
+
+
+FORWARDED = """FYI, see below.
+
+---------- Forwarded message ---------
+From: Training Team <training@example.com>
+Date: Mon, Jan 20, 2025 at 9:00 AM
+Subject: Security training
+To: Alice <alice@example.com>
+
+Security training is on Thursday 2025-01-23 from 14:00 to 15:30 in Room 4.
+"""
+
+
+def test_forwarded_invite_keeps_its_body():
+    compacted, _ = ec.compact_email_body(FORWARDED)
+    assert compacted.startswith("FYI, see below.")
+    assert "Thursday 2025-01-23 from 14:00 to 15:30" in compacted
+
+
+def test_reply_without_its_own_date_keeps_the_quoted_invitation():
+    body = "Works for me.\n\nOn Mon, Jan 20, 2025 at 9:00 AM Bob <bob@example.com> wrote:\n> Review on Friday 2025-01-24 at 15:00?"
+    compacted, _ = ec.compact_email_body(body)
+    assert "Friday 2025-01-24 at 15:00" in compacted
+
+
+def test_token_budget_is_enforced():
+    body = "\n".join(f"line {i} " + "word " * 20 for i in range(200))
+    compacted, stats = ec.compact_email_body(body, max_tokens=100)
+    assert LLM.estimate_tokens(compacted) <= 100
+    assert compacted.startswith("line 0")
+    assert compacted.endswith(ec.TRUNCATION_MARKER)
+    assert stats["compacted_tokens"] <= 100
+
+
+def test_fully_quoted_body_falls_back_to_original():
+    compacted, _ = ec.compact_email_body("> only quoted text")
+    assert compacted == "> only quoted text"
+
+
+def test_stats_accumulate_savings():
+    stats = ec.CompactionStats()
+    stats.record({"original_bytes": 100, "compacted_bytes": 40, "original_tokens": 30, "compacted_tokens": 10})
+    snapshot = stats.snapshot()
+    assert (snapshot["bytes_saved"], snapshot["tokens_saved"]) == (60, 20)
+    assert snapshot["token_reduction"] == round(20 / 30, 4)
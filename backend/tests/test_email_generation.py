@@ -22,12 +22,23 @@ from app.models.email_recipient import EmailRecipient
 from app.services import gmail
 from app.db.helpers import get_or_create_user, get_latest_token
 from app.services.email_generation import email_generation_service
+from app.services.outbox import outbox_sender
 
 def _make_client():
     sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
     import main as main  # type: ignore
     return TestClient(main.app)
 
+
+def _wait_sent(client, headers, outbox_id):
+    """发送接口只入队；这里直接跑一轮发件箱，再查询发送状态。"""
+    outbox_sender.run_once()
+    r = client.get(f"/api/v1/emails/outbox/{outbox_id}", headers=headers)
+    assert r.status_code == 200
+    sent = r.json()
+    assert sent.get("status") == "sent", sent.get("last_error")
+    return sent
+
 def _ensure_user_token_and_recipient():
     db = SessionLocal()
     email = f"test-{uuid.uuid4().hex[:8]}@example.com"
@@ -104,11 +115,12 @@ def _run_generate_and_send_email():
     }
     r2 = client.post("/api/v1/emails/send", headers=headers, json=send_payload)
     print("send", r2.status_code, r2.text)
-    assert r2.status_code == 200
+    assert r2.status_code == 202
     send_body = r2.json()
     assert send_body.get("success") is True
-    assert send_body.get("gmail_message_id")
-    assert send_body.get("thread_id")
+    sent = _wait_sent(client, headers, send_body["outbox_id"])
+    assert sent.get("gmail_message_id")
+    assert sent.get("thread_id")
     db.close()
 
 def _run_generate_and_send_email_multiple():
@@ -143,11 +155,12 @@ def _run_generate_and_send_email_multiple():
     }
     r2 = client.post("/api/v1/emails/send", headers=auth_headers, json=send_payload)
     print("send_multi", r2.status_code, r2.text)
-    assert r2.status_code == 200
+    assert r2.status_code == 202
     send_body = r2.json()
     assert send_body.get("success") is True
-    assert send_body.get("gmail_message_id")
-    assert send_body.get("thread_id")
+    sent = _wait_sent(client, auth_headers, send_body["outbox_id"])
+    assert sent.get("gmail_message_id")
+    assert sent.get("thread_id")
     db.close()
 
 def _suite(name):
@@ -0,0 +1,317 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services import email_processor as ep
+from app.services.spam_classifier import SpamFilter
+
+
+def _fake_pipeline(monkeypatch, delay=0.05):
+    state = {"in_flight": 0, "peak": 0, "stored": [], "verdicts": [], "marked": []}
+    monkeypatch.setattr(ep.settings, "GMAIL_INCREMENTAL_SYNC_ENABLED", False)
+
+    monkeypatch.setattr(
+        ep.gmail,
+        "iter_message_pages",
+        lambda db, user_id, max_results: iter([[{"id": f"m{i}"} for i in range(max_results)] + [{}]]),
+    )
+    monkeypatch.setattr(ep, "get_existing_email_ids", lambda db, ids: {"m0"})
+    monkeypatch.setattr(
+        ep,
+        "_fetch_message",
+        lambda user_id, email_id: {"id": email_id, "subject": email_id, "body_text": "hi"},
+    )
+    monkeypatch.setattr(ep, "_fetch_messages_batch", lambda user_id, email_ids: {})
+    monkeypatch.setattr(ep, "_fetch_metadata_batch", lambda user_id, email_ids: {})
+    monkeypatch.setattr(ep, "_mark_processed", lambda user_id, email_ids: state["marked"].extend(email_ids) or len(email_ids))
+
+    async def fake_analyze(email_content, sender=None, subject=None, recipients=None):
+        state["in_flight"] += 1
+        state["peak"] = max(state["peak"], state["in_flight"])
+        await asyncio.sleep(delay)
+        state["in_flight"] -= 1
+        return {
+            "success": True,
+            "data": {"is_spam": subject == "m1", "judge_reason": "", "is_schedule": False, "events": []},
+        }
+
+    def fake_store(user_id, email_id, email_data, data):
+        state["stored"].append(email_id)
+        return 1, 2
+
+    monkeypatch.setattr(ep, "analyze_email_cached_async", fake_analyze)
+    monkeypatch.setattr(ep, "_store_analysis", fake_store)
+    monkeypatch.setattr(ep, "_record_verdict", lambda *args: state["verdicts"].append(args[1]))
+    monkeypatch.setattr(ep, "spam_filter", SpamFilter("missing.npz", threshold=0.9))
+    return state
+
+
+def test_process_unread_emails_runs_concurrently(monkeypatch):
+    state = _fake_pipeline(monkeypatch)
+
+    start = time.perf_counter()
+    processed, created, message = ep.process_unread_emails(None, 1, 10)
+    elapsed = time.perf_counter() - start
+
+    # m0 is already stored, m1 is spam, the id-less message is skipped
+    assert processed == 8
+    assert created == 16
+    assert "processed 8 emails" in message
+    assert sorted(state["stored"]) == sorted(f"m{i}" for i in range(2, 10))
+    assert state["peak"] > 1
+    assert elapsed < 9 * 0.05
+
+
+def test_stored_and_already_stored_mail_is_marked_processed(monkeypatch):
+    state = _fake_pipeline(monkeypatch, delay=0.0)
+
+    _, _, _, stats = ep.process_unread_emails_with_stats(None, 1, 5)
+
+    # m1 is spam and not stored, but it is labelled too
+    assert sorted(state["marked"]) == ["m0", "m1", "m2", "m3", "m4"]
+    assert stats["marked_processed"] == 5
+
+    monkeypatch.setattr(ep.settings, "GMAIL_MARK_PROCESSED_ENABLED", False)
+    state["marked"].clear()
+    ep.process_unread_emails(None, 1, 5)
+    assert state["marked"] == []
+
+
+def test_spam_is_not_listed_again(monkeypatch):
+    state = _fake_pipeline(monkeypatch, delay=0.0)
+    spam_filter = SpamFilter("missing.npz", threshold=0.9)
+    monkeypatch.setattr(spam_filter, "score_batch", lambda emails: [0.99 if e["id"] == "m2" else 0.1 for e in emails])
+    monkeypatch.setattr(ep, "spam_filter", spam_filter)
+    analyzed = []
+    fake_analyze = ep.analyze_email_cached_async
+
+    async def counting_analyze(email_content, sender=None, subject=None, recipients=None):
+        analyzed.append(subject)
+        return await fake_analyze(email_content, sender=sender, subject=subject, recipients=recipients)
+
+    monkeypatch.setattr(ep, "analyze_email_cached_async", counting_analyze)
+    # the listing query excludes the processed label
+    monkeypatch.setattr(
+        ep.gmail,
+        "iter_message_pages",
+        lambda db, user_id, max_results: iter(
+            [[{"id": f"m{i}"} for i in range(max_results) if f"m{i}" not in state["marked"]]]
+        ),
+    )
+
+    _, _, _, first = ep.process_unread_emails_with_stats(None, 1, 4)
+    _, _, _, second = ep.process_unread_emails_with_stats(None, 1, 4)
+
+    # m1 is spam by LLM verdict, m2 by the classifier
+    assert {"m1", "m2"} <= set(state["marked"])
+    assert first["listed"] == 4
+    assert second["listed"] == 0
+    assert sorted(analyzed) == ["m1", "m3"]
+
+
+def test_process_unread_emails_respects_concurrency_limit(monkeypatch):
+    state = _fake_pipeline(monkeypatch, delay=0.01)
+
+    asyncio.run(ep.process_unread_emails_async(None, 1, 10, concurrency=2))
+
+    assert state["peak"] == 2
+
+
+def test_process_unread_emails_with_stats_reports_run_counts(monkeypatch):
+    _fake_pipeline(monkeypatch, delay=0.0)
+
+    processed, _, _, stats = ep.process_unread_emails_with_stats(None, 1, 5)
+
+    assert processed == 3
+    assert stats["listed"] == 5
+    assert stats["already_processed"] == 1
+    assert stats["failed"] == 0
+    assert stats["duration_seconds"] >= 0
+    # the fake analyzer makes no real LLM calls
+    assert stats["llm"] == {}
+
+
+def test_prefetched_messages_skip_single_fetch(monkeypatch):
+    state = _fake_pipeline(monkeypatch, delay=0.0)
+    single = []
+    monkeypatch.setattr(
+        ep,
+        "_fetch_messages_batch",
+        lambda user_id, email_ids: {
+            email_id: {"id": email_id, "subject": email_id, "body_text": "hi"}
+            for email_id in email_ids
+            if email_id != "m3"
+        },
+    )
+    monkeypatch.setattr(
+        ep,
+        "_fetch_message",
+        lambda user_id, email_id: single.append(email_id) or {"id": email_id, "subject": email_id, "body_text": "hi"},
+    )
+
+    processed, _, _ = ep.process_unread_emails(None, 1, 5)
+
+    assert processed == 3
+    assert single == ["m3"]
+
+
+def test_two_phase_fetch_only_downloads_bodies_that_pass_metadata_filters(monkeypatch):
+    state = _fake_pipeline(monkeypatch, delay=0.0)
+    monkeypatch.setattr(ep.settings, "INGEST_SKIP_SENDERS", ["*@news.example.com"])
+    metadata = {
+        "m1": {"from": "Alice <alice@example.com>", "message_id": "<a@x>"},
+        "m2": {"from": "alice@example.com", "message_id": "<a@x>"},
+        "m3": {"from": "Deals <promo@news.example.com>", "message_id": "<b@x>"},
+    }
+    fetched = []
+    monkeypatch.setattr(ep, "_fetch_metadata_batch", lambda user_id, email_ids: metadata)
+    monkeypatch.setattr(ep, "_fetch_messages_batch", lambda user_id, email_ids: fetched.extend(email_ids) or {})
+
+    _, _, _, stats = ep.process_unread_emails_with_stats(None, 1, 5)
+
+    assert fetched == ["m1", "m4"]
+    assert stats["filtered_on_metadata"] == {"duplicate": 1, "sender": 1}
+    assert sorted(state["stored"]) == ["m4"]
+
+
+def test_pages_are_processed_while_the_next_one_is_listed(monkeypatch):
+    _fake_pipeline(monkeypatch, delay=0.05)
+    events = []
+
+    def pages(db, user_id, max_results):
+        for start in range(0, max_results, 2):
+            events.append(f"list {start}")
+            yield [{"id": f"m{i}"} for i in range(start, min(start + 2, max_results))]
+
+    def fake_store(user_id, email_id, email_data, data):
+        events.append(f"store {email_id}")
+        return 1, 0
+
+    monkeypatch.setattr(ep.gmail, "iter_message_pages", pages)
+    monkeypatch.setattr(ep, "_store_analysis", fake_store)
+
+    processed, _, _, stats = ep.process_unread_emails_with_stats(None, 1, 6)
+
+    assert processed == 4
+    assert stats["listed"] == 6
+    assert stats["already_processed"] == 1
+    # the third page is requested while the second one is still being analyzed
+    assert events.index("list 4") < events.index("store m3")
+    assert events.index("store m3") < events.index("store m4")
+
+
+def test_failed_analysis_holds_the_history_cursor(monkeypatch):
+    state = _fake_pipeline(monkeypatch, delay=0.0)
+    saved = []
+    monkeypatch.setattr(ep.settings, "GMAIL_INCREMENTAL_SYNC_ENABLED", True)
+    monkeypatch.setattr(
+        ep.mailbox_sync,
+        "list_new_messages",
+        lambda db, user_id, max_results: ep.mailbox_sync.SyncBatch(
+            iter([[{"id": f"m{i}"} for i in range(5)]]), ep.mailbox_sync.INCREMENTAL, "200"
+        ),
+    )
+    monkeypatch.setattr(ep.mailbox_sync, "save_cursor", lambda db, user_id, batch: saved.append(batch.next_history_id))
+
+    failing = {"m3"}
+
+    async def flaky_analyze(email_content, sender=None, subject=None, recipients=None):
+        if subject in failing:
+            return {"success": False, "error": "timeout"}
+        return {"success": True, "data": {"is_spam": False, "is_schedule": False, "events": []}}
+
+    monkeypatch.setattr(ep, "analyze_email_cached_async", flaky_analyze)
+
+    processed, _, _, stats = ep.process_unread_emails_with_stats(None, 1, 5)
+
+    assert processed == 3
+    assert stats["failed"] == 1
+    # the cursor stays put and m3 is not labelled, so the next run lists it again
+    assert saved == []
+    assert "m3" not in state["marked"]
+
+    failing.clear()
+    ep.process_unread_emails(None, 1, 5)
+    assert saved == ["200"]
+
+
+def test_process_unread_emails_no_messages(monkeypatch):
+    monkeypatch.setattr(ep.settings, "GMAIL_INCREMENTAL_SYNC_ENABLED", False)
+    monkeypatch.setattr(ep.gmail, "iter_message_pages", lambda db, user_id, max_results: iter([]))
+
+    assert ep.process_unread_emails(None, 1, 5) == (0, 0, "No new emails to process")
+
+
+def test_process_unread_emails_batch_mode(monkeypatch):
+    state = _fake_pipeline(monkeypatch)
+    batches = []
+
+    async def fake_batch(emails, max_batch_tokens, max_batch_emails, concurrency):
+        batches.append([item["id"] for item in emails])
+        return {
+            item["id"]: {
+                "success": True,
+                "data": {"is_spam": item["id"] == "m1", "is_schedule": False, "events": []},
+            }
+            for item in emails
+            if item["id"] != "m2"
+        }
+
+    monkeypatch.setattr(ep.settings, "LLM_ANALYSIS_BATCH_SIZE", 4)
+    monkeypatch.setattr(ep, "analyze_email_batch_cached_async", fake_batch)
+
+    processed, created, _, stats = ep.process_unread_emails_with_stats(None, 1, 6)
+
+    assert batches == [["m1", "m2", "m3", "m4", "m5"]]
+    # m1 is spam and the analysis for m2 is missing
+    assert sorted(state["stored"]) == ["m3", "m4", "m5"]
+    assert (processed, created) == (3, 6)
+    assert stats["failed"] == 1
+
+
+def test_confident_spam_skips_llm(monkeypatch):
+    state = _fake_pipeline(monkeypatch)
+    spam_filter = SpamFilter("missing.npz", threshold=0.9)
+    monkeypatch.setattr(
+        spam_filter,
+        "score_batch",
+        lambda emails: [0.99 if e["id"] in ("m3", "m4") else 0.1 for e in emails],
+    )
+    monkeypatch.setattr(ep, "spam_filter", spam_filter)
+
+    processed, _, _ = ep.process_unread_emails(None, 1, 6)
+
+    assert processed == 2
+    assert sorted(state["stored"]) == ["m2", "m5"]
+    # only the LLM verdict is kept as training data, not the classifier's own
+    assert state["verdicts"] == ["m1"]
+    assert spam_filter.stats()["llm_calls_saved"] == 2
+
+
+def test_templated_schedule_skips_llm(monkeypatch):
+    state = _fake_pipeline(monkeypatch)
+    analyzed = []
+    original = ep.analyze_email_cached_async
+
+    async def counting_analyze(email_content, sender=None, subject=None, recipients=None):
+        analyzed.append(subject)
+        return await original(email_content, sender, subject, recipients)
+
+    monkeypatch.setattr(ep, "analyze_email_cached_async", counting_analyze)
+    monkeypatch.setattr(
+        ep,
+        "_fetch_message",
+        lambda user_id, email_id: {
+            "id": email_id,
+            "subject": email_id,
+            "body_text": "Meeting: Review\nTime: 2025-01-20 14:00-15:00" if email_id == "m2" else "hi",
+        },
+    )
+
+    ep.process_unread_emails(None, 1, 4)
+
+    assert sorted(analyzed) == ["m1", "m3"]
+    assert sorted(state["stored"]) == ["m2", "m3"]
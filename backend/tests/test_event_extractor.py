@@ -0,0 +1,67 @@
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import LLM
+from app.services.event_extractor import extract_schedule
+
+
+ROOM_BOOKING = """Your room booking is confirmed.
+
+Meeting: Q1 planning
+Room: 3F-Orion
+Time: 2025-01-20 (Mon) 14:00-15:30
+Attendees: alice@example.com, bob@example.com
+"""
+
+
+def test_room_booking_matches_llm_result_shape():
+    result = extract_schedule(ROOM_BOOKING, "Booking confirmed: Q1 planning")
+
+    expected = LLM.parse_json_response(
+        json.dumps(
+            {
+                "is_spam": False,
+                "summary": "Q1 planning: 2025-01-20 14:00-15:30 @ 3F-Orion",
+                "has_schedule": True,
+                "events": [
+                    {
+                        "name": "Q1 planning",
+                        "date": "2025-01-20",
+                        "start_time": "14:00",
+                        "end_time": "15:30",
+                        "location": "3F-Orion",
+                        "participants": "alice@example.com, bob@example.com",
+                    }
+                ],
+            }
+        )
+    )
+    assert result == expected
+    assert result["data"]["events"][0]["start_time"] == datetime(2025, 1, 20, 14, 0)
+
+
+def test_chinese_notice_uses_subject_as_event_name():
+    body = "各位同事：\n\n定于2025年3月5日（周三）9:30至11:00召开部门例会。\n地点：A栋201\n"
+    result = extract_schedule(body, "回复：部门例会通知")
+
+    event = result["data"]["events"][0]
+    assert event["event_name"] == "部门例会通知"
+    assert (event["start_time"], event["end_time"]) == (datetime(2025, 3, 5, 9, 30), datetime(2025, 3, 5, 11, 0))
+    assert event["location"] == "A栋201"
+
+
+def test_ambiguous_or_incomplete_mail_falls_back():
+    # no end time
+    assert extract_schedule("Meeting on 2025-01-20 14:00", "Sync") is None
+    # two different slots
+    assert extract_schedule("Meeting 2025-01-20 14:00-15:00 or 2025-01-21 10:00-11:00", "Sync") is None
+    # relative date mentioned alongside
+    assert extract_schedule("Meeting 2025-01-20 14:00-15:00, prep call tomorrow", "Sync") is None
+    # no scheduling keyword
+    assert extract_schedule("Order shipped 2025-01-20 14:00-15:00", "Your order") is None
+    # end before start
+    assert extract_schedule("Meeting 2025-01-20 15:00-14:00", "Sync") is None
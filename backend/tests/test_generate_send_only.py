@@ -18,6 +18,7 @@ from fastapi.testclient import TestClient
 from app.core.database import SessionLocal
 from app.core.security import create_access_token
 from app.db.helpers import get_or_create_user, get_latest_token
+from app.services.outbox import outbox_sender
 
 
 def _make_client():
@@ -25,6 +26,16 @@ def _make_client():
     return TestClient(main.app)
 
 
+def _wait_sent(client, headers, outbox_id):
+    """发送接口只入队；这里直接跑一轮发件箱，再查询发送状态。"""
+    outbox_sender.run_once()
+    r = client.get(f"/api/v1/emails/outbox/{outbox_id}", headers=headers)
+    assert r.status_code == 200
+    sent = r.json()
+    assert sent.get("status") == "sent", sent.get("last_error")
+    return sent
+
+
 def _ensure_recipient(client, headers, email, name):
     r = client.post("/api/v1/recipients/", headers=headers, json={"name": name, "email": email})
     if r.status_code == 200:
@@ -116,11 +127,12 @@ def _run_send_only():
         "body_html": None
     }
     r = client.post("/api/v1/emails/send", headers=headers, json=payload)
-    assert r.status_code == 200
+    assert r.status_code == 202
     body = r.json()
     assert body.get("success") is True
-    assert body.get("gmail_message_id")
-    assert body.get("thread_id")
+    sent = _wait_sent(client, headers, body["outbox_id"])
+    assert sent.get("gmail_message_id")
+    assert sent.get("thread_id")
     db.close()
 
 
@@ -174,11 +186,12 @@ class TestGenerateSendOnly(unittest.TestCase):
             "body_html": None
         }
         r = client.post("/api/v1/emails/send", headers=headers, json=payload)
-        assert r.status_code == 200
+        assert r.status_code == 202
         body = r.json()
         assert body.get("success") is True
-        assert body.get("gmail_message_id")
-        assert body.get("thread_id")
+        sent = _wait_sent(client, headers, body["outbox_id"])
+        assert sent.get("gmail_message_id")
+        assert sent.get("thread_id")
         db.close()
 
 
@@ -0,0 +1,126 @@
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import LLM
+import main as main
+from app.core.database import get_db
+from app.core.deps import get_current_user
+from app.services.email_generation import email_generation_service
+from app.services.llm_provider import LLMProvider
+
+
+RESPONSE = "【Email Subject】：Project sync tomorrow\n【Email Content】：\nHi team,\n\nLet's meet at **2pm**.\n\nBest,\n[Your Name]"
+
+
+def _feed_in_chunks(parser, text, size):
+    events = []
+    for i in range(0, len(text), size):
+        events.extend(parser.feed(text[i : i + size]))
+    events.extend(parser.finish())
+    return events
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, len(RESPONSE)])
+def test_stream_parser_emits_subject_then_body_deltas(size):
+    parser = LLM.EmailStreamParser()
+    events = _feed_in_chunks(parser, RESPONSE, size)
+
+    assert events[0] == ("subject", "Project sync tomorrow")
+    assert all(kind == "delta" for kind, _ in events[1:])
+    body = "".join(text for _, text in events[1:])
+    assert body.strip() == LLM.parse_email_generation_response(RESPONSE)["data"]["content"]
+    assert parser.content == body.strip()
+
+
+def test_stream_parser_subject_is_emitted_before_body_arrives():
+    parser = LLM.EmailStreamParser()
+    assert parser.feed("【Email Subject】：Hel") == []
+    assert parser.feed("lo\n") == [("subject", "Hello")]
+    assert parser.feed("【Email Content】：Body") == [("delta", "Body")]
+
+
+def test_stream_parser_reads_event_details_after_body():
+    parser = LLM.EmailStreamParser()
+    text = RESPONSE + '\n【Event Details】：{"title": "Project sync", "date": "2031-03-05", "start_time": "14:00"}'
+    events = _feed_in_chunks(parser, text, 6)
+
+    body = "".join(text for kind, text in events if kind == "delta")
+    assert "Event Details" not in body
+    assert parser.event == {"title": "Project sync", "date": "2031-03-05", "start_time": "14:00"}
+
+
+def test_generate_email_from_draft_makes_one_llm_call(monkeypatch):
+    calls = []
+
+    class Completions:
+        def create(self, **kwargs):
+            calls.append(kwargs)
+            content = RESPONSE + "\n【Event Details】：none"
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=Completions()))
+    monkeypatch.setattr(LLM, "get_provider", lambda name=None: LLMProvider("test", "test-model", client=client))
+
+    result = email_generation_service.generate_email_from_draft(
+        subject=None, brief_content="sync tomorrow 2pm", tone="friendly", sender_name="Alice"
+    )
+
+    assert result["success"]
+    assert len(calls) == 1
+    assert result["data"]["subject"] == "Project sync tomorrow"
+    assert result["data"]["event"] is None
+
+
+def test_stream_parser_falls_back_without_markers():
+    parser = LLM.EmailStreamParser()
+    events = _feed_in_chunks(parser, "Email Subject - Hi\nsome body", 4)
+    assert ("delta", "some body") in events
+
+
+@pytest.fixture
+def stream_client(monkeypatch):
+    chunks = [RESPONSE[i : i + 5] for i in range(0, len(RESPONSE), 5)]
+
+    def fake_create(**kwargs):
+        assert kwargs["stream"] is True
+        for text in chunks:
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None
+            )
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=fake_create)))
+    monkeypatch.setattr(LLM, "get_provider", lambda name=None: LLMProvider("test", "test-model", client=client))
+    main.app.dependency_overrides[get_db] = lambda: None
+    main.app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(id=1, full_name="Alice")
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+
+def test_generate_stream_endpoint_sends_sse(stream_client):
+    resp = stream_client.post(
+        "/api/v1/emails/generate/stream",
+        json={"to_email": "bob@example.com", "brief_content": "sync tomorrow"},
+    )
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+
+    events = []
+    for block in resp.text.strip().split("\n\n"):
+        kind, data = block.split("\n", 1)
+        events.append((kind.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+
+    assert events[0] == ("subject", {"subject": "Project sync tomorrow"})
+    assert {kind for kind, _ in events[1:-1]} == {"delta"}
+    kind, final = events[-1]
+    assert kind == "done"
+    assert final["subject"] == "Project sync tomorrow"
+    assert "**" not in final["body"]
+    assert final["body"].endswith("Alice")
+    assert final["body_html"].startswith("<!DOCTYPE html>")
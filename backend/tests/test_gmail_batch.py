@@ -0,0 +1,254 @@
+import sys
+from base64 import urlsafe_b64encode
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from app.services import gmail
+
+
+def _message(email_id):
+    body = urlsafe_b64encode(f"body of {email_id}".encode()).decode()
+    return {
+        "id": email_id,
+        "threadId": f"t-{email_id}",
+        "snippet": "",
+        "payload": {
+            "headers": [{"name": "Subject", "value": f"subject {email_id}"}, {"name": "From", "value": "a@b.com"}],
+            "body": {"data": body},
+        },
+    }
+
+
+def _http_error(status, reason=b""):
+    return HttpError(SimpleNamespace(status=status, reason="err"), reason)
+
+
+class FakeGmail:
+    """Batch-capable fake; ``failures`` maps id -> list of errors returned on successive attempts."""
+
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.batches = []
+        self.requests = []
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def get(self, userId, id, **kwargs):
+        self.requests.append(kwargs)
+        return id
+
+    def new_batch_http_request(self, callback):
+        service = self
+
+        class Batch:
+            def __init__(self):
+                self.ids = []
+
+            def add(self, request, request_id):
+                self.ids.append(request_id)
+
+            def execute(self):
+                service.batches.append(list(self.ids))
+                for email_id in self.ids:
+                    errors = service.failures.get(email_id) or []
+                    if errors:
+                        callback(email_id, None, errors.pop(0))
+                    else:
+                        callback(email_id, _message(email_id), None)
+
+        return Batch()
+
+
+@pytest.fixture
+def fake_gmail(monkeypatch):
+    def _install(**kwargs):
+        service = FakeGmail(**kwargs)
+        monkeypatch.setattr(gmail, "gmail_service", lambda db, user_id: service)
+        monkeypatch.setattr(gmail.time, "sleep", lambda seconds: None)
+        return service
+
+    return _install
+
+
+def test_batch_fetch_groups_requests_and_parses_like_get_email(fake_gmail):
+    service = fake_gmail()
+    ids = [f"m{i}" for i in range(120)]
+
+    results = gmail.get_emails_batch(None, "1", ids, batch_size=50)
+
+    assert [len(batch) for batch in service.batches] == [50, 50, 20]
+    assert set(results) == set(ids)
+    assert results["m7"] == gmail._parse_message("m7", _message("m7"))
+    assert results["m7"]["body_text"] == "body of m7"
+
+
+def test_batch_fetch_only_requests_messages_missing_from_the_store(fake_gmail):
+    service = fake_gmail()
+    gmail.get_emails_batch(None, "1", ["m0", "m1"])
+
+    results = gmail.get_emails_batch(None, "1", ["m0", "m1", "m2"])
+
+    assert service.batches == [["m0", "m1"], ["m2"]]
+    assert results["m1"] == gmail._parse_message("m1", _message("m1"))
+
+
+def test_masked_fetches_are_not_served_as_full_messages(fake_gmail):
+    service = fake_gmail()
+    gmail.get_emails_batch(None, "1", ["m0"], fields=gmail.FULL_MESSAGE_FIELDS)
+    gmail.get_emails_batch(None, "1", ["m0"], fields=gmail.FULL_MESSAGE_FIELDS)
+    assert service.batches == [["m0"]]
+
+    # the trimmed copy lacks labelIds and deep parts, so a full read goes to Gmail
+    gmail.get_emails_batch(None, "1", ["m0"])
+    assert service.batches == [["m0"], ["m0"]]
+    assert "fields" not in service.requests[-1]
+
+
+def test_rate_limited_items_are_retried_in_smaller_batches(fake_gmail):
+    service = fake_gmail(failures={"m1": [_http_error(429)], "m2": [_http_error(429)], "m3": [_http_error(404)]})
+
+    results = gmail.get_emails_batch(None, "1", ["m0", "m1", "m2", "m3"], batch_size=4)
+
+    assert service.batches == [["m0", "m1", "m2", "m3"], ["m1", "m2"]]
+    assert set(results) == {"m0", "m1", "m2"}
+
+
+def test_batch_size_is_capped_at_gmail_limit(fake_gmail):
+    service = fake_gmail()
+
+    gmail.get_emails_batch(None, "1", [f"m{i}" for i in range(150)], batch_size=500)
+
+    assert [len(batch) for batch in service.batches] == [100, 50]
+
+
+def test_metadata_batch_requests_headers_only(fake_gmail):
+    service = fake_gmail()
+
+    results = gmail.get_email_metadata_batch(None, "1", ["m1"])
+
+    assert service.requests == [{"format": "metadata", "metadataHeaders": gmail.METADATA_HEADERS}]
+    assert results["m1"]["subject"] == "subject m1"
+    assert results["m1"]["from"] == "a@b.com"
+
+
+def test_full_fetch_can_use_fields_mask(fake_gmail):
+    service = fake_gmail()
+
+    gmail.get_emails_batch(None, "1", ["m1"], fields=gmail.FULL_MESSAGE_FIELDS)
+
+    assert service.requests[0]["fields"].startswith("id,threadId,snippet,payload(")
+
+
+class FakeList:
+    """``messages().list()`` over a mailbox of ``total`` ids, paged by ``maxResults``."""
+
+    def __init__(self, total):
+        self.total = total
+        self.calls = []
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def list(self, **kwargs):
+        self.calls.append(kwargs)
+        start = int(kwargs.get("pageToken") or 0)
+        end = min(start + kwargs["maxResults"], self.total)
+        result = {"messages": [{"id": f"m{i}"} for i in range(start, end)]}
+        if end < self.total:
+            result["nextPageToken"] = str(end)
+        return SimpleNamespace(execute=lambda: result)
+
+
+def test_iter_message_pages_follows_tokens_lazily_up_to_cap(monkeypatch):
+    service = FakeList(total=10)
+    monkeypatch.setattr(gmail, "gmail_service", lambda db, user_id: service)
+
+    pages = gmail.iter_message_pages(None, "1", max_results=7, page_size=3)
+    assert service.calls == []
+    assert [m["id"] for m in next(pages)] == ["m0", "m1", "m2"]
+    assert len(service.calls) == 1
+
+    rest = list(pages)
+    assert [[m["id"] for m in page] for page in rest] == [["m3", "m4", "m5"], ["m6"]]
+    assert [call.get("pageToken") for call in service.calls] == [None, "3", "6"]
+    assert service.calls[-1]["maxResults"] == 1
+
+
+def test_fetch_emails_reads_whole_listing_when_under_cap(monkeypatch):
+    service = FakeList(total=5)
+    monkeypatch.setattr(gmail, "gmail_service", lambda db, user_id: service)
+    monkeypatch.setattr(gmail.settings, "GMAIL_LIST_PAGE_SIZE", 2)
+
+    assert [m["id"] for m in gmail.fetch_emails(None, "1", max_results=50)] == ["m0", "m1", "m2", "m3", "m4"]
+    assert len(service.calls) == 3
+
+
+class FakeModify:
+    """``labels().list/create`` and ``messages().batchModify`` recording their calls."""
+
+    def __init__(self, existing):
+        self.existing = existing
+        self.created = []
+        self.modified = []
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def labels(self):
+        return self
+
+    def list(self, userId):
+        return SimpleNamespace(execute=lambda: {"labels": self.existing})
+
+    def create(self, userId, body):
+        self.created.append(body["name"])
+        return SimpleNamespace(execute=lambda: {"id": "Label_new"})
+
+    def batchModify(self, userId, body):
+        self.modified.append(body)
+        return SimpleNamespace(execute=lambda: None)
+
+
+def test_mark_processed_chunks_batch_modify_and_creates_label(monkeypatch):
+    service = FakeModify(existing=[{"id": "INBOX", "name": "INBOX"}])
+    monkeypatch.setattr(gmail, "gmail_service", lambda db, user_id: service)
+    monkeypatch.setattr(gmail, "_label_ids", {})
+
+    ids = [f"m{i}" for i in range(2500)]
+    assert gmail.mark_processed(None, "1", ids + ["m0"], label_name="Agent/Done", remove_unread=True) == 2500
+
+    assert service.created == ["Agent/Done"]
+    assert [len(body["ids"]) for body in service.modified] == [1000, 1000, 500]
+    assert service.modified[0]["addLabelIds"] == ["Label_new"]
+    assert service.modified[0]["removeLabelIds"] == ["UNREAD"]
+
+    # the label id is cached, so a second run neither lists nor creates labels
+    service.existing = []
+    gmail.mark_processed(None, "1", ["x"], label_name="Agent/Done", remove_unread=False)
+    assert service.created == ["Agent/Done"]
+    assert "removeLabelIds" not in service.modified[-1]
+
+
+def test_list_query_excludes_processed_label(monkeypatch):
+    monkeypatch.setattr(gmail.settings, "GMAIL_LIST_QUERY", "is:unread newer_than:30d")
+    monkeypatch.setattr(gmail.settings, "GMAIL_PROCESSED_LABEL", "Mail Agent/Processed")
+    monkeypatch.setattr(gmail.settings, "GMAIL_MARK_PROCESSED_ENABLED", True)
+    assert gmail.list_query() == "is:unread newer_than:30d -label:Mail-Agent-Processed"
+
+    monkeypatch.setattr(gmail.settings, "GMAIL_MARK_PROCESSED_ENABLED", False)
+    assert gmail.list_query() == "is:unread newer_than:30d"
@@ -0,0 +1,78 @@
+import sys
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main as main
+from app.core.database import get_db
+from app.services import push_ingestion
+from devtools.pubsub_publisher import build_push_envelope
+
+
+def test_envelope_roundtrip_and_validation():
+    envelope = build_push_envelope("alice@example.com", 42)
+    assert push_ingestion.decode_push_envelope(envelope) == ("alice@example.com", "42")
+
+    with pytest.raises(push_ingestion.InvalidPushMessage):
+        push_ingestion.decode_push_envelope({"message": {"data": "bm90IGpzb24"}})
+
+
+def test_queue_coalesces_and_reruns_after_mid_sync_notification():
+    started, release = threading.Event(), threading.Event()
+    runs = []
+
+    def runner(user_id):
+        runs.append(user_id)
+        if len(runs) == 1:
+            started.set()
+            release.wait(2)
+
+    queue = push_ingestion.SyncQueue(runner=runner, workers=1)
+    assert queue.enqueue(1)
+    started.wait(2)
+    # 同步进行中：第一条通知安排一次补跑，之后的合并进去
+    assert queue.enqueue(1)
+    assert not queue.enqueue(1)
+    release.set()
+
+    assert queue.wait_idle(2)
+    queue.stop()
+    assert runs == [1, 1]
+    assert queue.stats()["coalesced"] == 1
+
+
+@pytest.fixture
+def push_client(monkeypatch):
+    queued = []
+    monkeypatch.setattr(push_ingestion.settings, "GMAIL_PUSH_VERIFICATION_TOKEN", "secret")
+    monkeypatch.setattr(push_ingestion, "get_user", lambda db, key: SimpleNamespace(id=7) if key == "alice@example.com" else None)
+    monkeypatch.setattr(
+        push_ingestion.mailbox_sync, "get_sync_state", lambda db, user_id: SimpleNamespace(history_id="100")
+    )
+    monkeypatch.setattr(push_ingestion.sync_queue, "enqueue", lambda user_id: queued.append(user_id) or True)
+    main.app.dependency_overrides[get_db] = lambda: None
+    yield TestClient(main.app), queued
+    main.app.dependency_overrides.clear()
+
+
+def test_push_endpoint_enqueues_sync_for_new_history(push_client):
+    client, queued = push_client
+
+    def push(email, history_id, token="secret"):
+        return client.post(
+            "/api/v1/gmail/push", params={"token": token}, json=build_push_envelope(email, history_id)
+        )
+
+    assert push("alice@example.com", 150).status_code == 204
+    assert push("alice@example.com", 90).status_code == 204
+    assert push("bob@example.com", 150).status_code == 204
+    assert queued == [7]
+
+    assert push("alice@example.com", 150, token="wrong").status_code == 403
+    bad = client.post("/api/v1/gmail/push", params={"token": "secret"}, json={"message": {}})
+    assert bad.status_code == 400
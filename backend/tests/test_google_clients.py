@@ -0,0 +1,51 @@
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+
+from app.services import google_clients
+
+
+@pytest.fixture
+def tokens(monkeypatch):
+    current = {"token": "t1"}
+    monkeypatch.setattr(google_clients, "get_fresh_token", lambda db, user_id: current["token"])
+    monkeypatch.setattr(google_clients, "service_cache", google_clients.ServiceCache())
+    return current
+
+
+def test_service_is_built_once_and_token_is_swapped_in_place(tokens):
+    first = google_clients.gmail_service(None, "1")
+    assert google_clients.gmail_service(None, "1") is first
+
+    tokens["token"] = "t2"
+    assert google_clients.gmail_service(None, "1") is first
+    assert first._http.credentials.token == "t2"
+
+    calendar = google_clients.calendar_service(None, "1")
+    assert calendar is not first
+    assert google_clients.service_cache.stats() == {"builds": 2, "hits": 2, "token_swaps": 1}
+
+
+def test_services_are_cached_per_user_and_thread(tokens):
+    service = google_clients.gmail_service(None, "1")
+    assert google_clients.gmail_service(None, "2") is not service
+
+    other = []
+    worker = threading.Thread(target=lambda: other.append(google_clients.gmail_service(None, "1")))
+    worker.start()
+    worker.join()
+    assert other[0] is not service
+
+
+def test_discovery_document_comes_from_configured_dir(tmp_path, monkeypatch):
+    (tmp_path / "gmail.v1.json").write_text('{"name": "vendored"}', encoding="utf-8")
+    monkeypatch.setattr(google_clients.settings, "GOOGLE_DISCOVERY_DIR", str(tmp_path))
+    google_clients.load_discovery_document.cache_clear()
+    try:
+        assert google_clients.load_discovery_document("gmail", "v1") == '{"name": "vendored"}'
+    finally:
+        google_clients.load_discovery_document.cache_clear()
@@ -0,0 +1,195 @@
+import asyncio
+import sys
+from base64 import urlsafe_b64encode
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models import CalendarEvent, CalendarInviteEvent, Email
+from app.services import email_processor as ep
+from app.services import ics_ingest
+from app.services.mime_body import extract_body
+
+NOW = datetime(2025, 3, 1, 9, 0)
+
+INVITE = """BEGIN:VCALENDAR\r
+METHOD:REQUEST\r
+BEGIN:VTIMEZONE\r
+TZID:Pacific Standard Time\r
+END:VTIMEZONE\r
+BEGIN:VEVENT\r
+UID:abc-123\r
+SUMMARY:Quarterly planning\\, Q2\r
+DTSTART;TZID=Pacific Standard Time:20250310T090000\r
+DTEND;TZID=Pacific Standard Time:20250310T103000\r
+LOCATION:Room 4B\r
+ATTENDEE;CN="Doe, Jane";ROLE=REQ-PARTICIPANT:mailto:jane@example.com\r
+ATTENDEE;CN=Bob:mailto:bob@example.com\r
+ \r
+BEGIN:VALARM\r
+TRIGGER:-PT15M\r
+END:VALARM\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+
+def _b64(text):
+    return urlsafe_b64encode(text.encode()).decode()
+
+
+def test_invite_times_are_converted_to_local_timezone(monkeypatch):
+    monkeypatch.setattr(ics_ingest.settings, "ICS_LOCAL_TIMEZONE", "Asia/Shanghai")
+
+    result = ics_ingest.ingest_invite([{"data": INVITE, "attachment_id": None}], None, now=NOW)
+
+    assert result["data"]["is_schedule"] is True
+    (event,) = result["data"]["events"]
+    assert event["event_name"] == "Quarterly planning, Q2"
+    # 09:00 PDT (UTC-7, DST already started on 2025-03-09) is 00:00 the next day in Shanghai
+    assert event["start_time"] == datetime(2025, 3, 11, 0, 0)
+    assert event["end_time"] == datetime(2025, 3, 11, 1, 30)
+    assert event["location"] == "Room 4B"
+    assert event["participants"] == "jane@example.com, bob@example.com"
+
+
+def test_weekly_rrule_is_expanded_with_exdate_and_count(monkeypatch):
+    monkeypatch.setattr(ics_ingest.settings, "ICS_LOCAL_TIMEZONE", "UTC")
+    text = (
+        "BEGIN:VCALENDAR\nBEGIN:VEVENT\nSUMMARY:Standup\n"
+        "DTSTART:20250303T100000Z\nDURATION:PT15M\n"
+        "RRULE:FREQ=WEEKLY;BYDAY=MO,TH;COUNT=5\n"
+        "EXDATE:20250306T100000Z\n"
+        "END:VEVENT\nEND:VCALENDAR\n"
+    )
+
+    result = ics_ingest.ingest_invite([{"data": text}], None, now=NOW)
+
+    starts = [e["start_time"] for e in result["data"]["events"]]
+    assert starts == [
+        datetime(2025, 3, 3, 10),
+        datetime(2025, 3, 10, 10),
+        datetime(2025, 3, 13, 10),
+        datetime(2025, 3, 17, 10),
+    ]
+    assert all((e["end_time"] - e["start_time"]).seconds == 900 for e in result["data"]["events"])
+
+
+def test_cancellation_stores_no_events_and_attachment_is_fetched_lazily():
+    fetched = []
+    cancel = "BEGIN:VCALENDAR\nMETHOD:CANCEL\nBEGIN:VEVENT\nSUMMARY:Sync\nDTSTART:20250310T100000Z\nEND:VEVENT\nEND:VCALENDAR\n"
+
+    def fetch(attachment_id):
+        fetched.append(attachment_id)
+        return cancel.encode()
+
+    result = ics_ingest.ingest_invite(
+        [{"data": None, "attachment_id": "att-1", "filename": "invite.ics"}], fetch, now=NOW
+    )
+
+    assert fetched == ["att-1"]
+    assert result["data"]["is_schedule"] is False
+    assert result["data"]["judge_reason"] == "Cancelled: Sync"
+    # without a UID there is nothing stored to withdraw
+    assert result["data"]["cancelled_events"] == []
+    assert ics_ingest.ingest_invite([{"data": "not a calendar"}], fetch, now=NOW) is None
+
+
+def test_walker_collects_calendar_parts_outside_the_body_text():
+    payload = {
+        "mimeType": "multipart/mixed",
+        "parts": [
+            {
+                "mimeType": "multipart/alternative",
+                "parts": [
+                    {"mimeType": "text/plain", "body": {"data": _b64("You are invited")}},
+                    {"mimeType": "text/calendar", "body": {"data": _b64(INVITE)}},
+                ],
+            },
+            {"mimeType": "application/ics", "filename": "invite.ics", "body": {"attachmentId": "att-9"}},
+        ],
+    }
+
+    body = extract_body(payload)
+
+    assert body.text == "You are invited"
+    assert [part["attachment_id"] for part in body.calendar_parts] == [None, "att-9"]
+    assert body.calendar_parts[0]["data"] == INVITE
+
+
+def test_processor_stores_invites_without_calling_the_llm(monkeypatch):
+    stored = {}
+
+    async def fail_analyze(**kwargs):
+        raise AssertionError("LLM should not be called for invites")
+
+    def fake_store(user_id, email_id, email_data, data):
+        stored[email_id] = data
+        return 1, len(data["events"])
+
+    monkeypatch.setattr(ep, "analyze_email_cached_async", fail_analyze)
+    monkeypatch.setattr(ep, "_store_analysis", fake_store)
+    email = {"id": "m1", "subject": "Invitation", "body_text": "", "calendar_parts": [{"data": INVITE}]}
+
+    outcome = asyncio.run(ep._process_message(1, "m1", asyncio.Semaphore(1), {"m1": email}))
+
+    assert outcome == (1, 1)
+    assert stored["m1"]["events"][0]["uid"] == "abc-123"
+
+
+def _invite(uid, start, method="REQUEST", extra=""):
+    return (
+        f"BEGIN:VCALENDAR\nMETHOD:{method}\nBEGIN:VEVENT\nUID:{uid}\nSUMMARY:Review\n"
+        f"DTSTART:{start}\nDURATION:PT1H\n{extra}END:VEVENT\nEND:VCALENDAR\n"
+    )
+
+
+def _store_invite(db, email_id, text):
+    result = ics_ingest.ingest_invite([{"data": text}], None, now=NOW)
+    email = {"subject": "Review", "from": "a@example.com", "body_text": ""}
+    return ep._store_email_and_events(db, 1, email_id, email, result["data"])
+
+
+def _starts(db):
+    return sorted(event.start_time for event in db.query(CalendarEvent).all())
+
+
+def test_updated_and_cancelled_invites_replace_stored_events(monkeypatch):
+    monkeypatch.setattr(ics_ingest.settings, "ICS_LOCAL_TIMEZONE", "UTC")
+    engine = create_engine("sqlite://")
+    for model in (Email, CalendarEvent, CalendarInviteEvent):
+        model.__table__.create(engine)
+    db = sessionmaker(bind=engine)()
+
+    _store_invite(db, "m1", _invite("rev-1", "20250310T100000Z"))
+    _store_invite(db, "m2", _invite("other", "20250311T100000Z"))
+    # same UID, new time: the first row is replaced, not duplicated
+    assert _store_invite(db, "m3", _invite("rev-1", "20250312T150000Z")) == (1, 1)
+    assert _starts(db) == [datetime(2025, 3, 11, 10), datetime(2025, 3, 12, 15)]
+
+    assert _store_invite(db, "m4", _invite("rev-1", "20250312T150000Z", method="CANCEL")) == (1, 0)
+    assert _starts(db) == [datetime(2025, 3, 11, 10)]
+    assert db.query(CalendarInviteEvent).count() == 1
+    db.close()
+
+
+def test_cancelled_occurrence_only_removes_that_occurrence(monkeypatch):
+    monkeypatch.setattr(ics_ingest.settings, "ICS_LOCAL_TIMEZONE", "UTC")
+    engine = create_engine("sqlite://")
+    for model in (Email, CalendarEvent, CalendarInviteEvent):
+        model.__table__.create(engine)
+    db = sessionmaker(bind=engine)()
+
+    _store_invite(db, "m1", _invite("std", "20250303T100000Z", extra="RRULE:FREQ=WEEKLY;COUNT=3\n"))
+    cancel = _invite("std", "20250310T100000Z", method="CANCEL", extra="RECURRENCE-ID:20250310T100000Z\n")
+    result = ics_ingest.ingest_invite([{"data": cancel}], None, now=NOW)
+    assert result["data"]["cancelled_events"] == [{"uid": "std", "recurrence_id": datetime(2025, 3, 10, 10)}]
+
+    _store_invite(db, "m2", cancel)
+
+    assert _starts(db) == [datetime(2025, 3, 3, 10), datetime(2025, 3, 17, 10)]
+    db.close()
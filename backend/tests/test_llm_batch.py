@@ -0,0 +1,86 @@
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import LLM
+from app.services.llm_provider import LLMProvider
+
+
+def _entry(message_id, summary="ok"):
+    return {
+        "message_id": message_id,
+        "is_spam": False,
+        "summary": summary,
+        "has_schedule": False,
+        "events": [],
+    }
+
+
+class FakeCompletions:
+    """Answers batch prompts from a script; single-email prompts always succeed."""
+
+    def __init__(self, drop_ids=()):
+        self.drop_ids = set(drop_ids)
+        self.calls = []
+
+    def create(self, model, messages, **kwargs):
+        user = messages[-1]["content"]
+        ids = [line.split(": ", 1)[1].rstrip(" =") for line in user.splitlines() if line.startswith("=== Message ID")]
+        self.calls.append(ids)
+        if ids:
+            payload = {"results": [_entry(i) for i in ids if i not in self.drop_ids]}
+        else:
+            payload = _entry(None, summary="single")
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(payload)))]
+        )
+
+
+def _install(monkeypatch, completions):
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    monkeypatch.setattr(LLM, "get_provider", lambda name=None: LLMProvider("test", "test-model", client=client))
+
+
+def _emails(n, body="hello"):
+    return [{"id": f"m{i}", "content": body, "subject": f"s{i}"} for i in range(n)]
+
+
+def test_estimate_tokens_counts_cjk_per_character():
+    assert LLM.estimate_tokens("") == 0
+    assert LLM.estimate_tokens("abcdefgh") == 2
+    assert LLM.estimate_tokens("会议通知") == 4
+
+
+def test_pack_email_batches_respects_budget_and_size():
+    emails = _emails(5, body="x" * 400)
+    batches = LLM.pack_email_batches(emails, max_batch_tokens=250, max_batch_emails=10)
+    assert [len(b) for b in batches] == [2, 2, 1]
+
+    batches = LLM.pack_email_batches(_emails(5), max_batch_tokens=10_000, max_batch_emails=3)
+    assert [len(b) for b in batches] == [3, 2]
+
+
+def test_batch_uses_one_request_for_many_emails(monkeypatch):
+    completions = FakeCompletions()
+    _install(monkeypatch, completions)
+
+    results = LLM.analyze_email_batch(_emails(4))
+
+    assert len(completions.calls) == 1
+    assert set(results) == {"m0", "m1", "m2", "m3"}
+    assert all(r["success"] for r in results.values())
+
+
+def test_batch_retries_only_missing_items(monkeypatch):
+    completions = FakeCompletions(drop_ids={"m3"})
+    _install(monkeypatch, completions)
+
+    results = LLM.analyze_email_batch(_emails(4))
+
+    # one batch request, then a single-email call for the dropped entry only
+    assert completions.calls == [["m0", "m1", "m2", "m3"], []]
+    assert results["m3"]["data"]["judge_reason"] == "single"
+    assert results["m0"]["data"]["judge_reason"] == "ok"
@@ -0,0 +1,87 @@
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+
+import LLM
+from app.services import llm_metrics
+from app.services.llm_metrics import Histogram, LLMMetrics, capture_llm_metrics
+from app.services.llm_provider import LLMProvider
+from app.services.llm_router import ModelRouter
+
+VALID = json.dumps({"is_spam": False, "summary": "ok", "has_schedule": False, "events": []})
+
+
+class ScriptedCompletions:
+    def __init__(self, replies):
+        self.replies = list(replies)
+
+    def create(self, model, messages, **kwargs):
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        usage = SimpleNamespace(prompt_tokens=300, completion_tokens=40, prompt_cache_hit_tokens=256)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=reply))], usage=usage
+        )
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    registry = LLMMetrics()
+    monkeypatch.setattr(llm_metrics, "llm_metrics", registry)
+    monkeypatch.setattr(LLM, "model_router", ModelRouter(enabled=False))
+    return registry
+
+
+def _install(monkeypatch, replies):
+    client = SimpleNamespace(chat=SimpleNamespace(completions=ScriptedCompletions(replies)))
+    provider = LLMProvider("test", "test-model", client=client)
+    provider.policy.max_retries = 0
+    monkeypatch.setattr(LLM, "get_provider", lambda name=None: provider)
+
+
+def test_histogram_percentiles_interpolate_within_buckets():
+    histogram = Histogram((1.0, 2.0, 4.0))
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(value)
+
+    assert histogram.percentile(50) == pytest.approx(1.5)
+    assert histogram.percentile(100) == pytest.approx(4.0)
+    assert histogram.cumulative() == [("1", 1), ("2", 3), ("4", 4), ("+Inf", 4)]
+    assert Histogram((1.0,)).percentile(50) is None
+
+
+def test_calls_are_recorded_per_operation_and_model(monkeypatch, metrics):
+    _install(monkeypatch, [VALID, "not json", RuntimeError("boom")])
+
+    with capture_llm_metrics() as run:
+        LLM.analyze_email("hello", "a@example.com", "hi")
+        LLM.analyze_email("hello again", "a@example.com", "hi")
+    LLM.analyze_email("outside the run", "a@example.com", "hi")
+
+    series = metrics.snapshot()["analysis:test-model"]
+    assert series["calls"] == 3
+    assert series["outcomes"] == {"ok": 2, "RuntimeError": 1}
+    assert series["parse_failures"] == 1
+    assert series["prompt_tokens"]["count"] == 2
+    assert series["cached_tokens"] == 512
+
+    run_series = run.snapshot()["analysis:test-model"]
+    assert run_series["calls"] == 2
+    assert run_series["parse_failure_rate"] == 0.5
+
+
+def test_prometheus_exposition(monkeypatch, metrics):
+    _install(monkeypatch, [VALID])
+    LLM.analyze_email("hello", "a@example.com", "hi")
+
+    text = metrics.render_prometheus()
+
+    assert 'llm_calls_total{operation="analysis",model="test-model",outcome="ok"} 1' in text
+    assert 'llm_prompt_tokens_bucket{operation="analysis",model="test-model",le="+Inf"} 1' in text
+    assert 'llm_latency_seconds_count{operation="analysis",model="test-model"} 1' in text
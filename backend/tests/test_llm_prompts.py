@@ -0,0 +1,61 @@
+import sys
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import LLM
+
+
+def test_system_prompt_prefix_is_stable_across_calls():
+    morning = LLM.build_system_prompt(LLM.ANALYSIS_SYSTEM_PROMPT, datetime(2031, 3, 4, 9, 1))
+    evening = LLM.build_system_prompt(LLM.ANALYSIS_SYSTEM_PROMPT, datetime(2031, 3, 5, 18, 42))
+
+    assert morning.startswith(LLM.ANALYSIS_SYSTEM_PROMPT)
+    assert evening.startswith(LLM.ANALYSIS_SYSTEM_PROMPT)
+    assert "2031-03-04" not in LLM.ANALYSIS_SYSTEM_PROMPT
+    assert morning.rstrip().endswith('"next week", etc.')
+    assert "- Time: 09:01" in morning[len(LLM.ANALYSIS_SYSTEM_PROMPT):]
+
+
+def test_generation_messages_keep_static_prefix():
+    messages = LLM._build_generation_messages("brief", tone="casual")
+    assert messages[0]["content"].startswith(LLM.GENERATION_SYSTEM_PROMPT)
+    assert "Tone: casual" in messages[1]["content"]
+
+
+def test_extract_usage_reads_deepseek_and_openai_cache_fields():
+    deepseek = SimpleNamespace(
+        usage=SimpleNamespace(
+            prompt_tokens=1000,
+            completion_tokens=50,
+            total_tokens=1050,
+            prompt_cache_hit_tokens=768,
+            prompt_cache_miss_tokens=232,
+        )
+    )
+    openai_style = SimpleNamespace(
+        usage=SimpleNamespace(
+            prompt_tokens=200,
+            completion_tokens=10,
+            total_tokens=210,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+        )
+    )
+
+    assert LLM.extract_usage(deepseek)["cached_tokens"] == 768
+    assert LLM.extract_usage(deepseek)["cache_hit_rate"] == 0.768
+    assert LLM.extract_usage(openai_style)["cached_tokens"] == 0
+    assert LLM.extract_usage(SimpleNamespace()) is None
+
+
+def test_prompt_cache_stats_tracks_recent_window():
+    stats = LLM.PromptCacheStats(window=2)
+    for cached in (0, 100, 100):
+        stats.record("analysis", {"prompt_tokens": 100, "cached_tokens": cached})
+
+    snapshot = stats.snapshot()["analysis"]
+    assert snapshot["calls"] == 3
+    assert snapshot["hit_rate"] == round(200 / 300, 4)
+    assert snapshot["recent_hit_rate"] == 1.0
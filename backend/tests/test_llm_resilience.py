@@ -0,0 +1,206 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import httpx
+import openai
+import pytest
+
+from app.services import llm_resilience as lr
+
+
+def _policy(**overrides):
+    values = dict(
+        total_deadline=5.0,
+        max_retries=2,
+        base_delay=0.0,
+        max_delay=0.0,
+        hedge_enabled=False,
+        hedge_percentile=95,
+        hedge_min_samples=3,
+        hedge_min_delay=0.0,
+    )
+    values.update(overrides)
+    return lr.ResiliencePolicy(**values)
+
+
+def _kwargs(policy=None, breaker=None, tracker=None):
+    return dict(
+        timeout=2.0,
+        policy=policy or _policy(),
+        breaker=breaker or lr.CircuitBreaker(failure_threshold=10, reset_timeout=60),
+        tracker=tracker or lr.LatencyTracker(),
+        stats=lr.ResilienceStats(),
+    )
+
+
+def _connection_error():
+    return openai.APIConnectionError(request=httpx.Request("POST", "http://llm.test/v1/chat/completions"))
+
+
+def test_retries_transient_errors_then_succeeds():
+    calls = []
+
+    def attempt(timeout):
+        calls.append(timeout)
+        if len(calls) < 3:
+            raise _connection_error()
+        return "ok"
+
+    kwargs = _kwargs()
+    assert lr.call_sync(attempt, **kwargs) == "ok"
+    assert len(calls) == 3
+    assert kwargs["stats"].snapshot()["retries"] == 2
+
+
+def test_non_retryable_error_is_raised_immediately():
+    calls = []
+
+    def attempt(timeout):
+        calls.append(timeout)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        lr.call_sync(attempt, **_kwargs())
+    assert len(calls) == 1
+
+
+def test_gives_up_after_max_retries():
+    def attempt(timeout):
+        raise _connection_error()
+
+    with pytest.raises(openai.APIConnectionError):
+        lr.call_sync(attempt, **_kwargs(policy=_policy(max_retries=1)))
+
+
+def test_circuit_opens_and_half_opens():
+    breaker = lr.CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+
+    def failing(timeout):
+        raise _connection_error()
+
+    for _ in range(2):
+        with pytest.raises(openai.APIConnectionError):
+            lr.call_sync(failing, **_kwargs(policy=_policy(max_retries=3), breaker=breaker))
+    assert breaker.state == "open"
+
+    with pytest.raises(lr.CircuitOpenError):
+        lr.call_sync(lambda timeout: "ok", **_kwargs(breaker=breaker))
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert lr.call_sync(lambda timeout: "ok", **_kwargs(breaker=breaker)) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_retried_attempts_of_one_call_count_as_one_failure():
+    breaker = lr.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    calls = []
+
+    def failing(timeout):
+        calls.append(timeout)
+        raise _connection_error()
+
+    with pytest.raises(openai.APIConnectionError):
+        lr.call_sync(failing, **_kwargs(policy=_policy(max_retries=3), breaker=breaker))
+
+    assert len(calls) == 4
+    assert breaker.state == "closed"
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = lr.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+
+    def failing(timeout):
+        raise _connection_error()
+
+    with pytest.raises(openai.APIConnectionError):
+        lr.call_sync(failing, **_kwargs(breaker=breaker))
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+
+    with pytest.raises(openai.APIConnectionError):
+        lr.call_sync(failing, **_kwargs(policy=_policy(max_retries=3), breaker=breaker))
+    assert breaker.state == "open"
+
+
+def test_cancelled_probe_releases_the_half_open_slot():
+    breaker = lr.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+
+    def failing(timeout):
+        raise _connection_error()
+
+    with pytest.raises(openai.APIConnectionError):
+        lr.call_sync(failing, **_kwargs(breaker=breaker))
+    time.sleep(0.06)
+
+    async def hanging(timeout):
+        await asyncio.sleep(10)
+
+    async def cancel_probe():
+        probe = asyncio.ensure_future(lr.call_async(hanging, **_kwargs(breaker=breaker)))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(cancel_probe())
+    assert breaker.state == "half_open"
+    assert lr.call_sync(lambda timeout: "ok", **_kwargs(breaker=breaker)) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_async_attempt_is_bounded_by_deadline():
+    async def slow(timeout):
+        await asyncio.sleep(1)
+
+    kwargs = _kwargs(policy=_policy(total_deadline=0.1, max_retries=5))
+    start = time.perf_counter()
+    with pytest.raises((asyncio.TimeoutError, lr.DeadlineExceededError)):
+        asyncio.run(lr.call_async(slow, **kwargs))
+    assert time.perf_counter() - start < 0.5
+
+
+def _warm_tracker(seconds=0.01, n=5):
+    tracker = lr.LatencyTracker()
+    for _ in range(n):
+        tracker.observe(seconds)
+    return tracker
+
+
+def test_async_hedge_returns_faster_second_request():
+    calls = []
+
+    async def attempt(timeout):
+        calls.append(timeout)
+        await asyncio.sleep(1 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    kwargs = _kwargs(policy=_policy(hedge_enabled=True), tracker=_warm_tracker())
+    start = time.perf_counter()
+    assert asyncio.run(lr.call_async(attempt, **kwargs)) == 2
+    assert time.perf_counter() - start < 0.5
+    assert kwargs["stats"].snapshot()["hedge_wins"] == 1
+
+
+def test_sync_hedge_returns_faster_second_request():
+    calls = []
+
+    def attempt(timeout):
+        calls.append(timeout)
+        time.sleep(0.5 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    kwargs = _kwargs(policy=_policy(hedge_enabled=True), tracker=_warm_tracker())
+    assert lr.call_sync(attempt, **kwargs) == 2
+    assert kwargs["stats"].snapshot()["hedges"] == 1
+
+
+def test_no_hedge_before_enough_samples():
+    tracker = _warm_tracker(n=2)
+    assert tracker.hedge_delay(_policy(hedge_enabled=True)) is None
+    tracker.observe(0.2)
+    assert tracker.hedge_delay(_policy(hedge_enabled=True)) == 0.2
@@ -0,0 +1,94 @@
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+
+import LLM
+from app.services import llm_router
+from app.services.llm_provider import LLMProvider
+
+VALID = json.dumps({"is_spam": False, "summary": "ok", "has_schedule": False, "events": []})
+
+
+class ModelCompletions:
+    """Replies per model: the fast model answers with broken JSON."""
+
+    def __init__(self):
+        self.models = []
+
+    def create(self, model, messages, **kwargs):
+        self.models.append(model)
+        content = "not json" if model == "small" else VALID
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+@pytest.fixture
+def routed(monkeypatch):
+    completions = ModelCompletions()
+    provider = LLMProvider("test", "big", client=SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(llm_router.settings, "LLM_FAST_PROVIDER", "")
+    monkeypatch.setattr(llm_router.settings, "LLM_FAST_MODEL", "small")
+    router = llm_router.ModelRouter(
+        enabled=True, max_fast_tokens=200, max_fast_brief_tokens=50, max_fast_time_mentions=2, sender_failure_rate=0.5
+    )
+    monkeypatch.setattr(LLM, "get_provider", lambda name=None: provider)
+    monkeypatch.setattr(LLM, "model_router", router)
+    return completions, router
+
+
+def test_small_email_uses_fast_route_and_falls_back_on_invalid_output(routed):
+    completions, router = routed
+
+    result = LLM.analyze_email("lunch at 12?", "a@example.com", "lunch")
+
+    assert result["success"]
+    assert completions.models == ["small", "big"]
+    stats = router.stats()
+    assert stats["analysis:fast"]["invalid"] == 1
+    assert stats["analysis:fast"]["fallbacks"] == 1
+    assert stats["analysis:full"]["calls"] == 1
+
+
+def test_large_or_complex_email_goes_to_full_route(routed):
+    completions, _ = routed
+
+    LLM.analyze_email("word " * 2000, "a@example.com", "newsletter")
+    LLM.analyze_email("Standup 09:00, review 11:00, retro 15:00", "a@example.com", "schedule")
+
+    assert completions.models == ["big", "big"]
+
+
+def test_sender_with_failing_history_skips_fast_route(routed):
+    completions, router = routed
+    for _ in range(3):
+        LLM.analyze_email("hi", "Bob <bob@example.com>", "x")
+    completions.models.clear()
+
+    LLM.analyze_email("hi again", "bob@example.com", "y")
+
+    assert completions.models == ["big"]
+    assert router.route_analysis("hi", "carol@example.com", 10).name == llm_router.FAST_ROUTE
+
+
+def test_routing_disabled_always_uses_full_route():
+    router = llm_router.ModelRouter(enabled=False)
+    assert router.route_analysis("hi", None, 1) is router.full_route
+    assert router.route_generation(1) is router.full_route
+
+
+def test_routing_without_a_fast_model_is_disabled(monkeypatch):
+    monkeypatch.setattr(llm_router.settings, "LLM_FAST_PROVIDER", "")
+    monkeypatch.setattr(llm_router.settings, "LLM_FAST_MODEL", "")
+    warnings = []
+    monkeypatch.setattr(llm_router.logger, "warning", lambda *args: warnings.append(args))
+
+    router = llm_router.ModelRouter(enabled=True)
+
+    assert not router.enabled
+    assert router.route_analysis("hi", None, 1) is router.full_route
+    assert router.route_generation(1) is router.full_route
+    assert len(warnings) == 1
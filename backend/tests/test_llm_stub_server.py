@@ -0,0 +1,114 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import LLM
+from app.core.config import settings
+from app.services import llm_provider
+from app.services.llm_provider import LLMProvider, MissingAPIKeyError, build_provider, request_key, run_async
+from devtools.llm_stub_server import create_app
+
+
+@pytest.fixture
+def stub_provider(monkeypatch):
+    def _install(**app_kwargs):
+        app = create_app(**app_kwargs)
+        provider = LLMProvider(
+            "local",
+            "stub-chat",
+            base_url="http://testserver/v1",
+            api_key="local",
+            http_client=TestClient(app),
+            async_http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=app)),
+            max_concurrency=4,
+        )
+        monkeypatch.setattr(LLM, "get_provider", lambda name=None: provider)
+        return provider
+
+    return _install
+
+
+def test_analysis_and_batch_use_canned_responses(stub_provider):
+    stub_provider()
+
+    result = LLM.analyze_email("See you soon", "a@b.com", "Hello")
+    assert result["success"]
+    assert result["data"]["judge_reason"] == "Stub summary of 'Hello'"
+    assert result["usage"]["prompt_tokens"] > 0
+
+    batch = LLM.analyze_email_batch([{"id": f"m{i}", "content": "hi"} for i in range(3)])
+    assert set(batch) == {"m0", "m1", "m2"}
+
+
+def test_async_analysis_runs_against_stub(stub_provider):
+    stub_provider(latency_ms=20)
+
+    async def _run():
+        return await asyncio.gather(*(LLM.analyze_email_async("hi", subject=f"s{i}") for i in range(6)))
+
+    results = asyncio.run(_run())
+    assert [r["data"]["judge_reason"] for r in results] == [f"Stub summary of 's{i}'" for i in range(6)]
+
+
+def test_generation_stream_and_recorded_replay(stub_provider):
+    messages = LLM._build_generation_messages("lunch on friday")
+    recorded = "【Email Subject】：Lunch\n【Email Content】：\nSee you Friday."
+    stub_provider(recording={request_key(messages): recorded})
+
+    events = list(LLM.generate_email_stream("lunch on friday"))
+    assert events[0] == ("subject", "Lunch")
+    kind, final = events[-1]
+    assert kind == "done"
+    assert final["content"] == "See you Friday."
+    assert final["usage"]["completion_tokens"] > 0
+
+    generated = LLM.generate_email("something else")
+    assert generated["data"]["subject"] == "Re: something else"
+
+
+def test_provider_records_exchanges_for_replay(tmp_path):
+    record_path = tmp_path / "rec.jsonl"
+    provider = LLMProvider(
+        "local",
+        "stub-chat",
+        base_url="http://testserver/v1",
+        api_key="local",
+        http_client=TestClient(create_app()),
+        record_path=str(record_path),
+    )
+    messages = [{"role": "user", "content": "ping"}]
+    provider.complete(messages)
+
+    entry = json.loads(record_path.read_text(encoding="utf-8"))
+    assert entry == {"key": request_key(messages), "content": "OK"}
+
+
+def test_missing_api_key_fails_before_any_request(monkeypatch):
+    monkeypatch.setattr(settings, "DEEPSEEK_API_KEY", "")
+    provider = build_provider("deepseek")
+
+    with pytest.raises(MissingAPIKeyError, match="DEEPSEEK_API_KEY"):
+        provider.complete([{"role": "user", "content": "ping"}])
+    with pytest.raises(MissingAPIKeyError):
+        asyncio.run(provider.acomplete([{"role": "user", "content": "ping"}]))
+
+
+def test_run_async_closes_the_clients_created_on_its_loop(monkeypatch):
+    monkeypatch.setattr(llm_provider, "_providers", {})
+    provider = LLMProvider("deepseek", "chat", base_url="http://llm.test/v1", api_key="key")
+    llm_provider.register_provider(provider)
+
+    async def use_client():
+        return provider._async_state()[0]
+
+    client = run_async(use_client())
+
+    assert client.is_closed()
+    assert len(provider._loop_state) == 0
@@ -0,0 +1,105 @@
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+
+import LLM
+from app.services import mail_merge
+from app.services.llm_provider import LLMProvider
+
+TEMPLATE = (
+    "【Email Subject】：Launch invite for {{company}}\n"
+    "【Email Content】：\nHi {{first_name}},\n\nJoin our launch on Friday.\n\nBest,\n[Your Name]\n"
+    "【Event Details】：none"
+)
+
+
+def _reply(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class TemplateCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        return _reply(TEMPLATE)
+
+
+class RefineCompletions:
+    def __init__(self):
+        self.batches = []
+
+    async def create(self, messages, **kwargs):
+        ids = [line.split(": ", 1)[1].rstrip(" =") for line in messages[1]["content"].splitlines() if line.startswith("=== Recipient ID")]
+        self.batches.append(ids)
+        return _reply(json.dumps({"results": [{"recipient_id": i, "subject": "", "content": f"Refined for {i}"} for i in ids]}))
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    template, refine = TemplateCompletions(), RefineCompletions()
+    provider = LLMProvider(
+        "test",
+        "test-model",
+        client=SimpleNamespace(chat=SimpleNamespace(completions=template)),
+        async_client=SimpleNamespace(chat=SimpleNamespace(completions=refine)),
+    )
+    monkeypatch.setattr(LLM, "get_provider", lambda name=None: provider)
+    monkeypatch.setattr(mail_merge.settings, "MAIL_MERGE_REFINE_BATCH_SIZE", 2)
+    return template, refine
+
+
+def _recipients(count, notes_every=0):
+    return [
+        SimpleNamespace(
+            id=i,
+            name=f"Person {i}",
+            email=f"p{i}@example.com",
+            company=f"Co{i}" if i % 2 else None,
+            notes="likes demos" if notes_every and i % notes_every == 0 else None,
+        )
+        for i in range(count)
+    ]
+
+
+def test_render_template_uses_fields_and_defaults():
+    fields = mail_merge.recipient_fields(SimpleNamespace(name="Ada Lovelace", company=None))
+    assert mail_merge.render_template("Hi {{first_name}} at {{ company }}{{unknown}}", fields) == (
+        "Hi Ada at your organization"
+    )
+
+
+def test_bulk_generation_renders_locally_with_one_call(fake_llm):
+    template, refine = fake_llm
+
+    result = mail_merge.generate_bulk(_recipients(200), "launch friday", "friendly", sender_name="Alice")
+
+    assert result["success"]
+    data = result["data"]
+    assert template.calls == 1 and refine.batches == []
+    assert data["llm_calls"] == 1
+    assert len(data["items"]) == 200
+    first, second = data["items"][0], data["items"][1]
+    assert first["subject"] == "Launch invite for your organization"
+    assert second["subject"] == "Launch invite for Co1"
+    assert second["body"].startswith("Hi Person,") and second["body"].endswith("Alice")
+    assert "{{" not in "".join(item["body"] for item in data["items"])
+
+
+def test_refinement_only_sends_recipients_with_notes_in_batches(fake_llm):
+    _, refine = fake_llm
+
+    result = mail_merge.generate_bulk(_recipients(10, notes_every=2), "launch friday", "friendly", refine=True)
+
+    items = result["data"]["items"]
+    assert sorted(i for batch in refine.batches for i in batch) == ["0", "2", "4", "6", "8"]
+    assert all(len(batch) <= 2 for batch in refine.batches)
+    assert result["data"]["llm_calls"] == 1 + len(refine.batches)
+    assert items[2]["body"] == "Refined for 2" and items[2]["refined"]
+    assert not items[1]["refined"]
@@ -0,0 +1,164 @@
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+from googleapiclient.errors import HttpError
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models.mailbox_sync import MailboxSyncState
+from app.services import gmail, mailbox_sync
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    MailboxSyncState.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+class FakeHistory:
+    """``users().history().list()`` over scripted pages; raises 404 when ``expired``."""
+
+    def __init__(self, pages, expired=False):
+        self.pages = pages
+        self.expired = expired
+        self.calls = []
+
+    def users(self):
+        return self
+
+    def history(self):
+        return self
+
+    def list(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.expired:
+            raise HttpError(SimpleNamespace(status=404, reason="Not Found"), b"")
+        return SimpleNamespace(execute=lambda: self.pages[kwargs.get("pageToken") or 0])
+
+
+class FakeList:
+    """``users().messages().list()`` over ``total`` ids, paged by ``maxResults``."""
+
+    def __init__(self, total):
+        self.total = total
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def list(self, **kwargs):
+        start = int(kwargs.get("pageToken") or 0)
+        end = min(start + kwargs["maxResults"], self.total)
+        result = {"messages": [{"id": str(i)} for i in range(start, end)]}
+        if end < self.total:
+            result["nextPageToken"] = str(end)
+        return SimpleNamespace(execute=lambda: result)
+
+
+def _record(history_id, *ids, labels=("INBOX", "UNREAD")):
+    return {
+        "id": history_id,
+        "messagesAdded": [{"message": {"id": i, "threadId": f"t{i}", "labelIds": list(labels)}} for i in ids],
+    }
+
+
+def test_list_history_follows_pages_and_filters_read_mail(monkeypatch):
+    service = FakeHistory(
+        {
+            0: {"history": [_record("11", "a"), _record("12", "b", labels=("INBOX",))], "nextPageToken": 1},
+            1: {"history": [_record("13", "c", "a")], "historyId": "15"},
+        }
+    )
+    monkeypatch.setattr(gmail, "gmail_service", lambda db, user_id: service)
+
+    messages, cursor = gmail.list_history(None, "1", "10", max_results=10)
+
+    assert [m["id"] for m in messages] == ["a", "c"]
+    assert cursor == "15"
+    assert service.calls[0]["startHistoryId"] == "10"
+
+
+def test_list_history_stops_at_cap_with_resumable_cursor(monkeypatch):
+    service = FakeHistory({0: {"history": [_record("11", "a", "b"), _record("12", "c")], "historyId": "20"}})
+    monkeypatch.setattr(gmail, "gmail_service", lambda db, user_id: service)
+
+    messages, cursor = gmail.list_history(None, "1", "10", max_results=2)
+
+    assert [m["id"] for m in messages] == ["a", "b"]
+    assert cursor == "11"
+
+
+def test_first_run_is_full_then_incremental(db, monkeypatch):
+    monkeypatch.setattr(gmail, "get_history_id", lambda db, user_id: "100")
+    monkeypatch.setattr(gmail, "iter_message_pages", lambda db, user_id, max_results: iter([[{"id": "old"}]]))
+    monkeypatch.setattr(gmail, "list_history", lambda db, user_id, start, max_results: ([{"id": "new"}], "105"))
+
+    first = mailbox_sync.list_new_messages(db, 1, 10)
+    assert list(first.pages) == [[{"id": "old"}]]
+    assert (first.mode, first.next_history_id) == (mailbox_sync.FULL, "100")
+    mailbox_sync.save_cursor(db, 1, first)
+
+    second = mailbox_sync.list_new_messages(db, 1, 10)
+    assert second.mode == mailbox_sync.INCREMENTAL
+    assert list(second.pages) == [[{"id": "new"}]]
+    mailbox_sync.save_cursor(db, 1, second)
+    state = mailbox_sync.get_sync_state(db, 1)
+    assert state.history_id == "105"
+    assert state.last_full_sync_at is not None
+
+
+def test_expired_cursor_and_truncated_full_listing(db, monkeypatch):
+    db.add(MailboxSyncState(user_id=1, history_id="5"))
+    db.commit()
+
+    def expired(db, user_id, start, max_results):
+        raise gmail.HistoryExpiredError(start)
+
+    monkeypatch.setattr(gmail, "list_history", expired)
+    monkeypatch.setattr(gmail, "get_history_id", lambda db, user_id: "100")
+
+    def truncated_pages(db, user_id, max_results):
+        yield [{"id": "0"}, {"id": "1"}]
+        yield [{"id": "2"}]
+        return True
+
+    monkeypatch.setattr(gmail, "iter_message_pages", truncated_pages)
+
+    batch = mailbox_sync.list_new_messages(db, 1, 3)
+
+    assert batch.mode == mailbox_sync.FULL
+    assert batch.next_history_id == "100"
+    assert sum(len(page) for page in batch.pages) == 3
+    # 全量列表被截断：不保存游标，下次继续全量
+    assert batch.next_history_id is None
+    mailbox_sync.save_cursor(db, 1, batch)
+    assert mailbox_sync.get_sync_state(db, 1).history_id == "5"
+
+
+def test_full_listing_that_exactly_fills_the_cap_stores_the_cursor(db, monkeypatch):
+    service = FakeList(total=4)
+    monkeypatch.setattr(gmail, "gmail_service", lambda db, user_id: service)
+    monkeypatch.setattr(gmail.settings, "GMAIL_LIST_PAGE_SIZE", 2)
+    monkeypatch.setattr(gmail, "get_history_id", lambda db, user_id: "100")
+
+    batch = mailbox_sync.list_new_messages(db, 1, 4)
+    assert sum(len(page) for page in batch.pages) == 4
+    # 恰好列满 max_results，但 Gmail 没有下一页，游标照常保存
+    mailbox_sync.save_cursor(db, 1, batch)
+    assert mailbox_sync.get_sync_state(db, 1).history_id == "100"
+
+    db.delete(mailbox_sync.get_sync_state(db, 1))
+    db.commit()
+    service.total = 5
+    batch = mailbox_sync.list_new_messages(db, 1, 4)
+    assert sum(len(page) for page in batch.pages) == 4
+    assert batch.next_history_id is None
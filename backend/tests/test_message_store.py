@@ -0,0 +1,107 @@
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services import gmail
+from app.services.message_store import MessageStore, view_for
+
+
+def _message(email_id, body="x"):
+    return {
+        "id": email_id,
+        "threadId": f"t-{email_id}",
+        "snippet": body[:20],
+        "payload": {"headers": [{"name": "Subject", "value": f"subject {email_id}"}], "body": {}},
+        "padding": os.urandom(2000).hex(),
+    }
+
+
+def test_round_trip_hit_ratio_and_content_addressing(tmp_path):
+    store = MessageStore(str(tmp_path / "store.sqlite3"), max_bytes=10**9)
+    message = _message("m1")
+
+    assert store.get("u1", "m1") is None
+    store.put_many("u1", {"m1": message, "m2": message})
+
+    assert store.get("u1", "m1") == message
+    assert store.get("u2", "m1") is None
+    assert set(store.get_many("u1", ["m1", "m2", "m3"])) == {"m1", "m2"}
+    stats = store.stats()
+    assert (stats["hits"], stats["misses"]) == (3, 3)
+    assert stats["hit_ratio"] == 0.5
+    # both ids point at one compressed blob
+    assert stats["messages"] == 2
+    assert stats["stored_bytes"] < 4000
+
+
+def test_least_recently_read_messages_are_evicted(tmp_path):
+    store = MessageStore(str(tmp_path / "store.sqlite3"), max_bytes=10**9)
+    store.put("u1", "m0", _message("m0"))
+    blob_size = store.stats()["stored_bytes"]
+    # room for three copies with some slack, since compressed sizes vary by a few bytes
+    store.max_bytes = int(blob_size * 3.5)
+
+    store.put("u1", "m1", _message("m1"))
+    store.put("u1", "m2", _message("m2"))
+    store.get("u1", "m0")
+    store.put("u1", "m3", _message("m3"))
+
+    assert store.get("u1", "m1") is None
+    assert store.get("u1", "m0") is not None
+    assert store.stats()["evictions"] >= 1
+    assert store.stats()["stored_bytes"] <= store.max_bytes
+
+
+def test_replaced_copy_does_not_leave_its_blob_behind(tmp_path):
+    store = MessageStore(str(tmp_path / "store.sqlite3"), max_bytes=10**9)
+    store.put("u1", "m1", _message("m1", body="old"))
+    store.put("u1", "m1", _message("m1", body="new"))
+
+    stats = store.stats()
+    assert stats["messages"] == 1
+    assert stats["stored_bytes"] < 2500
+    assert store.get("u1", "m1")["snippet"] == "new"
+
+
+def test_trimmed_copies_are_kept_apart_from_full_ones(tmp_path):
+    store = MessageStore(str(tmp_path / "store.sqlite3"), max_bytes=10**9)
+    trimmed = view_for(gmail.FULL_MESSAGE_FIELDS)
+    store.put("u1", "m1", {"id": "m1", "payload": {}}, trimmed)
+
+    assert store.get("u1", "m1") is None
+    assert store.get("u1", "m1", trimmed) == {"id": "m1", "payload": {}}
+
+    # a full copy also answers requests for a trimmed view
+    store.put("u1", "m2", _message("m2"))
+    assert store.get("u1", "m2", trimmed)["threadId"] == "t-m2"
+
+
+class FakeGet:
+    def __init__(self):
+        self.calls = []
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def get(self, userId, id, **kwargs):
+        self.calls.append(id)
+        return SimpleNamespace(execute=lambda: _message(id))
+
+
+def test_get_email_and_reply_read_from_the_store(monkeypatch):
+    service = FakeGet()
+    monkeypatch.setattr(gmail, "gmail_service", lambda db, user_id: service)
+
+    first = gmail.get_email(None, "1", "m1")
+    second = gmail.get_email(None, "1", "m1")
+
+    assert first == second
+    assert service.calls == ["m1"]
+    assert gmail._get_raw_message(None, "1", "m1")["threadId"] == "t-m1"
+    assert service.calls == ["m1"]
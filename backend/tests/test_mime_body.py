@@ -0,0 +1,104 @@
+import sys
+from base64 import urlsafe_b64encode
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services import gmail
+from app.services.mime_body import body_parse_stats, extract_body, html_to_text
+
+
+def _part(mime_type, text, charset=None, filename=""):
+    headers = []
+    if charset:
+        headers.append({"name": "Content-Type", "value": f'{mime_type}; charset="{charset}"'})
+    data = urlsafe_b64encode(text.encode(charset or "utf-8")).decode()
+    return {"mimeType": mime_type, "filename": filename, "headers": headers, "body": {"data": data}}
+
+
+def test_nested_alternative_inside_mixed_prefers_plain_and_skips_attachments():
+    payload = {
+        "mimeType": "multipart/mixed",
+        "parts": [
+            {
+                "mimeType": "multipart/alternative",
+                "parts": [_part("text/plain", "Meeting at 3pm"), _part("text/html", "<p>Meeting at <b>3pm</b></p>")],
+            },
+            _part("text/plain", "attached notes", filename="notes.txt"),
+        ],
+    }
+
+    body = extract_body(payload)
+
+    assert body.text == "Meeting at 3pm"
+    assert body.source == "text/plain"
+    assert not body.truncated
+    assert body.parse_seconds >= 0
+
+
+def test_html_only_mail_falls_back_to_text():
+    markup = (
+        "<html><head><style>p{color:red}</style></head><body>"
+        "<p>Hello&nbsp;team,</p><p>Demo on <b>Friday</b></p><script>track()</script>"
+        "<table><tr><td>Room</td><td>4B</td></tr></table></body></html>"
+    )
+    payload = {"mimeType": "multipart/alternative", "parts": [_part("text/plain", "  "), _part("text/html", markup)]}
+
+    body = extract_body(payload)
+
+    assert body.source == "text/html"
+    assert body.text == "Hello team,\nDemo on Friday\nRoom 4B"
+    assert "track()" not in html_to_text(markup)
+
+
+def test_byte_cap_limits_decoding_and_charset_is_respected():
+    huge = {"mimeType": "text/plain", "body": {"data": urlsafe_b64encode(b"x" * 100_000).decode()}}
+    capped = extract_body(huge, max_bytes=1000)
+    assert capped.text == "x" * 1000
+    assert capped.bytes_decoded == 1000
+    assert capped.truncated
+
+    latin = extract_body(_part("text/plain", "Café", charset="iso-8859-1"))
+    assert latin.text == "Café"
+
+
+def test_calendar_parts_after_an_oversized_body_are_still_collected():
+    invite = "BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nUID:u1\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n"
+    payload = {
+        "mimeType": "multipart/mixed",
+        "parts": [
+            _part("text/plain", "x" * 5000),
+            _part("text/plain", "second body part"),
+            {"mimeType": "multipart/alternative", "parts": [_part("text/calendar", invite)]},
+            _part("application/octet-stream", invite, filename="invite.ics"),
+        ],
+    }
+
+    body = extract_body(payload, max_bytes=1000)
+
+    assert body.text == "x" * 1000
+    assert body.truncated
+    assert [part["data"] for part in body.calendar_parts] == [invite, invite]
+    assert body.calendar_parts[1]["filename"] == "invite.ics"
+
+
+def test_parse_message_reports_body_metadata():
+    body_parse_stats.reset()
+    msg = {
+        "threadId": "t1",
+        "payload": {
+            "mimeType": "multipart/mixed",
+            "headers": [{"name": "Subject", "value": "hi"}],
+            "parts": [{"mimeType": "multipart/alternative", "parts": [_part("text/html", "<div>only html</div>")]}],
+        },
+    }
+
+    parsed = gmail._parse_message("m1", msg)
+
+    assert parsed["body_text"] == "only html"
+    assert parsed["body_source"] == "text/html"
+    assert parsed["body_truncated"] is False
+    stats = body_parse_stats.snapshot()
+    assert stats["messages"] == 1
+    assert stats["html_fallbacks"] == 1
+    assert stats["max_parse_ms"] >= 0
@@ -0,0 +1,237 @@
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+from googleapiclient.errors import HttpError
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+from app.models.outbox import OutboxMessage
+from app.services import outbox
+from app.services.outbox import OutboxSender, TokenBucket, enqueue_email
+
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    engine = create_engine("sqlite://")
+    OutboxMessage.__table__.create(engine)
+    monkeypatch.setattr(settings, "OUTBOX_SEND_RATE_PER_SECOND", 100.0)
+    monkeypatch.setattr(settings, "OUTBOX_SEND_BURST", 100)
+    monkeypatch.setattr(settings, "OUTBOX_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "OUTBOX_RETRY_BASE_DELAY_SECONDS", 30)
+    monkeypatch.setattr(settings, "OUTBOX_RETRY_MAX_DELAY_SECONDS", 1800)
+    return sessionmaker(bind=engine)
+
+
+class FakeSend:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = []
+
+    def __call__(self, db, user_id, to_email, subject, body, body_html=None):
+        self.calls.append((user_id, to_email, subject))
+        if len(self.calls) <= self.failures:
+            return {"success": False, "message": "quota exceeded"}
+        return {"success": True, "message_id": f"g{len(self.calls)}", "thread_id": "t1"}
+
+
+def _enqueue(session_factory, user_id=1, to_email="a@example.com"):
+    db = session_factory()
+    try:
+        return enqueue_email(db, user_id, to_email, "hello", "body").id
+    finally:
+        db.close()
+
+
+def _row(session_factory, outbox_id):
+    db = session_factory()
+    try:
+        return db.query(OutboxMessage).filter(OutboxMessage.id == outbox_id).one()
+    finally:
+        db.close()
+
+
+def _make_due(session_factory, outbox_id):
+    db = session_factory()
+    db.query(OutboxMessage).filter(OutboxMessage.id == outbox_id).update(
+        {"next_attempt_at": datetime.now(timezone.utc) - timedelta(seconds=1)}
+    )
+    db.commit()
+    db.close()
+
+
+def test_enqueued_message_is_sent_once(session_factory):
+    send = FakeSend()
+    sender = OutboxSender(send=send, session_factory=session_factory)
+    outbox_id = _enqueue(session_factory)
+
+    assert _row(session_factory, outbox_id).status == outbox.QUEUED
+    assert sender.run_once() == 1
+    assert sender.run_once() == 0
+
+    row = _row(session_factory, outbox_id)
+    assert (row.status, row.attempts, row.gmail_message_id, row.thread_id) == ("sent", 1, "g1", "t1")
+    assert row.sent_at is not None
+    assert send.calls == [("1", "a@example.com", "hello")]
+    assert sender.stats()["sent"] == 1
+
+
+def test_failed_send_backs_off_then_gives_up(session_factory):
+    send = FakeSend(failures=10)
+    sender = OutboxSender(send=send, session_factory=session_factory)
+    outbox_id = _enqueue(session_factory)
+
+    sender.run_once()
+    row = _row(session_factory, outbox_id)
+    assert (row.status, row.attempts, row.last_error) == ("queued", 1, "quota exceeded")
+    delay = row.next_attempt_at.replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)
+    assert timedelta(seconds=25) < delay <= timedelta(seconds=30)
+    # 还没到重试时间
+    assert sender.run_once() == 0
+
+    for _ in range(2):
+        _make_due(session_factory, outbox_id)
+        sender.run_once()
+
+    row = _row(session_factory, outbox_id)
+    assert (row.status, row.attempts) == ("failed", 3)
+    assert len(send.calls) == 3
+    assert sender.stats()["retried"] == 2
+    assert sender.stats()["failed"] == 1
+
+
+@pytest.mark.parametrize("status, expected", [(400, ("failed", 1)), (429, ("queued", 1)), (503, ("queued", 1))])
+def test_permanent_send_errors_fail_without_retry(session_factory, status, expected):
+    def send(db, user_id, to_email, subject, body, body_html=None):
+        raise HttpError(SimpleNamespace(status=status, reason="error"), b"Invalid To header")
+
+    sender = OutboxSender(send=send, session_factory=session_factory)
+    outbox_id = _enqueue(session_factory, to_email="not-an-address")
+
+    sender.run_once()
+    row = _row(session_factory, outbox_id)
+    assert (row.status, row.attempts) == expected
+    assert "Invalid To header" in row.last_error
+
+
+def test_backoff_is_exponential_and_capped(session_factory):
+    assert [outbox._backoff(n) for n in (1, 2, 3)] == [30, 60, 120]
+    assert outbox._backoff(20) == 1800
+
+
+def test_token_bucket_paces_per_user(session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "OUTBOX_SEND_RATE_PER_SECOND", 0.5)
+    monkeypatch.setattr(settings, "OUTBOX_SEND_BURST", 2)
+    send = FakeSend()
+    sender = OutboxSender(send=send, session_factory=session_factory)
+    ids = [_enqueue(session_factory, user_id=1) for _ in range(3)]
+    other = _enqueue(session_factory, user_id=2)
+
+    assert sender.run_once() == 3
+    assert [_row(session_factory, i).status for i in ids] == ["sent", "sent", "queued"]
+    assert _row(session_factory, other).status == "sent"
+    # 被限速的消息推迟到下一个令牌可用时，而不是算作一次失败
+    throttled = _row(session_factory, ids[2])
+    assert throttled.attempts == 0
+    assert throttled.next_attempt_at.replace(tzinfo=timezone.utc) > datetime.now(timezone.utc)
+    assert sender.stats()["throttled"] == 1
+
+
+def test_token_bucket_refills_over_time():
+    now = [0.0]
+    bucket = TokenBucket(rate=2.0, capacity=2, clock=lambda: now[0])
+
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    now[0] = 0.5
+    assert bucket.try_acquire() == 0
+
+
+def test_interrupted_sends_are_requeued(session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "OUTBOX_SENDING_LEASE_SECONDS", 300)
+    sender = OutboxSender(send=FakeSend(), session_factory=session_factory)
+    stale = _enqueue(session_factory)
+    fresh = _enqueue(session_factory)
+    db = session_factory()
+    db.query(OutboxMessage).filter(OutboxMessage.id == stale).update(
+        {"status": "sending", "updated_at": datetime.now(timezone.utc) - timedelta(minutes=10)}
+    )
+    db.query(OutboxMessage).filter(OutboxMessage.id == fresh).update({"status": "sending"})
+    db.commit()
+    db.close()
+
+    assert sender.recover_stale() == 1
+    assert _row(session_factory, stale).status == "queued"
+    assert _row(session_factory, fresh).status == "sending"
+    assert sender.run_once() == 1
+    assert _row(session_factory, stale).status == "sent"
+
+
+def test_token_bucket_is_shared_safely_between_threads():
+    bucket = TokenBucket(rate=1e-6, capacity=50)
+    granted = []
+
+    def take():
+        for _ in range(20):
+            if bucket.try_acquire() == 0:
+                granted.append(1)
+
+    threads = [threading.Thread(target=take) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(granted) == 50
+
+
+def test_stale_sends_are_recovered_while_running(session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "OUTBOX_SENDING_LEASE_SECONDS", 300)
+    now = [1000.0]
+    sender = OutboxSender(send=FakeSend(), session_factory=session_factory, clock=lambda: now[0])
+    sender._recover_if_due()
+
+    # a process that died mid-send after this sender started
+    stale = _enqueue(session_factory)
+    db = session_factory()
+    db.query(OutboxMessage).filter(OutboxMessage.id == stale).update(
+        {"status": "sending", "updated_at": datetime.now(timezone.utc) - timedelta(minutes=10)}
+    )
+    db.commit()
+    db.close()
+
+    sender._recover_if_due()
+    assert _row(session_factory, stale).status == "sending"
+    now[0] += 150
+    sender._recover_if_due()
+    assert _row(session_factory, stale).status == "queued"
+    assert sender.stats()["recovered"] == 1
+
+
+def test_notify_during_a_claim_wakes_the_next_round(session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "OUTBOX_POLL_INTERVAL_SECONDS", 30)
+    sender = OutboxSender(send=FakeSend(), session_factory=session_factory)
+    runs = []
+
+    def run_once():
+        runs.append(len(runs))
+        if len(runs) == 1:
+            # an enqueue landing while the claim query is running
+            sender.notify()
+        else:
+            sender.stop()
+        return 0
+
+    monkeypatch.setattr(sender, "run_once", run_once)
+    worker = threading.Thread(target=sender._work, daemon=True)
+    worker.start()
+    worker.join(2)
+
+    assert not worker.is_alive()
+    assert runs == [0, 1]
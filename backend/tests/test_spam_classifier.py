@@ -0,0 +1,98 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models.spam_verdict import SpamVerdict
+from app.services import spam_classifier as sc
+
+
+SPAM = [
+    ("deals@promo-blast.biz", "Limited offer: 90% off", "Click https://x.biz now to claim your prize. Unsubscribe"),
+    ("win@lucky.biz", "You won a prize", "Claim your free prize today http://lucky.biz offer ends"),
+    ("noreply@shop.biz", "限时优惠 免费领取", "点击链接领取优惠券 https://shop.biz 退订"),
+]
+HAM = [
+    ("alice@company.com", "Project sync tomorrow", "Hi Bob, can we meet at 2pm to review the roadmap?"),
+    ("bob@company.com", "Re: roadmap review", "Sounds good, I will book the meeting room."),
+    ("carol@company.com", "明天开会", "明天下午三点在三楼会议室讨论项目进度"),
+]
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    SpamVerdict.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def _docs(rows):
+    return [sc.tokenize_email(*row) for row in rows]
+
+
+def test_model_separates_spam_and_saves_roundtrip(tmp_path):
+    model = sc.SpamModel.train(_docs(SPAM + HAM), [True] * 3 + [False] * 3, n_features=1 << 12)
+
+    probabilities = model.predict_proba(
+        _docs(
+            [
+                ("offers@promo-blast.biz", "Free prize offer", "Click https://promo.biz to claim"),
+                ("dave@company.com", "Meeting tomorrow", "Can we review the roadmap at 2pm?"),
+            ]
+        )
+    )
+    assert probabilities[0] > 0.9
+    assert probabilities[1] < 0.1
+
+    path = tmp_path / "model.npz"
+    model.save(path)
+    loaded = sc.SpamModel.load(path)
+    assert loaded.samples == 6
+    assert loaded.predict_proba(_docs(SPAM)).tolist() == pytest.approx(
+        model.predict_proba(_docs(SPAM)).tolist()
+    )
+
+
+def test_train_requires_both_classes():
+    with pytest.raises(ValueError):
+        sc.SpamModel.train(_docs(SPAM), [True] * 3)
+
+
+def test_retrain_from_stored_verdicts_and_filter_counts_saved_calls(db, tmp_path):
+    for i, (sender, subject, body) in enumerate(SPAM + HAM):
+        sc.record_verdict(db, 1, f"m{i}", {"from": sender, "subject": subject, "body_text": body}, i < 3)
+    sc.record_verdict(db, 1, "m0", {"subject": "duplicate"}, False)
+    assert db.query(SpamVerdict).count() == 6
+
+    path = tmp_path / "spam.npz"
+    report = sc.retrain(db, model_path=str(path), min_samples=6, n_features=1 << 12)
+    assert report["samples"] == 6
+    assert report["train_accuracy"] == 1.0
+
+    spam_filter = sc.SpamFilter(str(path), threshold=0.9)
+    scores = spam_filter.score_batch(
+        [
+            {"from": "win@lucky.biz", "subject": "Claim your free prize", "body_text": "offer http://lucky.biz"},
+            {"from": "alice@company.com", "subject": "Roadmap", "body_text": "meet at 2pm"},
+        ]
+    )
+    assert [spam_filter.is_confident_spam(s) for s in scores] == [True, False]
+    assert spam_filter.stats()["llm_calls_saved"] == 1
+    assert spam_filter.stats()["scored"] == 2
+
+
+def test_filter_without_model_scores_none(tmp_path):
+    spam_filter = sc.SpamFilter(str(tmp_path / "missing.npz"), threshold=0.9)
+    assert spam_filter.score_batch([{"subject": "hi"}]) == [None]
+    assert spam_filter.is_confident_spam(None) is False
+
+
+def test_retrain_refuses_small_training_sets(db, tmp_path):
+    with pytest.raises(ValueError):
+        sc.retrain(db, model_path=str(tmp_path / "m.npz"), min_samples=10)